@@ -0,0 +1,448 @@
+"""
+Асинхронный движок ETL: asyncpg и aiohttp на одном цикле событий.
+
+Альтернатива потоковому движку (engine.py на psycopg2 и requests): конвейеры
+persons, genres и movies выполняются корутинами на одном цикле событий. В
+каждом конвейере извлечение идёт отдельной задачей и читает следующую
+страницу, пока предыдущие преобразуются и отправляются, а загрузчик
+(async_loader.py) держит в полёте до BULK_CONCURRENCY запросов _bulk.
+Соединения берутся из общего пула asyncpg, так что запросы разных конвейеров
+к Postgres тоже выполняются одновременно. Сборка документов — процессорная
+работа — выполняется в потоках, чтобы не задерживать цикл событий.
+
+Документы те же, что у синхронного пути: используются те же запросы
+(queries.py, параметры %(name)s переводятся в $1, $2, ...), та же сборка
+документов (transform.py), хранилище отпечатков, регуляторы размера и
+водяные знаки, включая распространение изменений справочников в movies и
+новых связей в persons. Не поддерживаются spool и режимы чтения copy и
+dimension_cache: фильмы собираются агрегацией в Postgres, справочники
+читаются серверным курсором.
+
+Нужны пакеты asyncpg и aiohttp (pip install asyncpg aiohttp); без них
+недоступен только этот движок.
+
+Запуск:
+    python etl.py --engine async
+"""
+import asyncio
+import contextlib
+import functools
+import logging
+import re
+import time
+
+try:
+    import aiohttp
+    import asyncpg
+except ImportError:  # pragma: no cover - зависит от окружения
+    aiohttp = asyncpg = None
+
+import index_schemas
+from async_loader import AsyncBulkLoader
+from config import (
+    BATCH_SIZE,
+    BULK_CONCURRENCY,
+    ITERSIZE,
+    QUEUE_SIZE,
+    index_name_film_work,
+    index_name_genre,
+    index_name_person,
+)
+from db import get_dsl
+from extract import keyset_where, row_key
+from indexes import ensure_mapping
+from metrics import queue_depth, rows_total, stage_seconds
+from pipelines import (
+    bulk_sizes,
+    bulk_transformer,
+    dead_letters,
+    log_fingerprint_stats,
+    page_sizes,
+    save_fingerprints,
+)
+from propagation import RELATED_TABLES
+from queries import (
+    CHANGED_IDS_QUERY,
+    FILM_WORK_BY_IDS_QUERY,
+    FILM_WORK_QUERY,
+    GENRE_QUERY,
+    LAST_KEY_QUERY,
+    LINKED_FILM_WORK_IDS_QUERY,
+    PERSON_BY_IDS_QUERY,
+    PERSON_LINK_CHANGES_QUERY,
+    PERSON_LINK_LAST_KEY_QUERY,
+    PERSON_QUERY,
+)
+from serializer import dumps, loads
+from transform import GENRES, MOVIES, PERSONS
+
+_DONE = object()
+
+_PARAM_RE = re.compile(r"%\((\w+)\)s|%%")
+
+
+def to_asyncpg(query, params):
+    """
+    Запрос с параметрами psycopg2 %(name)s в запрос asyncpg с $1, $2, ...
+
+    :return: запрос и список аргументов по порядку номеров
+    """
+    names = []
+
+    def replace(match):
+        name = match.group(1)
+        if name is None:
+            return "%"
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    return _PARAM_RE.sub(replace, query), [params[name] for name in names]
+
+
+async def _init_connection(connection):
+    # json и jsonb разбираются так же, как в psycopg2: в словари и списки
+    for name in ("json", "jsonb"):
+        await connection.set_type_codec(
+            name,
+            encoder=lambda value: dumps(value).decode(),
+            decoder=loads,
+            schema="pg_catalog",
+        )
+
+
+async def create_pool(size):
+    dsl = get_dsl()
+    return await asyncpg.create_pool(
+        database=dsl["dbname"],
+        user=dsl["user"],
+        password=dsl["password"],
+        host=dsl["host"],
+        port=dsl["port"],
+        min_size=1,
+        max_size=size,
+        init=_init_connection,
+    )
+
+
+async def fetch(pool, query, params):
+    sql, args = to_asyncpg(query, params)
+    return await pool.fetch(sql, *args)
+
+
+async def fetch_key(pool, query):
+    """Ключ (updated_at, id) из первой строки результата или None."""
+    row = await pool.fetchrow(query)
+    return tuple(row) if row is not None else None
+
+
+async def iter_keyset_pages(
+    pool, query, batch_size=BATCH_SIZE, after=None, params=None, controller=None
+):
+    """Постраничное чтение по ключу (updated_at, id), см. extract.iter_keyset_pages."""
+    while True:
+        if controller is not None:
+            batch_size = controller.size
+        page_params = {**(params or {}), "limit": batch_size}
+        keyset = keyset_where(after, page_params)
+        started = time.perf_counter()
+        rows = await fetch(pool, query.format(keyset=keyset), page_params)
+        if not rows:
+            return
+        if controller is not None:
+            controller.observe(time.perf_counter() - started, len(rows))
+
+        last = rows[-1]
+        after = (last["updated_at"], last["id"])
+        yield rows
+
+        if len(rows) < batch_size:
+            return
+
+
+async def iter_streaming(pool, query, after=None, itersize=ITERSIZE):
+    """Потоковое чтение серверным курсором, см. extract.iter_streaming."""
+    params = {}
+    keyset = keyset_where(after, params)
+    sql, args = to_asyncpg(query.format(keyset=keyset), params)
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            async for row in connection.cursor(sql, *args, prefetch=itersize):
+                yield row
+
+
+async def iter_batches(rows, batch_size=BATCH_SIZE, controller=None):
+    """Группировка асинхронного потока строк в списки, см. extract.iter_batches."""
+    if controller is not None:
+        batch_size = controller.size
+    batch = []
+    started = time.perf_counter()
+    async for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            if controller is not None:
+                controller.observe(time.perf_counter() - started, len(batch))
+            yield batch
+            if controller is not None:
+                batch_size = controller.size
+            batch = []
+            started = time.perf_counter()
+    if batch:
+        yield batch
+
+
+async def iter_rows_by_ids(pool, ids, query, batch_size=BATCH_SIZE):
+    ids = sorted(ids)
+    for start in range(0, len(ids), batch_size):
+        yield await fetch(pool, query, {"ids": ids[start:start + batch_size]})
+
+
+async def collect_related_film_work_ids(pool, state, index):
+    """Фильмы, связанные с изменёнными персонами и жанрами, см. propagation."""
+    film_work_ids = set()
+    last_keys = {}
+    for table, (link_table, link_column) in RELATED_TABLES.items():
+        changed = 0
+        query = CHANGED_IDS_QUERY.format(table=table)
+        linked = LINKED_FILM_WORK_IDS_QUERY.format(
+            link_table=link_table, link_column=link_column
+        )
+        after = state.get_watermark(table, index)
+        async for rows in iter_keyset_pages(pool, query, after=after):
+            ids = [str(row["id"]) for row in rows]
+            film_work_ids.update(
+                str(row["film_work_id"]) for row in await fetch(pool, linked, {"ids": ids})
+            )
+            last = rows[-1]
+            last_keys[table] = (last["updated_at"], last["id"])
+            changed += len(rows)
+        if changed:
+            logging.info(f"Изменено записей в content.{table}: {changed}")
+    logging.info(f"Фильмов для переиндексации по связям: {len(film_work_ids)}")
+    return film_work_ids, last_keys
+
+
+async def collect_relinked_person_ids(pool, state, index):
+    """Персоны с новыми связями с фильмами, см. propagation."""
+    person_ids = set()
+    last_key = None
+    after = state.get_watermark("person_film_work", index)
+    async for rows in iter_keyset_pages(pool, PERSON_LINK_CHANGES_QUERY, after=after):
+        person_ids.update(str(row["person_id"]) for row in rows)
+        last = rows[-1]
+        last_key = (last["updated_at"], last["id"])
+    if person_ids:
+        logging.info(f"Персон с новыми связями с фильмами: {len(person_ids)}")
+    return person_ids, last_key
+
+
+async def run_pipeline(batches, transform, load, queue_size=QUEUE_SIZE, stop=None, name="etl"):
+    """
+    Конвейер на корутинах, см. engine.run_pipeline.
+
+    Извлечение — отдельная задача, связанная с загрузкой очередью на
+    queue_size пачек; преобразование выполняется в потоке.
+
+    :param batches: асинхронный итератор пар (строки, checkpoint)
+    :param load: корутина (данные, checkpoint) -> None
+    :return: число обработанных строк
+    """
+    batch_queue = asyncio.Queue(maxsize=queue_size)
+
+    async def extract():
+        try:
+            started = time.perf_counter()
+            async for batch in batches:
+                stage_seconds.observe(
+                    time.perf_counter() - started, pipeline=name, stage="query"
+                )
+                await batch_queue.put(batch)
+                queue_depth.set(batch_queue.qsize(), pipeline=name, queue="load")
+                if stop is not None and stop.is_set():
+                    logging.info("Извлечение остановлено, загрузка оставшихся пачек")
+                    break
+                started = time.perf_counter()
+        finally:
+            await batches.aclose()
+        await batch_queue.put(_DONE)
+
+    async def next_batch():
+        getter = asyncio.ensure_future(batch_queue.get())
+        await asyncio.wait({getter, producer}, return_when=asyncio.FIRST_COMPLETED)
+        if not getter.done() and producer.exception() is not None:
+            getter.cancel()
+            raise producer.exception()
+        return await getter
+
+    producer = asyncio.create_task(extract())
+    processed = 0
+    try:
+        while True:
+            item = await next_batch()
+            if item is _DONE:
+                break
+            rows, checkpoint = item
+            await load(await asyncio.to_thread(transform, rows), checkpoint)
+            processed += len(rows)
+            rows_total.inc(len(rows), pipeline=name)
+            logging.info(f"{name}: обработано записей: {processed}")
+    finally:
+        if not producer.done():
+            producer.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await producer
+    return processed
+
+
+def bulk_loader(loader, state, table, index):
+    """Загрузка пачки с сохранением отпечатков и водяного знака, см. pipelines.bulk_loader."""
+
+    async def load(payload, checkpoint):
+        bulk_data, fingerprints = payload
+        callbacks = []
+        if fingerprints:
+            callbacks.append(
+                functools.partial(save_fingerprints, fingerprints, loader.rejected)
+            )
+        if checkpoint is not None:
+            callbacks.append(
+                functools.partial(state.set_watermark, table, index, checkpoint)
+            )
+
+        def on_success():
+            for callback in callbacks:
+                callback()
+
+        await loader.submit(bulk_data, on_success if callbacks else None)
+
+    return load
+
+
+async def run_index(session, state, table, schema, batches, stop):
+    index = schema["index"]
+    await asyncio.to_thread(ensure_mapping, index, index_schemas.BY_INDEX[index])
+    async with AsyncBulkLoader(
+        session, controller=bulk_sizes[index], dead_letters=dead_letters, name=index
+    ) as loader:
+        processed = await run_pipeline(
+            batches,
+            bulk_transformer(schema),
+            bulk_loader(loader, state, table, index),
+            stop=stop,
+            name=index,
+        )
+    log_fingerprint_stats(index)
+    return processed
+
+
+async def load_persons(pool, session, state, stop=None):
+    """Выгрузка изменённых персон и персон с новыми связями, см. pipelines.load_persons."""
+    watermark = state.get_watermark("person", index_name_person)
+    if watermark is None:
+        related_ids, link_key = set(), await fetch_key(pool, PERSON_LINK_LAST_KEY_QUERY)
+    else:
+        related_ids, link_key = await collect_relinked_person_ids(
+            pool, state, index_name_person
+        )
+
+    async def batches():
+        rows = iter_streaming(pool, PERSON_QUERY, after=watermark)
+        async for datas in iter_batches(rows, BATCH_SIZE, page_sizes[index_name_person]):
+            related_ids.difference_update(str(data["id"]) for data in datas)
+            yield datas, row_key(datas[-1])
+        if related_ids:
+            logging.info(f"Переиндексация персон по связям: {len(related_ids)}")
+        async for datas in iter_rows_by_ids(pool, related_ids, PERSON_BY_IDS_QUERY):
+            yield datas, None
+
+    processed = await run_index(session, state, "person", PERSONS, batches(), stop)
+    if link_key is not None and (stop is None or not stop.is_set()):
+        state.set_watermark("person_film_work", index_name_person, link_key)
+    return processed
+
+
+async def load_genres(pool, session, state, stop=None):
+    """Выгрузка изменённых жанров, см. pipelines.load_genres."""
+    watermark = state.get_watermark("genre", index_name_genre)
+
+    async def batches():
+        rows = iter_streaming(pool, GENRE_QUERY, after=watermark)
+        async for datas in iter_batches(rows, BATCH_SIZE, page_sizes[index_name_genre]):
+            yield datas, row_key(datas[-1])
+
+    return await run_index(session, state, "genre", GENRES, batches(), stop)
+
+
+async def load_film_works(pool, session, state, stop=None):
+    """Выгрузка изменённых и затронутых связями фильмов, см. pipelines.load_film_works."""
+    watermark = state.get_watermark("film_work", index_name_film_work)
+    if watermark is None:
+        related_ids = set()
+        related_keys = {
+            table: await fetch_key(pool, LAST_KEY_QUERY.format(table=table))
+            for table in RELATED_TABLES
+        }
+    else:
+        related_ids, related_keys = await collect_related_film_work_ids(
+            pool, state, index_name_film_work
+        )
+
+    async def batches():
+        pages = iter_keyset_pages(
+            pool,
+            FILM_WORK_QUERY,
+            after=watermark,
+            controller=page_sizes[index_name_film_work],
+        )
+        async for datas in pages:
+            related_ids.difference_update(str(data["id"]) for data in datas)
+            yield datas, row_key(datas[-1])
+        logging.info(f"Переиндексация фильмов по связям: {len(related_ids)}")
+        async for datas in iter_rows_by_ids(pool, related_ids, FILM_WORK_BY_IDS_QUERY):
+            yield datas, None
+
+    processed = await run_index(session, state, "film_work", MOVIES, batches(), stop)
+    if stop is None or not stop.is_set():
+        for table, key in related_keys.items():
+            if key is not None:
+                state.set_watermark(table, index_name_film_work, key)
+    return processed
+
+
+JOBS = {
+    index_name_person: load_persons,
+    index_name_genre: load_genres,
+    index_name_film_work: load_film_works,
+}
+
+
+async def run(state, indexes=tuple(JOBS), stop=None):
+    """
+    Выгрузка индексов indexes конкурентно на одном цикле событий.
+
+    Ошибка одного конвейера логируется и не прерывает остальные.
+    :return: словарь индекс -> число выгруженных записей (None при ошибке)
+    """
+    if asyncpg is None or aiohttp is None:
+        raise RuntimeError("Для асинхронного движка нужны пакеты asyncpg и aiohttp")
+    # Каждому конвейеру — соединение под курсор или страницу и одно для
+    # запросов по id и распространения изменений
+    pool = await create_pool(2 * len(indexes))
+    try:
+        connector = aiohttp.TCPConnector(limit=BULK_CONCURRENCY * len(indexes))
+        async with aiohttp.ClientSession(connector=connector) as session:
+            results = await asyncio.gather(
+                *(JOBS[index](pool, session, state, stop) for index in indexes),
+                return_exceptions=True,
+            )
+    finally:
+        await pool.close()
+
+    processed = {}
+    for index, result in zip(indexes, results):
+        if isinstance(result, BaseException):
+            logging.error(f"{index}: ошибка выгрузки: {result}")
+            processed[index] = None
+        else:
+            processed[index] = result
+    return processed
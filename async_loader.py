@@ -0,0 +1,188 @@
+"""
+Асинхронная загрузка в Elasticsearch через _bulk на aiohttp.
+
+AsyncBulkLoader — аналог loader.BulkLoader для асинхронного движка
+(async_engine.py): та же нарезка запросов по числу документов и байтам, те
+же повторы отклонённых документов с экспоненциальной задержкой и jitter,
+пауза между запросами при отказах 429, регулятор размера и файл
+недоставленных. Вместо пула потоков до concurrency запросов в полёте
+ограничивает семафор, а обработчики успешной записи по-прежнему вызываются
+строго в порядке отправки. Нарезка, порядок обработчиков, разбор ответа и
+повторы (loader.bulk_retry) — общие с loader.py; запись в файл недоставленных (с
+fsync) выполняется в пуле потоков, чтобы не блокировать цикл событий.
+"""
+import asyncio
+import logging
+import time
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - зависит от окружения
+    aiohttp = None
+
+from config import (
+    BULK_CONCURRENCY,
+    BULK_GZIP_LEVEL,
+    BULK_MAX_BYTES,
+    BULK_MAX_DOCS,
+    BULK_TIMEOUT,
+    ELASTICSEARCH_URL,
+    ES_CONNECT_TIMEOUT,
+)
+from loader import (
+    BulkBatcher,
+    BulkRejected,
+    DocumentsRejected,
+    Throttle,
+    bulk_retry,
+    handle_response,
+    is_retryable,
+    is_throttled,
+    join_documents,
+    report_failures,
+)
+from metrics import bulk_bytes_total, stage_seconds
+from serializer import compress, loads
+
+# Ошибки, при которых запрос _bulk повторяется, как при недоступности ES
+CONNECTION_ERRORS = (aiohttp.ClientConnectionError, asyncio.TimeoutError) if aiohttp else ()
+
+
+class AsyncThrottle(Throttle):
+    """Throttle, ожидание которого не блокирует цикл событий."""
+
+    async def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            send_at = max(now, self.next_send)
+            self.next_send = send_at + self.delay
+        if send_at > now:
+            await asyncio.sleep(send_at - now)
+
+
+class AsyncBulkLoader:
+    """
+    Асинхронный загрузчик _bulk, см. loader.BulkLoader.
+
+    session — общая aiohttp.ClientSession; загрузчик её не закрывает.
+    """
+
+    def __init__(
+        self,
+        session,
+        url=ELASTICSEARCH_URL,
+        max_docs=BULK_MAX_DOCS,
+        max_bytes=BULK_MAX_BYTES,
+        concurrency=BULK_CONCURRENCY,
+        gzip_level=BULK_GZIP_LEVEL,
+        controller=None,
+        dead_letters=None,
+        name="bulk",
+    ):
+        self.session = session
+        self.url = f"{url}/_bulk"
+        self.name = name
+        self.controller = controller
+        self.dead_letters = dead_letters
+        self.batcher = BulkBatcher(max_docs, max_bytes, controller)
+        self.gzip_level = gzip_level
+        self.headers = {"Content-Type": "application/x-ndjson"}
+        self.timeout = aiohttp.ClientTimeout(
+            sock_connect=ES_CONNECT_TIMEOUT, sock_read=BULK_TIMEOUT
+        )
+        if gzip_level:
+            self.headers["Content-Encoding"] = "gzip"
+        # Не больше concurrency запросов в полёте: submit ждёт (backpressure)
+        self.slots = asyncio.Semaphore(concurrency)
+        self.throttle = AsyncThrottle()
+        self.failed = 0
+        self.rejected = set()
+
+    async def submit(self, bulk_data, on_success=None):
+        """
+        Добавление пачки документов _bulk в очередь отправки.
+
+        Выбрасывает исключение, если один из ранее отправленных запросов завершился ошибкой.
+        """
+        for request in self.batcher.add(bulk_data, on_success):
+            await self._dispatch(*request)
+        await self._drain(block=False)
+
+    async def flush(self):
+        """Отправка остатка и ожидание подтверждения всех запросов."""
+        request = self.batcher.take()
+        if request is not None:
+            await self._dispatch(*request)
+        await self._drain(block=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.flush()
+            return
+        pending = self.batcher.pending
+        for task, _ in pending:
+            task.cancel()
+        await asyncio.gather(*(task for task, _ in pending), return_exceptions=True)
+
+    async def _dispatch(self, body, offsets, callbacks):
+        await self.slots.acquire()
+        task = asyncio.create_task(self._send([body, offsets]))
+        task.add_done_callback(lambda _: self.slots.release())
+        self.batcher.pending.append((task, callbacks))
+
+    async def _drain(self, block):
+        pending = self.batcher.pending
+        while pending:
+            task, callbacks = pending[0]
+            if not block and not task.done():
+                return
+            await task
+            pending.popleft()
+            for callback in callbacks:
+                callback()
+
+    @bulk_retry(*CONNECTION_ERRORS)
+    async def _send(self, request):
+        """Попытка отправки документов request = [тело, смещения], см. BulkLoader._send."""
+        body, offsets = request
+        logging.debug(f"Отправка в _bulk: {len(offsets)} документов, {len(body)} байт")
+        data = compress(body, self.gzip_level) if self.gzip_level else body
+        result = await self._post(data)
+        retry, failures = handle_response(result, body, offsets, self.throttle)
+        if failures:
+            # Файл недоставленных пишется с fsync: не в цикле событий
+            failed = await asyncio.get_running_loop().run_in_executor(
+                None, report_failures, failures, self.dead_letters, self.rejected
+            )
+            self.failed += failed
+        if retry:
+            request[:] = join_documents(retry)
+            raise DocumentsRejected(f"отклонено документов: {len(retry)}")
+
+    async def _post(self, body):
+        await self.throttle.wait()
+        started = time.perf_counter()
+        async with self.session.post(
+            self.url, data=body, headers=self.headers, timeout=self.timeout
+        ) as response:
+            content = await response.read()
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, pipeline=self.name, stage="bulk")
+        bulk_bytes_total.inc(len(body), pipeline=self.name)
+        size = len(body) + len(content)
+        if is_retryable(response.status):
+            if response.status == 429:
+                self.throttle.slow_down()
+            self._observe(elapsed, size, throttled=response.status == 429)
+            raise BulkRejected(f"{response.status}: {content[:200].decode(errors='replace')}")
+        response.raise_for_status()
+        result = loads(content)
+        self._observe(elapsed, size, is_throttled(result), len(result["items"]))
+        return result
+
+    def _observe(self, elapsed, size, throttled, count=0):
+        if self.controller is not None:
+            self.controller.observe(elapsed, count, size, throttled)
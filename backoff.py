@@ -1,14 +1,37 @@
 from functools import wraps
+import asyncio
+import inspect
 import logging
+import random
 import time
 
 
+def backoff_delays(start_sleep_time=0.1, factor=2, border_sleep_time=10, jitter=False):
+    """
+    Бесконечная последовательность задержек перед повторами.
+
+    Формула:
+        t = start_sleep_time * (factor ^ n), если t < border_sleep_time
+        t = border_sleep_time, иначе
+    С jitter=True вместо t берётся случайное значение из [0, t] ("full jitter"),
+    чтобы одновременно упавшие клиенты не повторяли запросы синхронно.
+    """
+    current_sleep_time = start_sleep_time
+    while True:
+        yield random.uniform(0, current_sleep_time) if jitter else current_sleep_time
+        current_sleep_time = min(current_sleep_time * factor, border_sleep_time)
+
+
 def backoff(
     start_sleep_time=0.1,
     factor=2,
     border_sleep_time=10,
     max_iter=10,
     exception_type=Exception,
+    jitter=False,
+    deadline=None,
+    policies=None,
+    reraise=False,
 ):
     """
     Функция для повторного выполнения функции через некоторое время, если возникла ошибка.
@@ -17,28 +40,99 @@ def backoff(
     Формула:
         t = start_sleep_time * (factor ^ n), если t < border_sleep_time
         t = border_sleep_time, иначе
+    Декорировать можно и корутину: тогда пауза выполняется через asyncio.sleep.
     :param start_sleep_time: начальное время ожидания
     :param factor: во сколько раз нужно увеличивать время ожидания на каждой итерации
     :param border_sleep_time: максимальное время ожидания
+    :param max_iter: максимальное число попыток; None — без ограничения (до deadline)
+    :param exception_type: исключение (или кортеж исключений), при котором выполняется повтор
+    :param jitter: случайное время ожидания в пределах [0, t]
+    :param deadline: общее время в секундах, после которого повторы прекращаются
+    :param policies: отдельные параметры повтора для типов исключений, например
+        {TimeoutError: {"max_iter": 3}}; max_iter=1 означает «не повторять»
+    :param reraise: после последней неудачной попытки выбросить исключение,
+        а не вернуть None
     :return: результат выполнения функции
     """
+    policies = policies or {}
+    default_policy = {
+        "start_sleep_time": start_sleep_time,
+        "factor": factor,
+        "border_sleep_time": border_sleep_time,
+        "max_iter": max_iter,
+    }
+    if not isinstance(exception_type, tuple):
+        exception_type = (exception_type,)
+    retry_on = exception_type + tuple(policies)
+
+    def retries(name):
+        """Пауза перед повтором после ошибки или None, если попытки исчерпаны."""
+        started = time.monotonic()
+        iter_counts = {}
+        delays = {}
+
+        def next_sleep(e):
+            policy_type = next((t for t in policies if isinstance(e, t)), None)
+            policy = {**default_policy, **policies.get(policy_type, {})}
+            iter_counts[policy_type] = iter_counts.get(policy_type, 0) + 1
+            if policy_type not in delays:
+                delays[policy_type] = backoff_delays(
+                    policy["start_sleep_time"],
+                    policy["factor"],
+                    policy["border_sleep_time"],
+                    jitter,
+                )
+            sleep_time = next(delays[policy_type])
+
+            exhausted = (
+                policy["max_iter"] is not None
+                and iter_counts[policy_type] >= policy["max_iter"]
+            )
+            if deadline is not None:
+                remaining = deadline - (time.monotonic() - started)
+                exhausted = exhausted or remaining <= sleep_time
+            if exhausted:
+                logging.error(f"{name}: попытки исчерпаны, последняя ошибка: {e}.")
+                return None
+
+            logging.error(f"{name}: ошибка {e}.")
+            logging.info(f"Повторная попытка через {sleep_time:.2f} с.")
+            return sleep_time
+
+        return next_sleep
 
     def func_wrapper(func):
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_inner(*args, **kwargs):
+                next_sleep = retries(func.__name__)
+                while True:
+                    try:
+                        return await func(*args, **kwargs)
+                    except retry_on as e:
+                        sleep_time = next_sleep(e)
+                        if sleep_time is None:
+                            if reraise:
+                                raise
+                            return None
+                        await asyncio.sleep(sleep_time)
+
+            return async_inner
+
         @wraps(func)
         def inner(*args, **kwargs):
-            current_sleep_time = start_sleep_time
-            iter_count = 0
-            while iter_count < max_iter:
+            next_sleep = retries(func.__name__)
+            while True:
                 try:
-                    iter_count += 1
                     return func(*args, **kwargs)
-                except exception_type as e:
-                    logging.error(f"Подключиться не удалось: {e}.")
-                    logging.info("Повторное подключение.")
-                    time.sleep(current_sleep_time)
-                    current_sleep_time *= factor
-                    if current_sleep_time > border_sleep_time:
-                        current_sleep_time = border_sleep_time
+                except retry_on as e:
+                    sleep_time = next_sleep(e)
+                    if sleep_time is None:
+                        if reraise:
+                            raise
+                        return None
+                    time.sleep(sleep_time)
 
         return inner
 
@@ -0,0 +1,123 @@
+"""
+Бенчмарк полной выгрузки: серверный курсор с DictCursor против COPY TO STDOUT.
+
+Персоны читаются из синтетической таблицы bench.person (та же, что в
+streaming_memory), фильмы — из content.film_work запросами выгрузки movies.
+Оба пути доводят строки до готовых NDJSON-пачек (без отправки в
+Elasticsearch); замеряются строк в секунду и время CPU процесса. Для фильмов
+дополнительно проверяется, что оба пути дают одинаковые документы.
+
+Запуск из корня репозитория:
+    python -m benchmarks.copy_extract --rows 1000000 --repeat 3
+"""
+import argparse
+import json
+import sys
+import time
+
+from benchmarks.streaming_memory import BENCH_QUERY, prepare_table
+from config import BATCH_SIZE
+from copy_extract import iter_copy
+from db import get_connection
+from extract import iter_batches, iter_keyset_pages, iter_streaming
+from pipelines import film_works_bulk_data, persons_bulk_data
+from queries import (
+    FILM_WORK_COPY_COLUMNS,
+    FILM_WORK_COPY_QUERY,
+    FILM_WORK_QUERY,
+    PERSON_COLUMNS,
+)
+
+
+def person_batches(connection, mode, rows):
+    query = BENCH_QUERY.format(rows=rows)
+    if mode == "copy":
+        source = iter_copy(connection, query, PERSON_COLUMNS, json_columns=("films",))
+    else:
+        source = iter_streaming(connection, query)
+    return iter_batches(source, BATCH_SIZE)
+
+
+def film_batches(connection, mode, rows):
+    if mode == "copy":
+        source = iter_copy(
+            connection,
+            FILM_WORK_COPY_QUERY,
+            FILM_WORK_COPY_COLUMNS,
+            json_columns=("persons", "genres"),
+        )
+        return iter_batches(source, BATCH_SIZE)
+    return iter_keyset_pages(connection, FILM_WORK_QUERY)
+
+
+def run(connection, batches, to_bulk_data, keep):
+    """Выгрузка до NDJSON; при keep=True возвращаются и сами документы."""
+    count = 0
+    size = 0
+    documents = []
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    for datas in batches:
+        bulk_data = to_bulk_data(datas)
+        count += len(datas)
+        size += sum(map(len, bulk_data))
+        if keep:
+            documents.extend(bulk_data)
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    connection.rollback()
+    return {"rows": count, "bytes": size, "seconds": wall, "cpu_seconds": cpu}, documents
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-films", action="store_true")
+    parser.add_argument("--json", action="store_true", help="вывести результаты в JSON")
+    args = parser.parse_args()
+
+    cases = [("persons", person_batches, persons_bulk_data)]
+    if not args.skip_films:
+        cases.append(("movies", film_batches, film_works_bulk_data))
+
+    connection = get_connection()
+    results = []
+    try:
+        prepare_table(connection, args.rows)
+        for name, batches, to_bulk_data in cases:
+            outputs = {}
+            for mode in ("cursor", "copy"):
+                best = None
+                for _ in range(args.repeat):
+                    result, documents = run(
+                        connection,
+                        batches(connection, mode, args.rows),
+                        to_bulk_data,
+                        keep=name == "movies",
+                    )
+                    if best is None or result["seconds"] < best["seconds"]:
+                        best = result
+                outputs[mode] = documents
+                best.update(
+                    case=name, mode=mode, rows_per_second=best["rows"] / best["seconds"]
+                )
+                results.append(best)
+            if name == "movies" and outputs["cursor"] != outputs["copy"]:
+                print("ВНИМАНИЕ: документы movies в режимах различаются", file=sys.stderr)
+    finally:
+        connection.close()
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        return
+    print(f"{'case':>8} {'mode':>7} {'rows':>10} {'rows/s':>12} {'cpu, s':>8}")
+    for result in results:
+        print(
+            f"{result['case']:>8} {result['mode']:>7} {result['rows']:>10} "
+            f"{result['rows_per_second']:>12.0f} {result['cpu_seconds']:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Бенчмарк сборки документов movies: агрегация в SQL против кэша справочников.
+
+Читает из схемы content первые --pages страниц фильмов в каждом режиме и
+преобразует их в NDJSON (без отправки в Elasticsearch). Выводит время прогрева
+кэша, среднее время страницы и число документов в секунду, чтобы выбрать режим
+ETL_FILM_EXTRACT_MODE для конкретной базы.
+
+Запуск из корня репозитория:
+    python -m benchmarks.dimension_cache --pages 200
+"""
+import argparse
+import itertools
+import time
+
+from db import get_connection
+from dimensions import dimension_cache
+from pipelines import film_works_bulk_data, iter_film_work_batches
+
+
+def run(connection, mode, pages):
+    started = time.perf_counter()
+    if mode == "dimension_cache":
+        dimension_cache.refresh(connection)
+    warmup = time.perf_counter() - started
+
+    docs = 0
+    page_times = []
+    batches = iter_film_work_batches(connection, None, set(), mode=mode)
+    page_started = time.perf_counter()
+    for datas, _ in itertools.islice(batches, pages):
+        film_works_bulk_data(datas)
+        docs += len(datas)
+        now = time.perf_counter()
+        page_times.append(now - page_started)
+        page_started = now
+    batches.close()
+    return warmup, docs, page_times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=200)
+    args = parser.parse_args()
+
+    connection = get_connection()
+    try:
+        print(f"{'mode':>16} {'warmup, s':>10} {'docs':>8} {'page, ms':>10} {'docs/s':>10}")
+        for mode in ("sql", "dimension_cache"):
+            warmup, docs, page_times = run(connection, mode, args.pages)
+            total = sum(page_times)
+            page_ms = total / len(page_times) * 1000 if page_times else 0
+            rate = docs / total if total else 0
+            print(f"{mode:>16} {warmup:>10.2f} {docs:>8} {page_ms:>10.2f} {rate:>10.0f}")
+            connection.rollback()
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
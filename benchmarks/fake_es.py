@@ -0,0 +1,238 @@
+"""
+Локальная замена Elasticsearch для бенчмарков: _bulk и управление маппингами.
+
+Сервер принимает POST /_bulk (в том числе с Content-Encoding: gzip), считает
+документы и байты, запоминает время обработки каждого запроса и дайджест
+последней записанной версии каждого документа (чтобы сравнивать результат
+разных движков) и отвечает в формате Elasticsearch. Можно добавить задержку ответа, отказ всего запроса
+с 429 и частичные отказы отдельных документов (429 или 400).
+
+Создание индекса (PUT /<индекс>), его маппинг (GET и PUT /<индекс>/_mapping)
+и проверка существования (HEAD /<индекс>) поддерживаются настолько, насколько
+это нужно indexes.ensure_mapping и export.ensure_index: маппинги хранятся в
+памяти, документы по ним не проверяются.
+
+Запуск отдельно:
+    python -m benchmarks.fake_es --port 9201 --latency 0.02 --reject-rate 0.05
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class BulkStats:
+    """Статистика принятых запросов _bulk."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.rejected = 0
+            self.docs = 0
+            self.failed_docs = 0
+            self.bytes = 0
+            self.latencies = []
+            # (индекс, id) -> дайджест тела документа
+            self.documents = {}
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "rejected_requests": self.rejected,
+                "docs": self.docs,
+                "unique_docs": len(self.documents),
+                "failed_docs": self.failed_docs,
+                "bytes": self.bytes,
+                "latencies": list(self.latencies),
+            }
+
+    def digests(self):
+        with self.lock:
+            return dict(self.documents)
+
+
+class FakeElasticsearch(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port,
+        latency=0.0,
+        reject_rate=0.0,
+        item_retry_rate=0.0,
+        item_error_rate=0.0,
+        seed=0,
+    ):
+        super().__init__(("127.0.0.1", port), _BulkHandler)
+        self.latency = latency
+        self.reject_rate = reject_rate
+        self.item_retry_rate = item_retry_rate
+        self.item_error_rate = item_error_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.stats = BulkStats()
+        # Индекс -> properties маппинга
+        self.mappings = {}
+        self.mappings_lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def roll(self, rate):
+        with self.random_lock:
+            return rate and self.random.random() < rate
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-es", daemon=True).start()
+        return self
+
+
+class _BulkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        index, endpoint = self._target()
+        if endpoint == "_mapping":
+            with self.server.mappings_lock:
+                properties = self.server.mappings.get(index)
+            if properties is None:
+                self._reply(404, {"error": {"type": "index_not_found_exception"}, "status": 404})
+            else:
+                self._reply(200, {index: {"mappings": {"properties": dict(properties)}}})
+            return
+        self._reply(200, {"name": "fake-es", "version": {"number": "8.0.0"}})
+
+    def do_HEAD(self):
+        index, _ = self._target()
+        with self.server.mappings_lock:
+            exists = index in self.server.mappings
+        self.send_response(200 if exists else 404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        payload = json.loads(body) if body else {}
+        index, endpoint = self._target()
+        server = self.server
+        with server.mappings_lock:
+            if endpoint == "_mapping":
+                if index not in server.mappings:
+                    status = 404
+                else:
+                    server.mappings[index].update(payload.get("properties", {}))
+                    status = 200
+            elif endpoint is None and index:
+                if index in server.mappings:
+                    status = 400
+                else:
+                    mappings = payload.get("mappings", {})
+                    server.mappings[index] = dict(mappings.get("properties", {}))
+                    status = 200
+            else:
+                status = 404
+        if status == 200:
+            self._reply(200, {"acknowledged": True})
+        elif status == 400:
+            error = {"type": "resource_already_exists_exception"}
+            self._reply(400, {"error": error, "status": 400})
+        else:
+            self._reply(404, {"error": {"type": "index_not_found_exception"}, "status": 404})
+
+    def _target(self):
+        """Индекс и конечная точка (_mapping или None) из пути запроса."""
+        parts = self.path.split("?", 1)[0].strip("/").split("/")
+        return parts[0], parts[1] if len(parts) > 1 else None
+
+    def do_POST(self):
+        started = time.perf_counter()
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        if not self.path.split("?", 1)[0].endswith("_bulk"):
+            self._reply(404, {"error": "only _bulk is supported"})
+            return
+        if server.latency:
+            time.sleep(server.latency)
+        if server.roll(server.reject_rate):
+            with server.stats.lock:
+                server.stats.rejected += 1
+            self._reply(429, {"error": {"type": "es_rejected_execution_exception"}, "status": 429})
+            return
+
+        lines = body.split(b"\n")
+        items = []
+        ok_docs = {}
+        for i in range(0, len(lines) - 1, 2):
+            action = json.loads(lines[i])["index"]
+            if server.roll(server.item_retry_rate):
+                status, error = 429, {"type": "es_rejected_execution_exception"}
+            elif server.roll(server.item_error_rate):
+                status, error = 400, {"type": "mapper_parsing_exception", "reason": "fake"}
+            else:
+                status, error = 201, None
+                key = (action.get("_index"), action.get("_id"))
+                ok_docs[key] = hashlib.blake2b(lines[i + 1], digest_size=8).hexdigest()
+            item = {"_index": action.get("_index"), "_id": action.get("_id"), "status": status}
+            if error:
+                item["error"] = error
+            items.append({"index": item})
+
+        stats = server.stats
+        with stats.lock:
+            stats.requests += 1
+            stats.docs += len(ok_docs)
+            stats.failed_docs += len(items) - len(ok_docs)
+            stats.bytes += len(body)
+            stats.documents.update(ok_docs)
+            stats.latencies.append(time.perf_counter() - started)
+        self._reply(200, {
+            "took": 1,
+            "errors": len(ok_docs) != len(items),
+            "items": items,
+        })
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=9201)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, с")
+    parser.add_argument("--reject-rate", type=float, default=0.0, help="доля запросов с 429")
+    parser.add_argument("--item-retry-rate", type=float, default=0.0, help="доля документов с 429")
+    parser.add_argument("--item-error-rate", type=float, default=0.0, help="доля документов с 400")
+    args = parser.parse_args()
+
+    server = FakeElasticsearch(
+        args.port, args.latency, args.reject_rate, args.item_retry_rate, args.item_error_rate
+    )
+    print(f"Fake Elasticsearch на {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps({k: v for k, v in server.stats.snapshot().items() if k != "latencies"}))
+
+
+if __name__ == "__main__":
+    main()
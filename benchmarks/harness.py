@@ -0,0 +1,237 @@
+"""
+Сквозной бенчмарк конвейеров на синтетических данных.
+
+Заполняет схему content генератором benchmarks.synthetic (пропускается с
+--skip-generate), поднимает benchmarks.fake_es вместо Elasticsearch и
+прогоняет полную выгрузку persons, genres и movies, каждую в отдельном
+процессе с чистым состоянием, каждым движком из --engines (sync — engine.py,
+async — async_engine.py). Для каждого конвейера сообщает документы в
+секунду, p50/p99 времени обработки запросов _bulk (на стороне fake ES, с
+учётом --latency) и пиковый RSS процесса; если движков несколько, проверяет,
+что они записали одинаковые документы. Результаты вместе с параметрами
+запуска сохраняются в JSON, чтобы сравнивать их между коммитами.
+
+Запуск из корня репозитория (данные в content будут перезаписаны):
+    python -m benchmarks.harness --films 100000 --persons 50000 --reset
+    python -m benchmarks.harness --skip-generate --latency 0.05 --reject-rate 0.02
+    python -m benchmarks.harness --skip-generate --engines sync async
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import subprocess
+import tempfile
+import time
+import traceback
+from datetime import datetime, timezone
+
+from benchmarks.fake_es import FakeElasticsearch
+from benchmarks.synthetic import add_arguments, generate
+
+PIPELINES = ("persons", "genres", "movies")
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run_sync(pipeline, state):
+    from db import get_connection
+    from pipelines import load_film_works, load_genres, load_persons
+
+    load = {
+        "persons": load_persons,
+        "genres": load_genres,
+        "movies": load_film_works,
+    }[pipeline]
+    connection = get_connection()
+    try:
+        return load(connection, state)
+    finally:
+        connection.close()
+
+
+def run_async(pipeline, state):
+    from async_engine import run
+
+    return asyncio.run(run(state, indexes=(pipeline,)))[pipeline]
+
+
+def run_pipeline(engine, pipeline, state_path, results):
+    """
+    Выгрузка одного индекса в дочернем процессе; окружение уже настроено родителем.
+
+    При ошибке в results кладётся {"error": трассировка}, чтобы родитель не ждал впустую.
+    """
+    from state import JsonFileStorage, State
+
+    runner = run_async if engine == "async" else run_sync
+    started = time.perf_counter()
+    try:
+        processed = runner(pipeline, State(JsonFileStorage(state_path)))
+    except BaseException:
+        results.put({"error": traceback.format_exc()})
+        raise
+    seconds = time.perf_counter() - started
+    # ru_maxrss в Linux возвращается в килобайтах
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results.put({"processed": processed, "seconds": seconds, "peak_rss_mb": peak})
+
+
+def wait_result(process, results, poll=1.0):
+    """
+    Результат дочернего процесса из очереди results.
+
+    Если процесс завершился, так и не положив результат (например, убит),
+    возвращается {"error": ...} с кодом завершения.
+    """
+    while True:
+        try:
+            return results.get(timeout=poll)
+        except queue.Empty:
+            if process.is_alive():
+                continue
+        # Результат мог быть положен в очередь перед самым завершением
+        try:
+            return results.get(timeout=poll)
+        except queue.Empty:
+            return {"error": f"процесс завершился с кодом {process.exitcode} без результата"}
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_arguments(parser)
+    parser.add_argument("--reset", action="store_true", help="удалить существующие данные")
+    parser.add_argument("--skip-generate", action="store_true", help="использовать данные в content")
+    parser.add_argument("--pipelines", nargs="+", choices=PIPELINES, default=list(PIPELINES))
+    parser.add_argument("--engines", nargs="+", choices=("sync", "async"), default=["sync"])
+    parser.add_argument("--port", type=int, default=0, help="порт fake ES (0 — любой свободный)")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа _bulk, с")
+    parser.add_argument("--reject-rate", type=float, default=0.0, help="доля запросов _bulk с 429")
+    parser.add_argument("--item-retry-rate", type=float, default=0.0, help="доля документов с 429")
+    parser.add_argument("--item-error-rate", type=float, default=0.0, help="доля документов с 400")
+    parser.add_argument("--output", help="файл результатов (по умолчанию benchmarks/results/<время>.json)")
+    args = parser.parse_args()
+
+    if not args.skip_generate:
+        from db import get_connection
+
+        connection = get_connection()
+        try:
+            generate(
+                connection,
+                args.films,
+                args.persons,
+                args.genres,
+                args.persons_per_film,
+                args.genres_per_film,
+                reset=args.reset,
+            )
+        finally:
+            connection.close()
+
+    server = FakeElasticsearch(
+        args.port,
+        latency=args.latency,
+        reject_rate=args.reject_rate,
+        item_retry_rate=args.item_retry_rate,
+        item_error_rate=args.item_error_rate,
+    ).start()
+    workdir = tempfile.mkdtemp(prefix="etl-bench-")
+    # Дочерние процессы наследуют окружение: config.py прочитает его при импорте
+    os.environ.update({
+        "ELASTICSEARCH_URL": server.url,
+        "ETL_FINGERPRINTS_FILE": "",
+        "ETL_SPOOL_DIR": "",
+        "ETL_METRICS_PORT": "0",
+    })
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    digests = {}
+    for engine in args.engines:
+        for pipeline in args.pipelines:
+            server.stats.reset()
+            results_queue = context.Queue()
+            state_path = os.path.join(workdir, f"{engine}-{pipeline}.json")
+            process = context.Process(
+                target=run_pipeline, args=(engine, pipeline, state_path, results_queue)
+            )
+            process.start()
+            run = wait_result(process, results_queue)
+            process.join()
+            if "error" in run:
+                server.shutdown()
+                raise SystemExit(
+                    f"Конвейер {pipeline} ({engine}) завершился с ошибкой:\n{run['error']}"
+                )
+            stats = server.stats.snapshot()
+            latencies = stats.pop("latencies")
+            digests[engine, pipeline] = server.stats.digests()
+            results.append({
+                "engine": engine,
+                "pipeline": pipeline,
+                **run,
+                **stats,
+                "docs_per_second": stats["docs"] / run["seconds"] if run["seconds"] else None,
+                "bulk_p50_seconds": percentile(latencies, 0.5),
+                "bulk_p99_seconds": percentile(latencies, 0.99),
+            })
+    server.shutdown()
+
+    # Документы каждого движка сравниваются с документами первого
+    base = args.engines[0]
+    for result in results:
+        expected = digests[base, result["pipeline"]]
+        actual = digests[result["engine"], result["pipeline"]]
+        result["mismatched_docs"] = len(expected.keys() ^ actual.keys()) + sum(
+            expected[key] != actual[key] for key in expected.keys() & actual.keys()
+        )
+
+    report = {
+        "time": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "parameters": vars(args),
+        "results": results,
+    }
+    output = args.output or os.path.join(
+        "benchmarks", "results", datetime.now().strftime("%Y%m%d-%H%M%S") + ".json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+
+    print(
+        f"{'engine':>6} {'pipeline':>10} {'docs':>10} {'docs/s':>10} {'p50, ms':>9} "
+        f"{'p99, ms':>9} {'peak RSS, MB':>14} {'mismatched':>10}"
+    )
+    for result in results:
+        p50 = (result["bulk_p50_seconds"] or 0) * 1000
+        p99 = (result["bulk_p99_seconds"] or 0) * 1000
+        print(
+            f"{result['engine']:>6} {result['pipeline']:>10} {result['docs']:>10} "
+            f"{result['docs_per_second'] or 0:>10.0f} {p50:>9.1f} {p99:>9.1f} "
+            f"{result['peak_rss_mb']:>14.1f} {result['mismatched_docs']:>10}"
+        )
+    print(f"Результаты сохранены в {output}")
+
+
+if __name__ == "__main__":
+    main()
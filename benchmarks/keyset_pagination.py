@@ -0,0 +1,120 @@
+"""
+Бенчмарк постраничного чтения: LIMIT/OFFSET против keyset (updated_at, id).
+
+Создаёт в схеме bench синтетическую таблицу film_work на --rows строк
+(по умолчанию 2 000 000) с индексом (updated_at, id) и замеряет время чтения
+одной страницы на разной глубине. Время keyset-страницы должно оставаться
+постоянным, время OFFSET-страницы — расти линейно с глубиной.
+
+Запуск из корня репозитория:
+    python -m benchmarks.keyset_pagination --rows 2000000 --batch-size 100
+"""
+import argparse
+import time
+
+from db import get_connection
+from extract import iter_keyset_pages
+
+BENCH_QUERY = """
+    SELECT id, title, updated_at
+    FROM bench.film_work
+    WHERE {keyset}
+    ORDER BY updated_at, id
+    LIMIT %(limit)s;
+"""
+
+OFFSET_QUERY = """
+    SELECT id, title, updated_at
+    FROM bench.film_work
+    ORDER BY updated_at, id
+    LIMIT %(limit)s
+    OFFSET %(offset)s;
+"""
+
+
+def prepare_table(connection, rows):
+    """Создание синтетической таблицы, если в ней другое число строк."""
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE SCHEMA IF NOT EXISTS bench;")
+        cursor.execute("SELECT to_regclass('bench.film_work');")
+        if cursor.fetchone()[0] is not None:
+            cursor.execute("SELECT count(*) FROM bench.film_work;")
+            if cursor.fetchone()[0] == rows:
+                return
+            cursor.execute("DROP TABLE bench.film_work;")
+        # Каждые 10 строк делят один updated_at, чтобы проверить стабильность ключа
+        cursor.execute(
+            """
+            CREATE TABLE bench.film_work AS
+            SELECT
+                gen_random_uuid() AS id,
+                'film ' || n AS title,
+                now() - (n / 10) * interval '1 second' AS updated_at
+            FROM generate_series(1, %(rows)s) AS n;
+            """,
+            {"rows": rows},
+        )
+        cursor.execute("ALTER TABLE bench.film_work ADD PRIMARY KEY (id);")
+        cursor.execute("CREATE INDEX ON bench.film_work (updated_at, id);")
+        cursor.execute("ANALYZE bench.film_work;")
+    connection.commit()
+
+
+def key_at(connection, depth):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT updated_at, id FROM bench.film_work "
+            "ORDER BY updated_at, id OFFSET %(offset)s LIMIT 1;",
+            {"offset": depth},
+        )
+        return cursor.fetchone()
+
+
+def time_offset_page(connection, depth, batch_size):
+    with connection.cursor() as cursor:
+        started = time.perf_counter()
+        cursor.execute(OFFSET_QUERY, {"limit": batch_size, "offset": depth})
+        cursor.fetchall()
+        return time.perf_counter() - started
+
+
+def time_keyset_page(connection, depth, batch_size):
+    after = key_at(connection, depth - 1) if depth else None
+    pages = iter_keyset_pages(connection, BENCH_QUERY, batch_size, after)
+    started = time.perf_counter()
+    next(pages)
+    elapsed = time.perf_counter() - started
+    pages.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--points", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    connection = get_connection()
+    try:
+        prepare_table(connection, args.rows)
+        step = (args.rows - args.batch_size) // (args.points - 1)
+        print(f"{'depth':>12} {'offset, ms':>12} {'keyset, ms':>12}")
+        for point in range(args.points):
+            depth = point * step
+            offset_time = min(
+                time_offset_page(connection, depth, args.batch_size)
+                for _ in range(args.repeat)
+            )
+            keyset_time = min(
+                time_keyset_page(connection, depth, args.batch_size)
+                for _ in range(args.repeat)
+            )
+            print(f"{depth:>12} {offset_time * 1000:>12.2f} {keyset_time * 1000:>12.2f}")
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Бенчмарк памяти: fetchall() против потокового чтения серверным курсором.
+
+Создаёт в схеме bench синтетическую таблицу person на максимальное из --rows
+число строк и для каждого размера в отдельном процессе прогоняет выгрузку
+персон до готовых NDJSON-пачек (без отправки в Elasticsearch), замеряя
+пиковый RSS. У fetchall() пиковая память растёт с числом строк, у потокового
+чтения остаётся постоянной.
+
+Запуск из корня репозитория:
+    python -m benchmarks.streaming_memory --rows 100000 500000 1000000 2000000
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+
+import psycopg2.extras
+
+from config import BATCH_SIZE, ITERSIZE
+from db import get_connection
+from extract import iter_batches, iter_streaming
+from pipelines import persons_bulk_data
+
+# Фильмов у синтетических персон нет: films пустой, как у персоны без связей
+BENCH_QUERY = """
+    SELECT id, full_name, updated_at, '[]'::json AS films
+    FROM (
+        SELECT id, full_name, updated_at
+        FROM bench.person
+        ORDER BY updated_at, id
+        LIMIT {rows}
+    ) p
+    WHERE {{keyset}}
+    ORDER BY updated_at, id;
+"""
+
+
+def prepare_table(connection, rows):
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE SCHEMA IF NOT EXISTS bench;")
+        cursor.execute("SELECT to_regclass('bench.person');")
+        if cursor.fetchone()[0] is not None:
+            cursor.execute("SELECT count(*) FROM bench.person;")
+            if cursor.fetchone()[0] >= rows:
+                return
+            cursor.execute("DROP TABLE bench.person;")
+        cursor.execute(
+            """
+            CREATE TABLE bench.person AS
+            SELECT
+                gen_random_uuid() AS id,
+                'Person Full Name ' || n AS full_name,
+                now() - n * interval '1 second' AS updated_at
+            FROM generate_series(1, %(rows)s) AS n;
+            """,
+            {"rows": rows},
+        )
+        cursor.execute("CREATE INDEX ON bench.person (updated_at, id);")
+        cursor.execute("ANALYZE bench.person;")
+    connection.commit()
+
+
+def run_fetchall(connection, query):
+    """Прежний путь: вся таблица в DictRow, затем в документах NDJSON, затем в одном теле."""
+    with connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+        cursor.execute(query.format(keyset="TRUE"))
+        persons_data = cursor.fetchall()
+    payload = b"".join(persons_bulk_data(persons_data))
+    return len(persons_data), len(payload)
+
+
+def run_streaming(connection, query):
+    rows = 0
+    size = 0
+    for persons_data in iter_batches(iter_streaming(connection, query), BATCH_SIZE):
+        payload = b"".join(persons_bulk_data(persons_data))
+        rows += len(persons_data)
+        size += len(payload)
+    return rows, size
+
+
+def measure(mode, rows, results):
+    connection = get_connection()
+    try:
+        query = BENCH_QUERY.format(rows=rows)
+        runner = run_fetchall if mode == "fetchall" else run_streaming
+        count, size = runner(connection, query)
+    finally:
+        connection.close()
+    # ru_maxrss в Linux возвращается в килобайтах
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results.put({"mode": mode, "rows": count, "bytes": size, "peak_rss_mb": peak})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--rows", type=int, nargs="+", default=[100_000, 500_000, 1_000_000, 2_000_000]
+    )
+    parser.add_argument("--modes", nargs="+", default=["fetchall", "streaming"])
+    parser.add_argument("--json", action="store_true", help="вывести результаты в JSON")
+    args = parser.parse_args()
+
+    connection = get_connection()
+    try:
+        prepare_table(connection, max(args.rows))
+    finally:
+        connection.close()
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for rows in args.rows:
+        for mode in args.modes:
+            queue = context.Queue()
+            process = context.Process(target=measure, args=(mode, rows, queue))
+            process.start()
+            results.append(queue.get())
+            process.join()
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        return
+    print(f"itersize={ITERSIZE} batch_size={BATCH_SIZE}")
+    print(f"{'rows':>10} {'mode':>10} {'peak RSS, MB':>14}")
+    for result in results:
+        print(f"{result['rows']:>10} {result['mode']:>10} {result['peak_rss_mb']:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Генератор синтетических данных в схеме content локального Postgres.
+
+Создаёт таблицы film_work, person, genre, person_film_work и genre_film_work
+(если их нет) и заполняет их: --films фильмов, --persons персон, --genres
+жанров, у каждого фильма --persons-per-film персон в ролях actor, writer и
+director и --genres-per-film жанров. Связи выбираются детерминированно, так
+что одинаковые параметры дают одинаковую структуру данных.
+
+Существующие данные удаляются только с --reset, чтобы не стереть
+настоящую базу по ошибке.
+
+Запуск из корня репозитория:
+    python -m benchmarks.synthetic --films 100000 --persons 50000 --reset
+"""
+import argparse
+import logging
+
+from db import get_connection
+
+TABLES = ("person_film_work", "genre_film_work", "film_work", "person", "genre")
+
+SCHEMA_DDL = """
+    CREATE SCHEMA IF NOT EXISTS content;
+
+    CREATE TABLE IF NOT EXISTS content.film_work (
+        id uuid PRIMARY KEY,
+        title TEXT NOT NULL,
+        description TEXT,
+        creation_date DATE,
+        rating FLOAT,
+        type TEXT NOT NULL,
+        created_at timestamp with time zone,
+        updated_at timestamp with time zone
+    );
+    CREATE TABLE IF NOT EXISTS content.person (
+        id uuid PRIMARY KEY,
+        full_name TEXT NOT NULL,
+        created_at timestamp with time zone,
+        updated_at timestamp with time zone
+    );
+    CREATE TABLE IF NOT EXISTS content.genre (
+        id uuid PRIMARY KEY,
+        name TEXT NOT NULL,
+        description TEXT,
+        created_at timestamp with time zone,
+        updated_at timestamp with time zone
+    );
+    CREATE TABLE IF NOT EXISTS content.person_film_work (
+        id uuid PRIMARY KEY,
+        film_work_id uuid NOT NULL REFERENCES content.film_work (id) ON DELETE CASCADE,
+        person_id uuid NOT NULL REFERENCES content.person (id) ON DELETE CASCADE,
+        role TEXT NOT NULL,
+        created_at timestamp with time zone
+    );
+    CREATE TABLE IF NOT EXISTS content.genre_film_work (
+        id uuid PRIMARY KEY,
+        film_work_id uuid NOT NULL REFERENCES content.film_work (id) ON DELETE CASCADE,
+        genre_id uuid NOT NULL REFERENCES content.genre (id) ON DELETE CASCADE,
+        created_at timestamp with time zone
+    );
+
+    CREATE INDEX IF NOT EXISTS film_work_updated_at_id_idx
+        ON content.film_work (updated_at, id);
+    CREATE INDEX IF NOT EXISTS person_updated_at_id_idx
+        ON content.person (updated_at, id);
+    CREATE INDEX IF NOT EXISTS genre_updated_at_id_idx
+        ON content.genre (updated_at, id);
+    CREATE INDEX IF NOT EXISTS person_film_work_film_work_id_idx
+        ON content.person_film_work (film_work_id);
+    CREATE INDEX IF NOT EXISTS person_film_work_person_id_idx
+        ON content.person_film_work (person_id);
+    CREATE INDEX IF NOT EXISTS person_film_work_created_at_id_idx
+        ON content.person_film_work (created_at, id);
+    CREATE INDEX IF NOT EXISTS genre_film_work_film_work_id_idx
+        ON content.genre_film_work (film_work_id);
+    CREATE INDEX IF NOT EXISTS genre_film_work_genre_id_idx
+        ON content.genre_film_work (genre_id);
+"""
+
+INSERT_GENRES = """
+    INSERT INTO content.genre (id, name, description, created_at, updated_at)
+    SELECT
+        gen_random_uuid(),
+        'Genre ' || n,
+        'Synthetic genre number ' || n,
+        now(),
+        now() - n * interval '1 second'
+    FROM generate_series(1, %(genres)s) AS n;
+"""
+
+INSERT_PERSONS = """
+    INSERT INTO content.person (id, full_name, created_at, updated_at)
+    SELECT
+        gen_random_uuid(),
+        'Person Full Name ' || n,
+        now(),
+        now() - n * interval '1 second'
+    FROM generate_series(1, %(persons)s) AS n;
+"""
+
+INSERT_FILMS = """
+    INSERT INTO content.film_work
+        (id, title, description, creation_date, rating, type, created_at, updated_at)
+    SELECT
+        gen_random_uuid(),
+        'Film ' || n,
+        repeat('Synthetic description of film ' || n || '. ', 5),
+        date '2000-01-01' + (n %% 8000),
+        round((random() * 10)::numeric, 1),
+        CASE WHEN n %% 5 = 0 THEN 'tv_show' ELSE 'movie' END,
+        now(),
+        now() - (n / 10) * interval '1 second'
+    FROM generate_series(1, %(films)s) AS n;
+"""
+
+# Связи: персона номер (номер фильма * 7919 + s * 104729) по модулю числа
+# персон — детерминированное и равномерное распределение без ORDER BY random()
+INSERT_PERSON_LINKS = """
+    INSERT INTO content.person_film_work (id, film_work_id, person_id, role, created_at)
+    SELECT
+        gen_random_uuid(),
+        f.id,
+        p.id,
+        (ARRAY['actor', 'writer', 'director'])[1 + s %% 3],
+        now()
+    FROM (SELECT id, row_number() OVER (ORDER BY id) AS rn FROM content.film_work) f
+    CROSS JOIN generate_series(0, %(fanout)s - 1) AS s
+    JOIN (SELECT id, row_number() OVER (ORDER BY id) - 1 AS pn FROM content.person) p
+        ON p.pn = (f.rn * 7919 + s * 104729) %% %(persons)s;
+"""
+
+INSERT_GENRE_LINKS = """
+    INSERT INTO content.genre_film_work (id, film_work_id, genre_id, created_at)
+    SELECT gen_random_uuid(), f.id, g.id, now()
+    FROM (SELECT id, row_number() OVER (ORDER BY id) AS rn FROM content.film_work) f
+    CROSS JOIN generate_series(0, %(fanout)s - 1) AS s
+    JOIN (SELECT id, row_number() OVER (ORDER BY id) - 1 AS gn FROM content.genre) g
+        ON g.gn = (f.rn + s) %% %(genres)s;
+"""
+
+
+def generate(
+    connection,
+    films,
+    persons,
+    genres,
+    persons_per_film,
+    genres_per_film,
+    reset=False,
+):
+    """Создание схемы content и заполнение её синтетическими данными."""
+    with connection.cursor() as cursor:
+        cursor.execute(SCHEMA_DDL)
+        cursor.execute("SELECT count(*) FROM content.film_work;")
+        if cursor.fetchone()[0] and not reset:
+            raise SystemExit("В content.film_work уже есть данные; добавьте --reset")
+        cursor.execute(
+            "TRUNCATE " + ", ".join(f"content.{table}" for table in TABLES) + ";"
+        )
+        params = {
+            "films": films,
+            "persons": persons,
+            "genres": genres,
+        }
+        for name, query, extra in (
+            ("genre", INSERT_GENRES, {}),
+            ("person", INSERT_PERSONS, {}),
+            ("film_work", INSERT_FILMS, {}),
+            ("person_film_work", INSERT_PERSON_LINKS, {"fanout": persons_per_film}),
+            ("genre_film_work", INSERT_GENRE_LINKS, {"fanout": genres_per_film}),
+        ):
+            cursor.execute(query, {**params, **extra})
+            logging.info(f"content.{name}: {cursor.rowcount} строк")
+        for table in TABLES:
+            cursor.execute(f"ANALYZE content.{table};")
+    connection.commit()
+
+
+def add_arguments(parser):
+    parser.add_argument("--films", type=int, default=10_000)
+    parser.add_argument("--persons", type=int, default=5_000)
+    parser.add_argument("--genres", type=int, default=30)
+    parser.add_argument("--persons-per-film", type=int, default=10)
+    parser.add_argument("--genres-per-film", type=int, default=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_arguments(parser)
+    parser.add_argument("--reset", action="store_true", help="удалить существующие данные")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    connection = get_connection()
+    try:
+        generate(
+            connection,
+            args.films,
+            args.persons,
+            args.genres,
+            args.persons_per_film,
+            args.genres_per_film,
+            reset=args.reset,
+        )
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
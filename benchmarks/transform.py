@@ -0,0 +1,130 @@
+"""
+Микробенчмарк преобразования строк в документы: документов в секунду на ядро.
+
+Генерирует синтетические строки фильмов (--persons персон на фильм), персон и
+жанров и замеряет скомпилированные преобразования из transform.py. Для movies
+для сравнения замеряется и прежнее преобразование с пятью проходами по persons.
+Postgres и Elasticsearch не нужны.
+
+Запуск из корня репозитория:
+    python -m benchmarks.transform --rows 20000 --persons 30
+"""
+import argparse
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+
+from transform import GENRES, MOVIES, PERSONS, compile_bulk, compile_schema
+
+ROLES = ("actor", "writer", "director")
+UPDATED_AT = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def film_rows(count, persons):
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "title": f"Film {n}",
+            "description": "Description " * 20,
+            "rating": random.uniform(1, 10),
+            "type": "movie",
+            "genres": ["Action", "Drama"],
+            "updated_at": UPDATED_AT,
+            "persons": [
+                {
+                    "person_role": random.choice(ROLES),
+                    "person_id": str(uuid.uuid4()),
+                    "person_name": f"Person {n}-{i}",
+                }
+                for i in range(persons)
+            ],
+        }
+        for n in range(count)
+    ]
+
+
+def legacy_film_document(data):
+    """Прежнее преобразование: по проходу по data["persons"] на каждое поле."""
+    return {
+        "id": data["id"],
+        "imdb_rating": float(data["rating"]) if data["rating"] is not None else None,
+        "genre": data["genres"],
+        "title": data["title"],
+        "description": data["description"],
+        "director": [p["person_name"] for p in data["persons"] if p["person_role"] == "director"],
+        "actors_names": [p["person_name"] for p in data["persons"] if p["person_role"] == "actor"],
+        "writers_names": [p["person_name"] for p in data["persons"] if p["person_role"] == "writer"],
+        "actors": [
+            {"id": p["person_id"], "name": p["person_name"]}
+            for p in data["persons"]
+            if p["person_role"] == "actor"
+        ],
+        "writers": [
+            {"id": p["person_id"], "name": p["person_name"]}
+            for p in data["persons"]
+            if p["person_role"] == "writer"
+        ],
+    }
+
+
+def rate(function, rows, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for row in rows:
+            function(row)
+        best = min(best, time.perf_counter() - started)
+    return len(rows) / best
+
+
+def bulk_rate(function, rows, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(rows)
+        best = min(best, time.perf_counter() - started)
+    return len(rows) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--persons", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    films = film_rows(args.rows, args.persons)
+    persons = [
+        {
+            "id": str(uuid.uuid4()),
+            "full_name": f"Person {n}",
+            "films": [{"id": str(uuid.uuid4()), "roles": ["actor"]}],
+            "updated_at": UPDATED_AT,
+        }
+        for n in range(args.rows)
+    ]
+    genres = [
+        {
+            "id": str(uuid.uuid4()),
+            "name": f"Genre {n}",
+            "description": "Text",
+            "updated_at": UPDATED_AT,
+        }
+        for n in range(args.rows)
+    ]
+
+    results = [
+        ("movies legacy document", rate(legacy_film_document, films, args.repeat)),
+        ("movies document", rate(compile_schema(MOVIES), films, args.repeat)),
+        ("movies bulk", bulk_rate(compile_bulk(MOVIES), films, args.repeat)),
+        ("genres bulk", bulk_rate(compile_bulk(GENRES), genres, args.repeat)),
+        ("persons bulk", bulk_rate(compile_bulk(PERSONS), persons, args.repeat)),
+    ]
+    print(f"{'transform':>24} {'docs/s':>12}")
+    for name, docs_per_second in results:
+        print(f"{name:>24} {docs_per_second:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ELASTICSEARCH_URL = os.environ.get("ELASTICSEARCH_URL", "http://127.0.0.1:9200")
+index_name_film_work = "movies"
+index_name_genre = "genres"
+index_name_person = "persons"
+
+# Размер страницы при чтении из Postgres
+BATCH_SIZE = int(os.environ.get("ETL_BATCH_SIZE", 100))
+
+# Адаптивный размер страниц и запросов _bulk (см. tuning.py): "1" — включён
+ADAPTIVE_BATCHING = os.environ.get("ETL_ADAPTIVE_BATCHING", "1") == "1"
+# Пределы размера страницы и целевое время запроса страницы к Postgres
+BATCH_SIZE_MIN = int(os.environ.get("ETL_BATCH_SIZE_MIN", 50))
+BATCH_SIZE_MAX = int(os.environ.get("ETL_BATCH_SIZE_MAX", 2000))
+QUERY_TARGET_SECONDS = float(os.environ.get("ETL_QUERY_TARGET_SECONDS", 0.5))
+
+# Сколько строк серверный курсор передаёт клиенту за один раз
+ITERSIZE = int(os.environ.get("ETL_ITERSIZE", 2000))
+
+# Сборка документов movies: "sql" (агрегация в Postgres), "dimension_cache"
+# или "copy" (агрегация в Postgres, чтение через COPY ... TO STDOUT)
+FILM_EXTRACT_MODE = os.environ.get("ETL_FILM_EXTRACT_MODE", "sql")
+# Чтение персон и жанров: "cursor" (серверный курсор) или "copy"
+PERSON_EXTRACT_MODE = os.environ.get("ETL_PERSON_EXTRACT_MODE", "cursor")
+GENRE_EXTRACT_MODE = os.environ.get("ETL_GENRE_EXTRACT_MODE", "cursor")
+# Размер куска вывода COPY, передаваемого разборщику, в байтах
+COPY_CHUNK_SIZE = int(os.environ.get("ETL_COPY_CHUNK_SIZE", 1024 * 1024))
+
+# Вместимость очередей между стадиями конвейера, в пачках
+QUEUE_SIZE = int(os.environ.get("ETL_QUEUE_SIZE", 4))
+
+# Файл с водяными знаками (updated_at, id) инкрементальной выгрузки
+STATE_FILE_PATH = os.environ.get("ETL_STATE_FILE", "state.json")
+
+# SQLite-файл с отпечатками записанных документов; пусто — подавление отключено
+FINGERPRINTS_PATH = os.environ.get("ETL_FINGERPRINTS_FILE", "")
+
+# Нарезка запросов _bulk: не больше документов и байт в одном запросе
+BULK_MAX_DOCS = int(os.environ.get("ETL_BULK_MAX_DOCS", 1000))
+BULK_MAX_BYTES = int(os.environ.get("ETL_BULK_MAX_BYTES", 5 * 1024 * 1024))
+# Пределы числа документов в запросе _bulk и целевое время запроса
+# при адаптивном размере (BULK_MAX_DOCS — начальное значение)
+BULK_DOCS_MIN = int(os.environ.get("ETL_BULK_DOCS_MIN", 100))
+BULK_DOCS_MAX = int(os.environ.get("ETL_BULK_DOCS_MAX", 5000))
+BULK_TARGET_SECONDS = float(os.environ.get("ETL_BULK_TARGET_SECONDS", 1.0))
+# Уровень gzip для тела _bulk (Content-Encoding: gzip); 0 — без сжатия
+BULK_GZIP_LEVEL = int(os.environ.get("ETL_BULK_GZIP_LEVEL", 0))
+# Сколько запросов _bulk отправляется параллельно
+BULK_CONCURRENCY = int(os.environ.get("ETL_BULK_CONCURRENCY", 4))
+# Сколько секунд повторять отправку отклонённых документов, прежде чем сдаться
+BULK_RETRY_DEADLINE = float(os.environ.get("ETL_BULK_RETRY_DEADLINE", 300))
+# Таймауты запросов к Elasticsearch, с: установка соединения, ожидание ответа
+# _bulk и ожидание ответа на служебные запросы (маппинги, алиасы, настройки).
+# Запрос _bulk без ответа считается неудачным и повторяется
+ES_CONNECT_TIMEOUT = float(os.environ.get("ETL_ES_CONNECT_TIMEOUT", 10))
+BULK_TIMEOUT = float(os.environ.get("ETL_BULK_TIMEOUT", 120))
+ES_REQUEST_TIMEOUT = float(os.environ.get("ETL_ES_REQUEST_TIMEOUT", 60))
+
+# Канал LISTEN/NOTIFY, в который триггеры публикуют изменения ("таблица:id")
+NOTIFY_CHANNEL = os.environ.get("ETL_NOTIFY_CHANNEL", "etl_changes")
+# Сколько секунд копить уведомления в одну пачку переиндексации
+NOTIFY_WINDOW = float(os.environ.get("ETL_NOTIFY_WINDOW", 0.2))
+# Интервал инкрементальной догоняющей выгрузки на случай пропущенных уведомлений
+CATCHUP_INTERVAL = float(os.environ.get("ETL_CATCHUP_INTERVAL", 300))
+
+# Интервалы запуска заданий планировщика по индексам, в секундах
+SCHEDULE_INTERVALS = {
+    index_name_film_work: float(os.environ.get("ETL_MOVIES_INTERVAL", 10)),
+    index_name_genre: float(os.environ.get("ETL_GENRES_INTERVAL", 30)),
+    index_name_person: float(os.environ.get("ETL_PERSONS_INTERVAL", 30)),
+}
+# Предел, до которого растёт интервал задания, пока изменений нет
+IDLE_MAX_INTERVAL = float(os.environ.get("ETL_IDLE_MAX_INTERVAL", 300))
+# Если за запуск выгружено не меньше записей, следующий запуск сразу
+BACKLOG_THRESHOLD = int(os.environ.get("ETL_BACKLOG_THRESHOLD", 1000))
+
+# Каталог spool — очереди пачек на диске (см. spool.py); пусто — spool отключён
+SPOOL_DIR = os.environ.get("ETL_SPOOL_DIR", "")
+# Размер сегмента spool и предельный объём, после которого запись блокируется
+SPOOL_SEGMENT_BYTES = int(os.environ.get("ETL_SPOOL_SEGMENT_BYTES", 16 * 1024 * 1024))
+SPOOL_MAX_BYTES = int(os.environ.get("ETL_SPOOL_MAX_BYTES", 1024 * 1024 * 1024))
+# Файл документов, окончательно отклонённых Elasticsearch; пусто — только в лог
+DEAD_LETTER_PATH = os.environ.get(
+    "ETL_DEAD_LETTER_FILE",
+    os.path.join(SPOOL_DIR, "dead_letters.ndjson") if SPOOL_DIR else "",
+)
+
+# Порт HTTP-сервера метрик Prometheus (/metrics); 0 — сервер не запускается
+METRICS_PORT = int(os.environ.get("ETL_METRICS_PORT", 0))
+# Профилирование запуска: "cprofile", "tracemalloc" или пусто (см. profiling.py)
+PROFILE_MODE = os.environ.get("ETL_PROFILE", "")
+PROFILE_DIR = os.environ.get("ETL_PROFILE_DIR", "profiles")
+
+# Число реплик индекса после перестроения (на время загрузки реплики отключаются)
+ES_NUMBER_OF_REPLICAS = int(os.environ.get("ES_NUMBER_OF_REPLICAS", 1))
+
+# Сверка индексов с Postgres (reconcile.py): среднее число строк в диапазоне
+# id, который сравнивается построчно, и размер страницы scroll в Elasticsearch
+RECONCILE_RANGE_ROWS = int(os.environ.get("ETL_RECONCILE_RANGE_ROWS", 256))
+RECONCILE_SCROLL_SIZE = int(os.environ.get("ETL_RECONCILE_SCROLL_SIZE", 5000))
+
+# Выгрузка в файлы (export.py): размер шарда до сжатия, сжатие ("zstd", "gzip"
+# или "none") и число шардов, одновременно отправляемых при загрузке из файлов
+EXPORT_SHARD_BYTES = int(os.environ.get("ETL_EXPORT_SHARD_BYTES", 256 * 1024 * 1024))
+EXPORT_COMPRESSION = os.environ.get("ETL_EXPORT_COMPRESSION", "zstd")
+EXPORT_REPLAY_WORKERS = int(os.environ.get("ETL_EXPORT_REPLAY_WORKERS", 4))
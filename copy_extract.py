@@ -0,0 +1,206 @@
+"""
+Потоковое чтение через COPY (SELECT ...) TO STDOUT для полных выгрузок.
+
+DictCursor на каждую строку создаёт DictRow и приводит каждую колонку к
+типу Python (datetime, разбор JSON и т. д.). COPY в текстовом формате отдаёт
+строки как есть, и разбор сведён к минимуму: строка делится по табуляции,
+NULL (\\N) и экранирование обрабатываются только в строках, где есть
+обратная косая черта, разбираются только JSON-колонки, остальные значения
+остаются строками. updated_at разбирается только у последней строки пачки,
+для водяного знака (см. extract.row_key).
+
+COPY выполняется в отдельном потоке: psycopg2 передаёт вывод построчно в
+объект-приёмник, который собирает строки в куски по chunk_size байт и
+отдаёт их разборщику через ограниченную очередь.
+"""
+import queue
+import re
+import threading
+
+import psycopg2
+
+from config import COPY_CHUNK_SIZE
+from extract import keyset_where
+from serializer import loads
+
+# Сколько кусков вывода COPY может ждать разбора
+_QUEUE_SIZE = 4
+
+_DONE = object()
+
+_ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v"}
+_ESCAPE_RE = re.compile(r"\\(.)")
+
+
+def _unescape_match(match):
+    char = match.group(1)
+    return _ESCAPES.get(char, char)
+
+
+def unescape(field):
+    """Значение поля текстового формата COPY: \\N — NULL, \\\\, \\t, \\n и т. д. — экранирование."""
+    if field == "\\N":
+        return None
+    if "\\" not in field:
+        return field
+    return _ESCAPE_RE.sub(_unescape_match, field)
+
+
+def copy_row_type(columns):
+    """
+    Тип строки COPY: кортеж, поля которого доступны и по имени колонки.
+
+    Преобразователь (transform.py) читает строки как row["имя"], поэтому
+    строки COPY подходят ему так же, как DictRow.
+    """
+    positions = {name: position for position, name in enumerate(columns)}
+    getitem = tuple.__getitem__
+
+    class CopyRow(tuple):
+        __slots__ = ()
+
+        def __getitem__(self, key):
+            return getitem(self, positions[key] if key.__class__ is str else key)
+
+        def keys(self):
+            return positions.keys()
+
+    return CopyRow
+
+
+def parse_copy(chunks, columns, json_columns=()):
+    """
+    Разбор вывода COPY в текстовом формате.
+
+    :param chunks: итератор кусков bytes; строка может быть разрезана между кусками
+    :param columns: имена колонок запроса по порядку
+    :param json_columns: колонки с JSON, которые нужно разобрать
+    :return: генератор строк CopyRow
+    """
+    row_type = copy_row_type(columns)
+    json_positions = [columns.index(name) for name in json_columns]
+    tail = b""
+    for chunk in chunks:
+        if tail:
+            chunk = tail + chunk
+        end = chunk.rfind(b"\n") + 1
+        tail = chunk[end:]
+        if not end:
+            continue
+        for line in chunk[:end - 1].decode().split("\n"):
+            fields = line.split("\t")
+            if "\\" in line:
+                fields = [unescape(field) for field in fields]
+            for position in json_positions:
+                value = fields[position]
+                if value is not None:
+                    fields[position] = loads(value)
+            yield row_type(fields)
+
+
+class _ChunkWriter:
+    """Приёмник вывода copy_expert: собирает строки в куски и кладёт их в очередь."""
+
+    def __init__(self, chunks, chunk_size, cancelled):
+        self.chunks = chunks
+        self.chunk_size = chunk_size
+        self.cancelled = cancelled
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        self.parts.append(data)
+        self.size += len(data)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.parts:
+            return
+        chunk = b"".join(self.parts)
+        self.parts = []
+        self.size = 0
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+
+def iter_copy_chunks(connection, copy_sql, chunk_size=COPY_CHUNK_SIZE):
+    """
+    Вывод COPY ... TO STDOUT кусками bytes.
+
+    Если генератор закрыт до конца вывода, запрос отменяется, а транзакция
+    соединения откатывается.
+    """
+    chunks = queue.Queue(maxsize=_QUEUE_SIZE)
+    cancelled = threading.Event()
+
+    def copy():
+        writer = _ChunkWriter(chunks, chunk_size, cancelled)
+        try:
+            with connection.cursor() as cursor:
+                cursor.copy_expert(copy_sql, writer)
+            writer.flush()
+            result = _DONE
+        except BaseException as e:
+            result = e
+        while not cancelled.is_set():
+            try:
+                chunks.put(result, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    thread = threading.Thread(target=copy, name="etl-copy", daemon=True)
+    thread.start()
+    finished = False
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is _DONE:
+                finished = True
+                return
+            if isinstance(chunk, BaseException):
+                finished = True
+                raise chunk
+            yield chunk
+    finally:
+        if not finished:
+            cancelled.set()
+            connection.cancel()
+            thread.join()
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                pass
+
+
+def iter_copy(
+    connection,
+    query,
+    columns,
+    after=None,
+    json_columns=(),
+    chunk_size=COPY_CHUNK_SIZE,
+):
+    """
+    Потоковое чтение запроса через COPY.
+
+    :param connection: соединение с Postgres
+    :param query: запрос с плейсхолдером {keyset}, упорядоченный по (updated_at, id)
+    :param columns: имена колонок запроса по порядку
+    :param after: ключ (updated_at, id), после которого начинать чтение
+    :param json_columns: колонки с JSON, которые нужно разобрать
+    :return: генератор строк CopyRow, как у iter_streaming
+    """
+    params = {}
+    keyset = keyset_where(after, params)
+    with connection.cursor() as cursor:
+        select = cursor.mogrify(query.format(keyset=keyset), params).decode()
+    copy_sql = f"COPY ({select.strip().rstrip(';')}) TO STDOUT"
+    yield from parse_copy(
+        iter_copy_chunks(connection, copy_sql, chunk_size), columns, json_columns
+    )
@@ -0,0 +1,36 @@
+import os
+
+import psycopg2
+import psycopg2.pool
+
+import config  # noqa: F401  (загружает переменные окружения из .env)
+from backoff import backoff
+
+
+def get_dsl():
+    DATABASE_NAME = os.getenv("DATABASE_NAME")
+    DATABASE_USER = os.getenv("DATABASE_USER")
+    DATABASE_PASSWORD = os.getenv("DATABASE_PASSWORD")
+    DATABASE_HOST = os.getenv("DATABASE_HOST")
+    DATABASE_PORT = os.getenv("DATABASE_PORT")
+
+    dsl = {
+        "dbname": DATABASE_NAME,
+        "user": DATABASE_USER,
+        "password": DATABASE_PASSWORD,
+        "host": DATABASE_HOST,
+        "port": int(DATABASE_PORT),
+    }
+    return dsl
+
+
+@backoff(reraise=True)
+def get_connection():
+    connection = psycopg2.connect(**get_dsl())
+    return connection
+
+
+@backoff(reraise=True)
+def create_pool(minconn, maxconn):
+    """Пул соединений, который можно использовать из нескольких потоков."""
+    return psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, **get_dsl())
@@ -0,0 +1,146 @@
+"""
+Кэш справочников (персоны и жанры) для сборки документов movies без тяжёлого JOIN.
+
+Вместо пятикратного JOIN с json_agg(DISTINCT ...) по каждой странице фильмов
+справочники content.person и content.genre один раз загружаются в словари
+id -> имя и затем догружаются по водяному знаку (updated_at, id). Для страницы
+фильмов читаются только строки связей person_film_work и genre_film_work,
+а вложенные поля собираются в Python в том же виде, что возвращает
+FILM_WORK_QUERY, поэтому преобразование документов не меняется: в том же
+порядке (персоны — по id и роли, как json_agg(DISTINCT jsonb), жанры — по
+правилам сортировки базы, как array_agg(DISTINCT)) и без связей с удалёнными
+персонами и жанрами.
+
+Режим включается переменной ETL_FILM_EXTRACT_MODE=dimension_cache.
+"""
+import logging
+
+from extract import iter_streaming
+from queries import (
+    GENRE_FILM_WORK_LINKS_QUERY,
+    GENRE_NAMES_BY_IDS_QUERY,
+    GENRE_NAMES_ORDER_QUERY,
+    GENRE_QUERY,
+    PERSON_FILM_WORK_LINKS_QUERY,
+    PERSON_NAMES_BY_IDS_QUERY,
+    PERSON_NAMES_QUERY,
+)
+
+
+class DimensionCache:
+    def __init__(self):
+        self.person_names = {}
+        self.genre_names = {}
+        # Название жанра -> место в порядке сортировки базы
+        self.genre_ranks = {}
+        self.watermarks = {"person": None, "genre": None}
+
+    def refresh(self, connection):
+        """Догрузка персон и жанров, изменённых после прошлого обновления."""
+        for table, query, names, column in (
+            ("person", PERSON_NAMES_QUERY, self.person_names, "full_name"),
+            ("genre", GENRE_QUERY, self.genre_names, "name"),
+        ):
+            loaded = 0
+            row = None
+            for row in iter_streaming(connection, query, after=self.watermarks[table]):
+                names[str(row["id"])] = row[column]
+                loaded += 1
+            if row is not None:
+                self.watermarks[table] = (row["updated_at"], row["id"])
+            if loaded:
+                logging.info(f"Кэш справочников: загружено {loaded} записей content.{table}")
+                if table == "genre":
+                    self._rank_genres(connection)
+
+    def enrich(self, connection, films):
+        """
+        Добавление к строкам фильмов полей persons и genres.
+
+        :param films: строки content.film_work без агрегатов
+        :return: список словарей в формате строк FILM_WORK_QUERY
+        """
+        ids = [str(film["id"]) for film in films]
+        persons = {film_id: [] for film_id in ids}
+        genres = {film_id: set() for film_id in ids}
+        with connection.cursor() as cursor:
+            cursor.execute(PERSON_FILM_WORK_LINKS_QUERY, {"ids": ids})
+            person_links = cursor.fetchall()
+            cursor.execute(GENRE_FILM_WORK_LINKS_QUERY, {"ids": ids})
+            genre_links = cursor.fetchall()
+
+            self._load_missing(
+                cursor,
+                PERSON_NAMES_BY_IDS_QUERY,
+                self.person_names,
+                {str(person_id) for _, person_id, _ in person_links},
+            )
+            if self._load_missing(
+                cursor,
+                GENRE_NAMES_BY_IDS_QUERY,
+                self.genre_names,
+                {str(genre_id) for _, genre_id in genre_links},
+            ):
+                self._rank_genres(connection)
+
+        # Множество — аналог DISTINCT: одна персона в одной роли один раз. Связи
+        # с удалёнными записями отбрасываются, как FILTER (WHERE p.id IS NOT NULL)
+        person_links = {
+            (str(film_id), str(person_id), role) for film_id, person_id, role in person_links
+        }
+        for film_id, person_id, role in person_links:
+            if person_id in self.person_names:
+                persons[film_id].append(
+                    {
+                        "person_role": role,
+                        "person_id": person_id,
+                        "person_name": self.person_names[person_id],
+                    }
+                )
+        for film_id, genre_id in genre_links:
+            genre_id = str(genre_id)
+            if genre_id in self.genre_names:
+                genres[str(film_id)].add(self.genre_names[genre_id])
+
+        rows = []
+        for film in films:
+            film_id = str(film["id"])
+            row = dict(film)
+            # json_agg(DISTINCT jsonb) упорядочивает объекты по значениям ключей
+            # в порядке их хранения: person_id, person_name, person_role
+            row["persons"] = sorted(
+                persons[film_id], key=lambda person: (person["person_id"], person["person_role"])
+            )
+            # array_agg(DISTINCT g.name) при LEFT JOIN без жанров даёт [NULL]
+            row["genres"] = sorted(genres[film_id], key=self._genre_rank) or [None]
+            rows.append(row)
+        return rows
+
+    def _genre_rank(self, name):
+        # Жанр, переименованный после чтения порядка, — в конец до следующего refresh
+        return self.genre_ranks.get(name, len(self.genre_ranks))
+
+    def _rank_genres(self, connection):
+        """Перечитывание порядка названий жанров: его задают правила сортировки базы."""
+        with connection.cursor() as cursor:
+            cursor.execute(GENRE_NAMES_ORDER_QUERY)
+            self.genre_ranks = {name: rank for rank, (name,) in enumerate(cursor)}
+
+    @staticmethod
+    def _load_missing(cursor, query, names, ids):
+        """
+        Дочитывание записей, появившихся после последнего refresh.
+
+        :return: были ли дочитаны записи
+        """
+        missing = [item_id for item_id in ids if item_id not in names]
+        if not missing:
+            return False
+        cursor.execute(query, {"ids": missing})
+        loaded = cursor.fetchall()
+        for item_id, name in loaded:
+            names[str(item_id)] = name
+        return bool(loaded)
+
+
+dimension_cache = DimensionCache()
@@ -0,0 +1,167 @@
+"""
+Конвейерный запуск ETL: извлечение, преобразование и загрузка в отдельных потоках.
+
+Стадии связаны ограниченными очередями. Пока загрузчик ждёт ответа
+Elasticsearch, извлекатель уже читает следующую страницу из Postgres, а
+преобразователь готовит предыдущую. Когда очередь заполнена, стадия-источник
+блокируется (backpressure), поэтому в памяти не больше queue_size пачек на
+каждое звено. Ошибка в любой стадии останавливает остальные, а исключение
+пробрасывается из run_pipeline.
+
+Если передано событие stop, после его установки извлечение новых пачек
+прекращается, а уже извлечённые пачки преобразуются и загружаются до конца.
+
+Загрузчик один, поэтому пачки загружаются в порядке извлечения и водяные знаки
+продвигаются монотонно.
+"""
+import logging
+import queue
+import threading
+import time
+
+from config import QUEUE_SIZE
+from metrics import queue_depth, rows_total, stage_seconds
+from profiling import profile_process, profile_thread, trace_memory
+
+_DONE = object()
+
+# Как часто заблокированная стадия проверяет, не остановлен ли конвейер
+_POLL_INTERVAL = 0.1
+
+
+class PipelineStopped(Exception):
+    """Конвейер остановлен из-за ошибки в другой стадии."""
+
+
+class _Pipeline:
+    def __init__(self, name, queue_size):
+        self.name = name
+        self.transform_queue = queue.Queue(maxsize=queue_size)
+        self.load_queue = queue.Queue(maxsize=queue_size)
+        self.stopped = threading.Event()
+        self.errors = []
+        self.processed = 0
+
+    def put(self, target, item):
+        while not self.stopped.is_set():
+            try:
+                target.put(item, timeout=_POLL_INTERVAL)
+                self.report_depth()
+                return
+            except queue.Full:
+                continue
+        raise PipelineStopped
+
+    def get(self, source):
+        while not self.stopped.is_set():
+            try:
+                item = source.get(timeout=_POLL_INTERVAL)
+                self.report_depth()
+                return item
+            except queue.Empty:
+                continue
+        raise PipelineStopped
+
+    def report_depth(self):
+        queue_depth.set(self.transform_queue.qsize(), pipeline=self.name, queue="transform")
+        queue_depth.set(self.load_queue.qsize(), pipeline=self.name, queue="load")
+
+    def run_stage(self, name, stage, args):
+        try:
+            with profile_thread(f"{self.name}-{name}"):
+                stage(*args)
+        except PipelineStopped:
+            pass
+        except BaseException as e:
+            logging.error(f"Ошибка в стадии {name}: {e}")
+            self.errors.append(e)
+            self.stopped.set()
+
+    def extract(self, batches, stop):
+        try:
+            started = time.perf_counter()
+            for batch in batches:
+                stage_seconds.observe(
+                    time.perf_counter() - started, pipeline=self.name, stage="query"
+                )
+                self.put(self.transform_queue, batch)
+                if stop is not None and stop.is_set():
+                    logging.info("Извлечение остановлено, загрузка оставшихся пачек")
+                    break
+                started = time.perf_counter()
+        finally:
+            close = getattr(batches, "close", None)
+            if close is not None:
+                close()
+        self.put(self.transform_queue, _DONE)
+
+    def transform(self, transform):
+        while True:
+            item = self.get(self.transform_queue)
+            if item is _DONE:
+                self.put(self.load_queue, _DONE)
+                return
+            rows, checkpoint = item
+            self.put(self.load_queue, (len(rows), transform(rows), checkpoint))
+
+    def load(self, load):
+        while True:
+            item = self.get(self.load_queue)
+            if item is _DONE:
+                return
+            count, payload, checkpoint = item
+            load(payload, checkpoint)
+            # Счёт после загрузки пачки, включая её саму
+            self.processed += count
+            rows_total.inc(count, pipeline=self.name)
+            logging.info(f"{self.name}: обработано записей: {self.processed}")
+
+
+def run_pipeline(
+    batches, transform, load, queue_size=QUEUE_SIZE, stop=None, name="etl"
+):
+    """
+    Запуск конвейера извлечение -> преобразование -> загрузка.
+
+    :param batches: итератор пар (строки, checkpoint); итерируется в потоке
+        извлечения, поэтому должен быть единственным пользователем своего соединения
+    :param transform: функция строки -> данные для загрузки
+    :param load: функция (данные, checkpoint) -> None; отправляет пачку и
+        сохраняет checkpoint (например, водяной знак), если он не None
+    :param queue_size: вместимость каждой очереди между стадиями, в пачках
+    :param stop: threading.Event для мягкой остановки: после установки новые
+        пачки не извлекаются, а извлечённые загружаются
+    :param name: имя конвейера для логов и метрик (обычно имя индекса)
+    :return: число обработанных строк
+    """
+    with trace_memory(name), profile_process(name):
+        return _run(_Pipeline(name, queue_size), batches, transform, load, stop)
+
+
+def _run(pipeline, batches, transform, load, stop):
+    stages = [
+        ("extract", pipeline.extract, (batches, stop)),
+        ("transform", pipeline.transform, (transform,)),
+        ("load", pipeline.load, (load,)),
+    ]
+    threads = [
+        threading.Thread(
+            target=pipeline.run_stage, args=(name, stage, args), name=f"{pipeline.name}-{name}"
+        )
+        for name, stage, args in stages
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except BaseException:
+        # Например, KeyboardInterrupt в основном потоке
+        pipeline.stopped.set()
+        for thread in threads:
+            thread.join()
+        raise
+
+    if pipeline.errors:
+        raise pipeline.errors[0]
+    return pipeline.processed
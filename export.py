@@ -0,0 +1,364 @@
+"""
+Выгрузка документов в файлы и загрузка из них в Elasticsearch.
+
+Команда dump прогоняет конвейеры persons, genres и movies как обычно, но
+документы _bulk пишет не в Elasticsearch, а в шарды NDJSON на диске
+(ExportSink): каталог <dir>/<индекс>/ с файлами <индекс>-<номер>.ndjson.zst
+(.gz, без расширения — без сжатия) и manifest.json. В манифесте хранятся
+водяные знаки выгрузки индекса (state) и для каждого шарда — число
+документов, размер до и после сжатия и диапазон водяных знаков (from, to]:
+состояние до и после строк, попавших в шард. Шард пишется во временный файл
+.part и появляется в манифесте только после fsync и переименования, вместе с
+продвинутыми водяными знаками, одной атомарной записью манифеста. Повторный
+dump в тот же каталог продолжает выгрузку с места остановки: дописываются
+только изменённые строки.
+
+Команда replay отправляет шарды в Elasticsearch (--url, по умолчанию
+ELASTICSEARCH_URL) параллельно, по EXPORT_REPLAY_WORKERS шардов, каждый
+своим BulkLoader. Шарды разных запусков dump могут содержать разные версии
+одного документа, поэтому запуски загружаются по очереди, а параллельно —
+шарды одного запуска. Файлы читаются через mmap и распаковываются потоково,
+поэтому память не зависит от размера шарда. Отсутствующий индекс создаётся
+по схеме из index_schemas.py. Так одну выгрузку из реплики Postgres можно
+загрузить в несколько кластеров (staging, prod) без повторных запросов к
+базе; после загрузки инкрементальную выгрузку в кластер можно продолжать с
+водяных знаков to последнего шарда.
+
+Сжатие zstd требует пакета zstandard; без него используется gzip.
+
+Запуск:
+    python export.py dump /data/export movies genres persons
+    python export.py replay /data/export movies genres persons --url http://staging-es:9200
+"""
+import argparse
+import concurrent.futures
+import gzip
+import logging
+import mmap
+import os
+import zlib
+
+import requests
+
+import index_schemas
+from config import (
+    ELASTICSEARCH_URL,
+    EXPORT_COMPRESSION,
+    EXPORT_REPLAY_WORKERS,
+    EXPORT_SHARD_BYTES,
+    index_name_film_work,
+    index_name_genre,
+    index_name_person,
+)
+from indexes import TIMEOUT
+from loader import BulkLoader
+from spool import open_dead_letters
+from state import JsonFileStorage, State
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - зависит от окружения
+    zstandard = None
+
+MANIFEST = "manifest.json"
+SUFFIXES = {"zstd": ".zst", "gzip": ".gz", "none": ""}
+
+# Сколько байт сжатого файла распаковывается за раз при загрузке
+_READ_CHUNK = 4 * 1024 * 1024
+
+
+def _compression(name):
+    if name not in SUFFIXES:
+        raise ValueError(f"Неизвестное сжатие {name}: ожидается одно из {sorted(SUFFIXES)}")
+    if name == "zstd" and zstandard is None:
+        logging.warning("Пакет zstandard не установлен, шарды сжимаются gzip")
+        return "gzip"
+    return name
+
+
+def _open_writer(file, compression):
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=3).stream_writer(file, closefd=False)
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=file, mode="wb", compresslevel=6)
+    return file
+
+
+def _decompressor(compression):
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Для чтения шардов zstd нужен пакет zstandard")
+        return zstandard.ZstdDecompressor().decompressobj()
+    if compression == "gzip":
+        return zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+    return None
+
+
+def read_manifest(directory):
+    """Манифест выгрузки индекса или {}, если выгрузки в каталоге ещё не было."""
+    return JsonFileStorage(os.path.join(directory, MANIFEST)).retrieve_state()
+
+
+class ExportSink:
+    """
+    Запись документов _bulk одного индекса в шарды на диске.
+
+    Интерфейс как у loader.BulkLoader: обработчик on_success, переданный в
+    submit, вызывается, когда шард с документами пачки (и всех предыдущих)
+    закрывается, а flush закрывает текущий шард. Заодно это хранилище
+    состояния (см. state.State) для водяных знаков выгрузки: они хранятся в
+    манифесте, и изменения, сделанные обработчиками шарда, сохраняются одной
+    записью вместе с самим шардом.
+    """
+
+    def __init__(
+        self,
+        directory,
+        index,
+        shard_bytes=EXPORT_SHARD_BYTES,
+        compression=EXPORT_COMPRESSION,
+    ):
+        self.index = index
+        self.directory = os.path.join(directory, index)
+        self.shard_bytes = shard_bytes
+        self.compression = _compression(compression)
+        os.makedirs(self.directory, exist_ok=True)
+        self.storage = JsonFileStorage(os.path.join(self.directory, MANIFEST))
+        self.manifest = self.storage.retrieve_state() or {
+            "index": index,
+            "runs": 0,
+            "state": {},
+            "shards": [],
+        }
+        # Номер запуска выгрузки: replay загружает запуски по порядку
+        self.run = self.manifest["runs"] + 1
+        for name in os.listdir(self.directory):
+            if name.endswith(".part"):
+                # Шард, оборванный падением: водяной знак для него не сохранялся
+                os.remove(os.path.join(self.directory, name))
+        self.file = None
+        self.sealing = False
+
+    def retrieve_state(self):
+        return dict(self.manifest["state"])
+
+    def save_state(self, state):
+        self.manifest["state"] = dict(state)
+        # Во время закрытия шарда манифест сохраняется после обработчиков
+        if not self.sealing:
+            self.storage.save_state(self.manifest)
+
+    def _open(self):
+        seq = len(self.manifest["shards"]) + 1
+        self.name = f"{self.index}-{seq:06d}.ndjson{SUFFIXES[self.compression]}"
+        self.file = open(os.path.join(self.directory, self.name + ".part"), "wb")
+        self.writer = _open_writer(self.file, self.compression)
+        self.docs = 0
+        self.size = 0
+        self.callbacks = []
+
+    def submit(self, bulk_data, on_success=None):
+        if bulk_data:
+            if self.file is None:
+                self._open()
+            for doc in bulk_data:
+                self.writer.write(doc)
+                self.size += len(doc)
+            self.docs += len(bulk_data)
+        if on_success is not None:
+            if self.file is not None:
+                self.callbacks.append(on_success)
+            else:
+                on_success()
+        if self.file is not None and self.size >= self.shard_bytes:
+            self.flush()
+
+    def flush(self):
+        """Закрытие текущего шарда: fsync, переименование, обработчики и запись в манифест."""
+        if self.file is None:
+            return
+        if self.writer is not self.file:
+            self.writer.close()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+        path = os.path.join(self.directory, self.name)
+        os.replace(path + ".part", path)
+
+        previous = self.manifest["state"]
+        self.sealing = True
+        try:
+            for callback in self.callbacks:
+                callback()
+        finally:
+            self.sealing = False
+        self.manifest["runs"] = self.run
+        self.manifest["shards"].append({
+            "file": self.name,
+            "run": self.run,
+            "compression": self.compression,
+            "docs": self.docs,
+            "bytes": self.size,
+            "compressed_bytes": os.path.getsize(path),
+            "watermark": [previous, self.manifest["state"]],
+        })
+        self.storage.save_state(self.manifest)
+        logging.info(f"Шард {self.name}: {self.docs} документов, {self.size} байт")
+
+    def discard(self):
+        """Удаление незаконченного шарда; обработчики его пачек не вызываются."""
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        os.remove(os.path.join(self.directory, self.name + ".part"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.discard()
+
+
+def iter_shard_batches(path, compression):
+    """Пачки документов _bulk шарда; файл читается через mmap и распаковывается потоково."""
+    decompressor = _decompressor(compression)
+    pending = b""
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        with memoryview(data) as view:
+            for start in range(0, len(data), _READ_CHUNK):
+                with view[start:start + _READ_CHUNK] as piece:
+                    chunk = decompressor.decompress(piece) if decompressor else bytes(piece)
+                # Документ — две строки: действие и тело
+                lines = (pending + chunk).split(b"\n")
+                complete = len(lines) - 1
+                complete -= complete % 2
+                pending = b"\n".join(lines[complete:])
+                if complete:
+                    yield [
+                        b"%b\n%b\n" % (lines[i], lines[i + 1])
+                        for i in range(0, complete, 2)
+                    ]
+    if pending:
+        raise ValueError(f"Шард {path} оборван: {len(pending)} байт после последнего документа")
+
+
+def replay_shard(path, compression, index, url, dead_letters=None):
+    """Отправка шарда в Elasticsearch; возвращает число отправленных документов."""
+    sent = 0
+    with BulkLoader(url=url, dead_letters=dead_letters, name=index) as loader:
+        for docs in iter_shard_batches(path, compression):
+            loader.submit(docs)
+            sent += len(docs)
+    return sent
+
+
+def ensure_index(url, index):
+    """Создание индекса по схеме из index_schemas.py, если его (или алиаса) нет."""
+    if requests.head(f"{url}/{index}", timeout=TIMEOUT).status_code != 404:
+        return
+    schema = index_schemas.BY_INDEX[index]
+    response = requests.put(
+        f"{url}/{index}",
+        json={"settings": schema["settings"], "mappings": schema["mappings"]},
+        timeout=TIMEOUT,
+    )
+    response.raise_for_status()
+    logging.info(f"Создан индекс {index}")
+
+
+def replay(directory, indexes, url=ELASTICSEARCH_URL, workers=EXPORT_REPLAY_WORKERS):
+    """
+    Параллельная отправка шардов выгрузки в Elasticsearch по адресу url.
+
+    Операции index идемпотентны, поэтому после сбоя replay можно повторить.
+    :return: число отправленных документов
+    """
+    dead_letters = open_dead_letters()
+    runs = {}
+    for index in indexes:
+        manifest = read_manifest(os.path.join(directory, index))
+        if not manifest:
+            logging.warning(f"Выгрузки индекса {index} в {directory} нет")
+            continue
+        ensure_index(url, index)
+        for shard in manifest["shards"]:
+            runs.setdefault(shard["run"], []).append((index, shard))
+
+    sent = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        for run in sorted(runs):
+            sent += _replay_shards(pool, directory, runs[run], url, dead_letters)
+    return sent
+
+
+def _replay_shards(pool, directory, shards, url, dead_letters):
+    """Параллельная отправка шардов одного запуска dump."""
+    futures = {
+        pool.submit(
+            replay_shard,
+            os.path.join(directory, index, shard["file"]),
+            shard["compression"],
+            index,
+            url,
+            dead_letters,
+        ): shard
+        for index, shard in shards
+    }
+    sent = 0
+    for future in concurrent.futures.as_completed(futures):
+        shard = futures[future]
+        docs = future.result()
+        if docs != shard["docs"]:
+            raise ValueError(
+                f"Шард {shard['file']}: прочитано {docs} документов, "
+                f"в манифесте {shard['docs']}"
+            )
+        sent += docs
+        logging.info(f"Шард {shard['file']} загружен: {docs} документов")
+    return sent
+
+
+def dump(directory, indexes):
+    """Выгрузка индексов в шарды каталога directory; возвращает число выгруженных записей."""
+    from db import get_connection
+    from pipelines import load_film_works, load_genres, load_persons
+
+    loads = {
+        index_name_film_work: load_film_works,
+        index_name_genre: load_genres,
+        index_name_person: load_persons,
+    }
+    processed = 0
+    connection = get_connection()
+    try:
+        for index in indexes:
+            sink = ExportSink(directory, index)
+            count = loads[index](connection, State(sink), sink=sink)
+            logging.info(f"В {sink.directory} выгружено записей: {count}")
+            processed += count
+    finally:
+        connection.close()
+    return processed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Выгрузка документов в файлы и загрузка из них")
+    parser.add_argument("command", choices=("dump", "replay"))
+    parser.add_argument("directory")
+    parser.add_argument("indexes", nargs="+", choices=sorted(index_schemas.BY_INDEX))
+    parser.add_argument("--url", default=ELASTICSEARCH_URL, help="Elasticsearch для replay")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+    if args.command == "dump":
+        dump(args.directory, args.indexes)
+    else:
+        sent = replay(args.directory, args.indexes, url=args.url)
+        logging.info(f"Из {args.directory} отправлено документов: {sent}")
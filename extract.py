@@ -0,0 +1,138 @@
+import logging
+import time
+import uuid
+from datetime import datetime
+
+import psycopg2.extras
+
+from config import BATCH_SIZE, ITERSIZE
+
+KEYSET_CONDITION = "(updated_at, id) > (%(after_updated_at)s, %(after_id)s)"
+
+
+def keyset_where(after, params):
+    """Условие по ключу (updated_at, id) и его параметры для начала чтения после after."""
+    if after is None:
+        return "TRUE"
+    params["after_updated_at"], params["after_id"] = after
+    return KEYSET_CONDITION
+
+
+def row_key(row):
+    """Ключ (updated_at, id) строки для водяного знака."""
+    updated_at = row["updated_at"]
+    if isinstance(updated_at, str):
+        # Строка из COPY (см. copy_extract.py): время в ней не разобрано
+        updated_at = datetime.fromisoformat(updated_at)
+    return updated_at, row["id"]
+
+
+def iter_keyset_pages(
+    connection, query, batch_size=BATCH_SIZE, after=None, params=None, controller=None
+):
+    """
+    Постраничное чтение по ключу (updated_at, id) вместо LIMIT/OFFSET.
+
+    Каждая следующая страница запрашивается условием
+    (updated_at, id) > (последний updated_at, последний id), поэтому Postgres
+    находит её начало по индексу и не перечитывает предыдущие строки:
+    стоимость страницы не зависит от её номера. Ключ уникален, так что строки
+    с одинаковым updated_at не теряются и не читаются дважды.
+
+    Для быстрой работы на таблице нужен индекс (updated_at, id).
+
+    :param connection: соединение с Postgres
+    :param query: запрос с плейсхолдером {keyset} и параметром %(limit)s
+    :param batch_size: размер страницы
+    :param after: ключ (updated_at, id), после которого начинать чтение
+    :param params: дополнительные параметры запроса
+    :param controller: tuning.SizeController; если задан, размер каждой
+        страницы берётся из него, а время запроса передаётся ему
+    :return: генератор страниц (списков строк DictRow)
+    """
+    with connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+        while True:
+            if controller is not None:
+                batch_size = controller.size
+            page_params = {**(params or {}), "limit": batch_size}
+            keyset = keyset_where(after, page_params)
+            started = time.perf_counter()
+            cursor.execute(query.format(keyset=keyset), page_params)
+            rows = cursor.fetchall()
+            if not rows:
+                return
+            if controller is not None:
+                controller.observe(time.perf_counter() - started, len(rows))
+
+            last = rows[-1]
+            after = (last["updated_at"], last["id"])
+            logging.debug(f"Прочитана страница из {len(rows)} записей до ключа {after}")
+            yield rows
+
+            if len(rows) < batch_size:
+                return
+
+
+def iter_streaming(connection, query, after=None, itersize=ITERSIZE):
+    """
+    Потоковое чтение через именованный (серверный) курсор.
+
+    Postgres держит результат запроса на своей стороне, а клиент забирает его
+    порциями по itersize строк, поэтому память процесса не зависит от размера
+    таблицы. Курсор живёт внутри транзакции соединения, пока генератор не
+    исчерпан или не закрыт.
+
+    :param connection: соединение с Postgres
+    :param query: запрос с плейсхолдером {keyset}, упорядоченный по (updated_at, id)
+    :param after: ключ (updated_at, id), после которого начинать чтение
+    :param itersize: число строк, забираемых с сервера за один раз
+    :return: генератор строк DictRow
+    """
+    params = {}
+    keyset = keyset_where(after, params)
+    name = f"etl_{uuid.uuid4().hex}"
+    with connection.cursor(name=name, cursor_factory=psycopg2.extras.DictCursor) as cursor:
+        cursor.itersize = itersize
+        cursor.execute(query.format(keyset=keyset), params)
+        yield from cursor
+
+
+def iter_batches(rows, batch_size=BATCH_SIZE, controller=None):
+    """
+    Группировка потока строк в списки по batch_size.
+
+    :param controller: tuning.SizeController; если задан, размер пачки берётся
+        из него, а время чтения пачки из потока передаётся ему
+    """
+    if controller is not None:
+        batch_size = controller.size
+    batch = []
+    started = time.perf_counter()
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            if controller is not None:
+                controller.observe(time.perf_counter() - started, len(batch))
+            yield batch
+            if controller is not None:
+                batch_size = controller.size
+            batch = []
+            started = time.perf_counter()
+    if batch:
+        yield batch
+
+
+def iter_rows_by_ids(connection, ids, query, batch_size=BATCH_SIZE):
+    """
+    Чтение записей по списку id пачками по batch_size.
+
+    :param query: запрос с условием id = ANY(%(ids)s::uuid[])
+    :return: генератор списков строк DictRow
+    """
+    ids = sorted(ids)
+    with connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+        for start in range(0, len(ids), batch_size):
+            cursor.execute(query, {"ids": ids[start:start + batch_size]})
+            rows = cursor.fetchall()
+            if rows:
+                yield rows
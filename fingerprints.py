@@ -0,0 +1,134 @@
+"""
+Отпечатки последних записанных документов для подавления повторной отправки.
+
+Для каждого (индекс, _id) хранится 8-байтный хэш BLAKE2b тела документа,
+последнего подтверждённого Elasticsearch. Документ, хэш которого не изменился,
+отбрасывается до отправки в _bulk: такие документы появляются, например, когда
+в строке Postgres обновилась колонка, не попадающая в индекс. Это экономит
+запись в ES и слияния сегментов.
+
+Поле updated_at в отпечаток не входит: иначе каждая изменённая строка давала
+бы новый отпечаток и подавление не срабатывало бы как раз при инкрементальной
+выгрузке. Документ, у которого изменилось только updated_at, не отправляется,
+и в индексе остаётся прежнее значение; reconcile.py считает такой документ
+устаревшим и переписывает его.
+
+Хранилище — SQLite-файл на локальном диске (ETL_FINGERPRINTS_FILE). Если индекс
+в ES удалён или пересоздан не через rebuild.py, файл нужно удалить.
+"""
+import collections
+import hashlib
+import logging
+import sqlite3
+import threading
+
+# Ограничение SQLite на число параметров в одном запросе
+_SQLITE_MAX_PARAMS = 500
+# Начало поля, не входящего в отпечаток; в документах transform.py оно последнее.
+# Внутри строк JSON кавычка экранирована, поэтому такая подстрока встречается
+# только как ключ верхнего уровня.
+_UNHASHED_FIELD = b',"updated_at":'
+
+
+def document_hash(doc):
+    """
+    Хэш тела документа _bulk без поля updated_at.
+
+    Строка действия (в ней есть имя индекса) в хэш не входит.
+    """
+    body = doc.split(b"\n", 1)[1]
+    end = body.rfind(_UNHASHED_FIELD)
+    if end >= 0:
+        body = body[:end]
+    return hashlib.blake2b(body, digest_size=8).digest()
+
+
+class FingerprintStore:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                index_name TEXT NOT NULL,
+                id TEXT NOT NULL,
+                hash BLOB NOT NULL,
+                PRIMARY KEY (index_name, id)
+            ) WITHOUT ROWID
+            """
+        )
+        self.lock = threading.Lock()
+        # (индекс, "checked" | "skipped") -> число документов
+        self.counters = collections.Counter()
+
+    def filter(self, index, ids, bulk_data, record_only=False):
+        """
+        Отбрасывание документов, не изменившихся с последней записи.
+
+        :param ids: _id документов в том же порядке, что и bulk_data
+        :param record_only: ничего не отбрасывать, только вычислить отпечатки
+            (для записи в новый пустой индекс)
+        :return: пара (оставшиеся документы, отпечатки для save после подтверждения)
+        """
+        hashes = [document_hash(doc) for doc in bulk_data]
+        previous = {} if record_only else self._lookup(index, ids)
+
+        kept = []
+        fingerprints = []
+        for doc_id, doc_hash, doc in zip(ids, hashes, bulk_data):
+            if previous.get(doc_id) == doc_hash:
+                continue
+            kept.append(doc)
+            fingerprints.append((index, doc_id, doc_hash))
+
+        with self.lock:
+            self.counters[index, "checked"] += len(bulk_data)
+            self.counters[index, "skipped"] += len(bulk_data) - len(kept)
+        return kept, fingerprints
+
+    def save(self, fingerprints):
+        """Сохранение отпечатков документов, подтверждённых Elasticsearch."""
+        if not fingerprints:
+            return
+        with self.lock:
+            self.connection.execute("BEGIN")
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO fingerprints (index_name, id, hash) VALUES (?, ?, ?)",
+                fingerprints,
+            )
+            self.connection.execute("COMMIT")
+
+    def skip_rate(self, index):
+        """Доля отброшенных документов индекса с момента запуска."""
+        checked = self.counters[index, "checked"]
+        return self.counters[index, "skipped"] / checked if checked else 0.0
+
+    def log_stats(self, index):
+        logging.info(
+            f"Отпечатки {index}: пропущено {self.counters[index, 'skipped']} "
+            f"из {self.counters[index, 'checked']} документов ({self.skip_rate(index):.1%})"
+        )
+
+    def _lookup(self, index, ids):
+        previous = {}
+        with self.lock:
+            for start in range(0, len(ids), _SQLITE_MAX_PARAMS):
+                chunk = ids[start:start + _SQLITE_MAX_PARAMS]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.connection.execute(
+                    f"SELECT id, hash FROM fingerprints "
+                    f"WHERE index_name = ? AND id IN ({placeholders})",
+                    [index, *chunk],
+                )
+                previous.update(rows)
+        return previous
+
+
+def open_fingerprint_store(path):
+    """Хранилище отпечатков или None, если подавление отключено (путь не задан)."""
+    if not path:
+        return None
+    return FingerprintStore(path)
@@ -0,0 +1,109 @@
+"""
+Схемы индексов Elasticsearch: настройки и маппинги movies, genres и persons.
+
+Во все индексы добавлено поле updated_at — время изменения строки в Postgres;
+по нему reconcile.py сверяет индексы с базой.
+"""
+from config import index_name_film_work, index_name_genre, index_name_person
+
+ANALYSIS = {
+    "filter": {
+        "english_stop": {"type": "stop", "stopwords": "_english_"},
+        "english_stemmer": {"type": "stemmer", "language": "english"},
+        "english_possessive_stemmer": {
+            "type": "stemmer",
+            "language": "possessive_english",
+        },
+        "russian_stop": {"type": "stop", "stopwords": "_russian_"},
+        "russian_stemmer": {"type": "stemmer", "language": "russian"},
+    },
+    "analyzer": {
+        "ru_en": {
+            "tokenizer": "standard",
+            "filter": [
+                "lowercase",
+                "english_stop",
+                "english_stemmer",
+                "english_possessive_stemmer",
+                "russian_stop",
+                "russian_stemmer",
+            ],
+        }
+    },
+}
+
+SETTINGS = {
+    "refresh_interval": "1s",
+    "analysis": ANALYSIS,
+}
+
+_TEXT = {"type": "text", "analyzer": "ru_en"}
+_TEXT_WITH_RAW = {**_TEXT, "fields": {"raw": {"type": "keyword"}}}
+_PERSON_REF = {
+    "type": "nested",
+    "dynamic": "strict",
+    "properties": {
+        "id": {"type": "keyword"},
+        "name": _TEXT,
+    },
+}
+
+MOVIES = {
+    "settings": SETTINGS,
+    "mappings": {
+        "dynamic": "strict",
+        "properties": {
+            "id": {"type": "keyword"},
+            "imdb_rating": {"type": "float"},
+            "genre": {"type": "keyword"},
+            "title": _TEXT_WITH_RAW,
+            "description": _TEXT,
+            "director": _TEXT,
+            "actors_names": _TEXT,
+            "writers_names": _TEXT,
+            "actors": _PERSON_REF,
+            "writers": _PERSON_REF,
+            "updated_at": {"type": "date"},
+        },
+    },
+}
+
+GENRES = {
+    "settings": SETTINGS,
+    "mappings": {
+        "dynamic": "strict",
+        "properties": {
+            "id": {"type": "keyword"},
+            "name": _TEXT_WITH_RAW,
+            "description": _TEXT,
+            "updated_at": {"type": "date"},
+        },
+    },
+}
+
+PERSONS = {
+    "settings": SETTINGS,
+    "mappings": {
+        "dynamic": "strict",
+        "properties": {
+            "id": {"type": "keyword"},
+            "full_name": _TEXT_WITH_RAW,
+            "films": {
+                "type": "nested",
+                "dynamic": "strict",
+                "properties": {
+                    "id": {"type": "keyword"},
+                    "roles": {"type": "keyword"},
+                },
+            },
+            "updated_at": {"type": "date"},
+        },
+    },
+}
+
+# Схема по имени (алиасу) индекса
+BY_INDEX = {
+    index_name_film_work: MOVIES,
+    index_name_genre: GENRES,
+    index_name_person: PERSONS,
+}
@@ -0,0 +1,187 @@
+"""
+Управление индексами Elasticsearch: версии индексов и переключение алиасов.
+
+Публичное имя (movies, genres, persons) — это алиас, указывающий на одну из
+версий индекса вида movies_20240101120000. Перестроение пишет в новую версию,
+созданную с отключёнными refresh и репликами, затем возвращает настройки,
+выполняет force merge и атомарно переключает алиас одним запросом _aliases.
+"""
+import logging
+import threading
+from datetime import datetime, timezone
+
+import requests
+
+from config import (
+    ELASTICSEARCH_URL,
+    ES_CONNECT_TIMEOUT,
+    ES_NUMBER_OF_REPLICAS,
+    ES_REQUEST_TIMEOUT,
+)
+
+# Таймауты (соединение, ответ) служебных запросов
+TIMEOUT = (ES_CONNECT_TIMEOUT, ES_REQUEST_TIMEOUT)
+
+# Настройки на время массовой загрузки
+BULK_SETTINGS = {"refresh_interval": "-1", "number_of_replicas": 0}
+
+# Алиасы, маппинг которых уже обновлён в этом процессе
+_mapped = set()
+_mapped_lock = threading.Lock()
+
+
+def es_request(method, path, **kwargs):
+    kwargs.setdefault("timeout", TIMEOUT)
+    response = requests.request(method, f"{ELASTICSEARCH_URL}/{path}", **kwargs)
+    response.raise_for_status()
+    return response.json()
+
+
+def versioned_name(alias):
+    return f"{alias}_{datetime.now(timezone.utc):%Y%m%d%H%M%S}"
+
+
+def create_versioned_index(alias, schema):
+    """Создание новой версии индекса со схемой schema и настройками для загрузки."""
+    name = versioned_name(alias)
+    body = {
+        "settings": {**schema["settings"], **BULK_SETTINGS},
+        "mappings": schema["mappings"],
+    }
+    es_request("PUT", name, json=body)
+    logging.info(f"Создан индекс {name}")
+    return name
+
+
+def create_index(name, schema):
+    """
+    Создание индекса name по схеме, если его ещё нет.
+
+    :return: True, если индекс создан этим вызовом
+    """
+    response = requests.put(
+        f"{ELASTICSEARCH_URL}/{name}",
+        json={"settings": schema["settings"], "mappings": schema["mappings"]},
+        timeout=TIMEOUT,
+    )
+    if response.status_code == 400 and "resource_already_exists_exception" in response.text:
+        # Индекс успел создать другой процесс
+        return False
+    response.raise_for_status()
+    logging.info(f"Создан индекс {name}")
+    return True
+
+
+def put_mapping(alias, schema):
+    """
+    Добавление в маппинг индекса полей схемы, которых в нём нет.
+
+    Определения существующих полей не сравниваются и не отправляются: изменить
+    их Elasticsearch всё равно не даст, а отличие индекса от схемы (например,
+    созданного первым запросом _bulk с динамическим маппингом) не должно
+    останавливать загрузку. Если индекса нет, он создаётся по схеме.
+    Повторный вызов ничего не меняет.
+    """
+    response = requests.get(f"{ELASTICSEARCH_URL}/{alias}/_mapping", timeout=TIMEOUT)
+    if response.status_code == 404:
+        if create_index(alias, schema):
+            return
+        response = requests.get(f"{ELASTICSEARCH_URL}/{alias}/_mapping", timeout=TIMEOUT)
+    response.raise_for_status()
+    # Алиас может указывать на несколько индексов: поле должно быть в каждом
+    present = None
+    for description in response.json().values():
+        fields = description.get("mappings", {}).get("properties", {}).keys()
+        present = set(fields) if present is None else present & fields
+    missing = {
+        field: definition
+        for field, definition in schema["mappings"]["properties"].items()
+        if field not in (present or ())
+    }
+    if missing:
+        es_request("PUT", f"{alias}/_mapping", json={"properties": missing})
+        logging.info(f"В маппинг {alias} добавлены поля: {', '.join(sorted(missing))}")
+
+
+def ensure_mapping(alias, schema):
+    """
+    put_mapping перед первой записью в алиас, один раз за процесс.
+
+    Индекс со "dynamic": "strict", созданный до появления поля в схеме
+    (например, updated_at), отклоняет документы с ним окончательно, без
+    повторов, поэтому недостающие поля добавляются до загрузки, а
+    отсутствующий индекс создаётся по схеме. Если запрос не удался,
+    исключение пробрасывается, и попытка повторяется при следующей загрузке.
+    """
+    with _mapped_lock:
+        if alias in _mapped:
+            return
+        put_mapping(alias, schema)
+        _mapped.add(alias)
+
+
+def finalize_index(name, schema):
+    """Возврат рабочих настроек после загрузки и слияние сегментов."""
+    es_request("POST", f"{name}/_refresh")
+    # Слияние большого индекса идёт дольше любого разумного таймаута ответа
+    es_request(
+        "POST",
+        f"{name}/_forcemerge",
+        params={"max_num_segments": 1},
+        timeout=(ES_CONNECT_TIMEOUT, None),
+    )
+    es_request(
+        "PUT",
+        f"{name}/_settings",
+        json={
+            "index": {
+                "refresh_interval": schema["settings"].get("refresh_interval", "1s"),
+                "number_of_replicas": ES_NUMBER_OF_REPLICAS,
+            }
+        },
+    )
+    logging.info(f"Индекс {name} готов к переключению")
+
+
+def swap_alias(alias, name):
+    """
+    Атомарное переключение алиаса на индекс name.
+
+    Если под публичным именем раньше был обычный индекс (до перехода на
+    алиасы), он удаляется в том же запросе.
+    :return: имена индексов, на которые алиас указывал раньше
+    """
+    response = requests.get(f"{ELASTICSEARCH_URL}/{alias}", timeout=TIMEOUT)
+    actions = [{"add": {"index": name, "alias": alias}}]
+    previous = []
+    if response.status_code == 200:
+        for index, description in response.json().items():
+            if index == alias:
+                actions.insert(0, {"remove_index": {"index": alias}})
+            elif alias in description.get("aliases", {}):
+                actions.insert(0, {"remove": {"index": index, "alias": alias}})
+                previous.append(index)
+    es_request("POST", "_aliases", json={"actions": actions})
+    logging.info(f"Алиас {alias} переключён на {name}")
+    return previous
+
+
+def delete_old_versions(alias, current):
+    """
+    Удаление версий индекса alias, созданных раньше версии current.
+
+    Более новые версии не трогаются: их может строить параллельное
+    перестроение. Индекс, на который алиас указывает сейчас, не удаляется,
+    даже если он старше current.
+    """
+    targets = es_request("GET", f"_alias/{alias}")
+    indices = es_request("GET", f"_cat/indices/{alias}_*", params={"format": "json", "h": "index"})
+    for index in indices:
+        name = index["index"]
+        suffix = name[len(alias) + 1:]
+        # Суффикс версии — время создания фиксированной ширины, см. versioned_name
+        if not (suffix.isdigit() and len(suffix) == 14):
+            continue
+        if name < current and name not in targets:
+            es_request("DELETE", name)
+            logging.info(f"Удалён индекс {name}")
@@ -0,0 +1,219 @@
+"""
+Выгрузка в режиме, близком к реальному времени, через LISTEN/NOTIFY Postgres.
+
+Триггеры на таблицах content публикуют в канал NOTIFY_CHANNEL сообщения вида
+"таблица:id"; изменения таблиц связей публикуются как "film_work:id фильма",
+а изменения person_film_work ещё и как "person_films:id персоны" (поле films
+индекса persons). Демон слушает канал на отдельном соединении в режиме
+autocommit, копит уведомления NOTIFY_WINDOW секунд и переиндексирует только
+затронутые документы: изменённые персоны и жанры, персоны с изменёнными
+связями, а также фильмы — изменённые напрямую и связанные с изменёнными
+персонами и жанрами.
+
+Уведомления не хранятся: сообщения, отправленные, пока демон не слушал канал,
+теряются. Поэтому при старте, после переподключения и раз в CATCHUP_INTERVAL
+секунд выполняется обычная инкрементальная выгрузка по водяным знакам.
+Удаление строк из Postgres документы из индексов не удаляет, как и в
+инкрементальной выгрузке.
+
+Запуск:
+    python listener.py --install-triggers   # один раз, создать триггеры
+    python listener.py
+"""
+import argparse
+import collections
+import logging
+import select
+import threading
+import time
+
+import psycopg2
+from psycopg2 import sql
+
+from config import CATCHUP_INTERVAL, NOTIFY_CHANNEL, NOTIFY_WINDOW, STATE_FILE_PATH
+from db import get_connection
+from metrics import start_http_server
+from pipelines import (
+    drain_spool,
+    fetch_and_send_film_works_to_elasticsearch,
+    fetch_and_send_genres_to_elasticsearch,
+    fetch_and_send_persons_to_elasticsearch,
+    reindex_film_works,
+    reindex_genres,
+    reindex_persons,
+)
+from propagation import RELATED_TABLES, linked_film_work_ids
+from state import JsonFileStorage, State
+
+NOTIFY_FUNCTION = """
+    CREATE OR REPLACE FUNCTION content.etl_notify_change() RETURNS trigger AS $$
+    DECLARE
+        changed record;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            changed := OLD;
+        ELSE
+            changed := NEW;
+        END IF;
+        IF TG_TABLE_NAME IN ('person_film_work', 'genre_film_work') THEN
+            PERFORM pg_notify(TG_ARGV[0], 'film_work:' || changed.film_work_id);
+            IF TG_TABLE_NAME = 'person_film_work' THEN
+                PERFORM pg_notify(TG_ARGV[0], 'person_films:' || changed.person_id);
+            END IF;
+        ELSE
+            PERFORM pg_notify(TG_ARGV[0], TG_TABLE_NAME || ':' || changed.id);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+NOTIFY_TRIGGER = """
+    DROP TRIGGER IF EXISTS etl_notify ON content.{table};
+    CREATE TRIGGER etl_notify
+        AFTER INSERT OR UPDATE OR DELETE ON content.{table}
+        FOR EACH ROW EXECUTE FUNCTION content.etl_notify_change({channel});
+"""
+
+# Ошибки, после которых соединения нужно открыть заново
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+NOTIFY_TABLES = ("film_work", "person", "genre", "person_film_work", "genre_film_work")
+
+
+def install_triggers(connection, channel=NOTIFY_CHANNEL):
+    """Создание функции уведомления и триггеров на таблицах content."""
+    with connection.cursor() as cursor:
+        cursor.execute(NOTIFY_FUNCTION)
+        for table in NOTIFY_TABLES:
+            cursor.execute(
+                sql.SQL(NOTIFY_TRIGGER).format(
+                    table=sql.Identifier(table), channel=sql.Literal(channel)
+                )
+            )
+    connection.commit()
+    logging.info(f"Триггеры уведомлений установлены, канал {channel}")
+
+
+def listen(channel=NOTIFY_CHANNEL):
+    """Соединение в режиме autocommit, подписанное на канал channel."""
+    connection = get_connection()
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute(sql.SQL("LISTEN {};").format(sql.Identifier(channel)))
+    return connection
+
+
+def collect_changes(connection, timeout, window=NOTIFY_WINDOW):
+    """
+    Ожидание уведомлений до timeout секунд, затем накопление их в течение window.
+
+    :return: словарь таблица -> множество id; пустой, если уведомлений не было
+    """
+    changes = collections.defaultdict(set)
+    if not select.select([connection], [], [], timeout)[0]:
+        return changes
+
+    deadline = time.monotonic() + window
+    while True:
+        connection.poll()
+        while connection.notifies:
+            notify = connection.notifies.pop(0)
+            table, _, item_id = notify.payload.partition(":")
+            changes[table].add(item_id)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([connection], [], [], remaining)[0]:
+            return changes
+
+
+def apply_changes(connection, changes):
+    """Переиндексация записей из уведомлений и связанных с ними фильмов."""
+    film_work_ids = set(changes.get("film_work", ()))
+    with connection.cursor() as cursor:
+        for table in RELATED_TABLES:
+            if changes.get(table):
+                film_work_ids |= linked_film_work_ids(cursor, table, changes[table])
+
+    person_ids = changes.get("person", set()) | changes.get("person_films", set())
+    if person_ids:
+        reindex_persons(connection, person_ids)
+    if changes.get("genre"):
+        reindex_genres(connection, changes["genre"])
+    if film_work_ids:
+        reindex_film_works(connection, film_work_ids)
+    connection.commit()
+
+
+def catch_up(connection, state):
+    """Инкрементальная выгрузка по водяным знакам."""
+    logging.info("Догоняющая выгрузка по водяным знакам")
+    fetch_and_send_persons_to_elasticsearch(connection, state)
+    fetch_and_send_genres_to_elasticsearch(connection, state)
+    fetch_and_send_film_works_to_elasticsearch(connection, state)
+    connection.commit()
+
+
+def run(state):
+    """Основной цикл; при потере соединения переподключается и догоняет."""
+    # Разгрузчик spool работает всё время жизни процесса
+    threading.Thread(
+        target=drain_spool, args=(threading.Event(),), name="spool", daemon=True
+    ).start()
+    while True:
+        listener = connection = None
+        try:
+            # Подписка до догоняющей выгрузки: изменения, сделанные во время
+            # выгрузки, придут уведомлениями
+            listener = listen()
+            connection = get_connection()
+            catch_up(connection, state)
+            next_catch_up = time.monotonic() + CATCHUP_INTERVAL
+            while True:
+                timeout = max(next_catch_up - time.monotonic(), 0)
+                changes = collect_changes(listener, timeout)
+                if changes:
+                    logging.info(
+                        "Уведомления: "
+                        + ", ".join(f"{table} {len(ids)}" for table, ids in changes.items())
+                    )
+                    try:
+                        apply_changes(connection, changes)
+                    except CONNECTION_ERRORS:
+                        raise
+                    except Exception as e:
+                        # Пропущенное догонит инкрементальная выгрузка
+                        connection.rollback()
+                        logging.error(f"Ошибка переиндексации по уведомлениям: {e}")
+                if time.monotonic() >= next_catch_up:
+                    catch_up(connection, state)
+                    next_catch_up = time.monotonic() + CATCHUP_INTERVAL
+        except CONNECTION_ERRORS as e:
+            logging.error(f"Потеряно соединение с Postgres: {e}")
+            time.sleep(1)
+        finally:
+            for conn in (listener, connection):
+                if conn is not None and not conn.closed:
+                    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Выгрузка по уведомлениям Postgres")
+    parser.add_argument(
+        "--install-triggers",
+        action="store_true",
+        help="создать триггеры уведомлений и выйти",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+    if args.install_triggers:
+        connection = get_connection()
+        try:
+            install_triggers(connection)
+        finally:
+            connection.close()
+    else:
+        start_http_server()
+        run(State(JsonFileStorage(STATE_FILE_PATH)))
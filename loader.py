@@ -0,0 +1,378 @@
+"""
+Загрузка в Elasticsearch через _bulk.
+
+BulkLoader копит документы и нарезает из них запросы _bulk по числу документов
+и по размеру тела в байтах, отправляет до concurrency запросов параллельно
+через общую requests.Session с пулом keep-alive соединений и вызывает
+обработчики успешной записи строго в порядке отправки.
+
+Ответ _bulk разбирается по элементам items: документы, отклонённые из-за
+перегрузки (429) или временной ошибки (5xx), отправляются повторно с
+экспоненциальной задержкой и jitter, а при отказах 429 загрузчик дополнительно
+снижает темп отправки. Если задан регулятор (tuning.SizeController), число
+документов в запросе берётся из него, а он получает время, объём и отказы
+каждого запроса. Неустранимые ошибки (например, несоответствие маппингу)
+логируются с id документа и не повторяются; если задан файл недоставленных
+(spool.DeadLetters), документы записываются в него для повторной отправки.
+
+Повтор запроса целиком и повтор отклонённых документов — одна попытка
+отправки под декоратором backoff (bulk_retry) с общим сроком
+BULK_RETRY_DEADLINE. Нарезка, порядок обработчиков, разбор ответа и
+параметры повторов не зависят от способа ввода-вывода (BulkBatcher,
+handle_response, bulk_retry, report_failures) и общие с асинхронным
+загрузчиком (async_loader.py); в загрузчиках остаются только отправка и ожидание.
+"""
+import collections
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from backoff import backoff
+from config import (
+    BULK_CONCURRENCY,
+    BULK_GZIP_LEVEL,
+    BULK_MAX_BYTES,
+    BULK_MAX_DOCS,
+    BULK_RETRY_DEADLINE,
+    BULK_TIMEOUT,
+    ELASTICSEARCH_URL,
+    ES_CONNECT_TIMEOUT,
+)
+from metrics import bulk_bytes_total, stage_seconds
+from serializer import NdjsonBuffer, compress, split_documents
+
+
+class BulkRejected(Exception):
+    """Elasticsearch отклонил запрос целиком: перегрузка (429) или временная ошибка (5xx)."""
+
+
+class BulkError(Exception):
+    """Документы не удалось записать за отведённое на повторы время."""
+
+
+class DocumentsRejected(BulkError):
+    """Часть документов отклонена в ответе _bulk (429, 5xx) и отправляется повторно."""
+
+
+def is_retryable(status):
+    return status == 429 or status >= 500
+
+
+class Throttle:
+    """
+    Пауза между запросами _bulk, общая для всех потоков загрузчика.
+
+    Удваивается при каждом отказе 429 (до max_delay) и уменьшается вдвое
+    после каждого запроса без отказов.
+    """
+
+    def __init__(self, min_delay=0.05, max_delay=5.0):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay = 0.0
+        self.next_send = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            send_at = max(now, self.next_send)
+            self.next_send = send_at + self.delay
+        if send_at > now:
+            time.sleep(send_at - now)
+
+    def slow_down(self):
+        with self.lock:
+            self.delay = min(max(self.delay * 2, self.min_delay), self.max_delay)
+            logging.warning(f"Elasticsearch перегружен, пауза между запросами {self.delay:.2f} с")
+
+    def speed_up(self):
+        with self.lock:
+            self.delay = self.delay / 2 if self.delay > self.min_delay else 0.0
+
+
+def bulk_retry(*exception_type):
+    """
+    Повторы попытки отправки _bulk: при отказе запроса целиком (исключения
+    exception_type и BulkRejected) паузы растут от 1 с, при отказе части
+    документов (DocumentsRejected) — от 0,5 с; не дольше BULK_RETRY_DEADLINE
+    с первой попытки, после чего исключение выбрасывается.
+    """
+    return backoff(
+        start_sleep_time=1,
+        border_sleep_time=30,
+        max_iter=None,
+        exception_type=(BulkRejected, *exception_type),
+        jitter=True,
+        deadline=BULK_RETRY_DEADLINE,
+        policies={DocumentsRejected: {"start_sleep_time": 0.5}},
+        reraise=True,
+    )
+
+
+def handle_response(result, body, offsets, throttle):
+    """
+    Разбор ответа _bulk по элементам items.
+
+    Темп отправки замедляется, если среди отказов есть 429, и ускоряется иначе.
+    :return: пара (документы для повтора, список (outcome, документ) неустранимых отказов)
+    """
+    if not result["errors"]:
+        throttle.speed_up()
+        return [], []
+
+    retry = []
+    failures = []
+    rejected = False
+    for doc, item in zip(split_documents(body, offsets), result["items"]):
+        # {"index": {"_id": ..., "status": ..., "error": {...}}}
+        outcome = next(iter(item.values()))
+        status = outcome.get("status", 200)
+        if status < 300:
+            continue
+        if is_retryable(status):
+            retry.append(doc)
+            rejected = rejected or status == 429
+        else:
+            failures.append((outcome, doc))
+
+    if rejected:
+        throttle.slow_down()
+    else:
+        throttle.speed_up()
+    return retry, failures
+
+
+def is_throttled(result):
+    """Есть ли среди документов ответа _bulk отказы 429."""
+    return result["errors"] and any(
+        next(iter(item.values())).get("status") == 429 for item in result["items"]
+    )
+
+
+def join_documents(docs):
+    """Тело _bulk из документов и смещения их начала."""
+    offsets = list(itertools.accumulate((len(doc) for doc in docs[:-1]), initial=0))
+    return b"".join(docs), offsets
+
+
+def report_failures(failures, dead_letters=None, rejected=None):
+    """
+    Неустранимые отказы: в лог с id документа и в файл недоставленных, если он задан.
+
+    :param rejected: множество, в которое добавляются _id отклонённых документов
+    :return: число отказов
+    """
+    for outcome, doc in failures:
+        error = outcome.get("error", {})
+        if rejected is not None:
+            rejected.add(outcome.get("_id"))
+        if dead_letters is not None:
+            dead_letters.write(doc, outcome)
+        logging.error(
+            f"Документ {outcome.get('_id')} не записан в индекс {outcome.get('_index')}: "
+            f"{error.get('type')}: {error.get('reason')}"
+        )
+    return len(failures)
+
+
+class BulkBatcher:
+    """
+    Нарезка документов на запросы _bulk и порядок обработчиков успешной записи.
+
+    Ввода-вывода здесь нет: add и take возвращают готовые запросы (тело,
+    смещения документов, обработчики), загрузчик отправляет их и кладёт в
+    pending пары (задача отправки, обработчики) — Future или asyncio.Task.
+    Обработчик пачки, все документы которой уже отправлены, присоединяется к
+    последнему запросу, а если запросов в полёте нет — вызывается сразу.
+    """
+
+    def __init__(self, max_docs, max_bytes, controller=None):
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.controller = controller
+        self.buffer = NdjsonBuffer()
+        self.callbacks = []
+        self.pending = collections.deque()
+
+    def add(self, bulk_data, on_success=None):
+        """:return: список запросов, готовых к отправке"""
+        if self.controller is not None:
+            self.max_docs = self.controller.size
+        ready = []
+        for doc in bulk_data:
+            if len(self.buffer) and (
+                len(self.buffer) >= self.max_docs
+                or self.buffer.size + len(doc) > self.max_bytes
+            ):
+                ready.append(self.take())
+            self.buffer.append(doc)
+
+        if on_success is not None:
+            if len(self.buffer):
+                self.callbacks.append(on_success)
+            elif ready:
+                ready[-1][2].append(on_success)
+            elif self.pending:
+                self.pending[-1][1].append(on_success)
+            else:
+                on_success()
+        if len(self.buffer) >= self.max_docs or self.buffer.size >= self.max_bytes:
+            ready.append(self.take())
+        return ready
+
+    def take(self):
+        """Содержимое буфера как запрос (тело, смещения, обработчики) или None, если он пуст."""
+        if not len(self.buffer):
+            return None
+        body, offsets = self.buffer.take()
+        callbacks = self.callbacks
+        self.callbacks = []
+        return body, offsets, callbacks
+
+
+class BulkLoader:
+    """
+    Параллельный загрузчик _bulk с нарезкой по байтам и числу документов.
+
+    Документ — bytes с парой строк NDJSON (действие и тело). Обработчик on_success,
+    переданный в submit, вызывается после того, как Elasticsearch подтвердил
+    все запросы, содержащие документы этой и всех предыдущих пачек, — на нём
+    удобно продвигать водяной знак. Обработчики вызываются в потоке, который
+    вызывает submit или flush. name — метка pipeline в метриках загрузчика.
+
+    В rejected копятся _id документов, отклонённых окончательно (статус 4xx
+    в ответе _bulk): обработчик on_success вызывается и для пачки с такими
+    документами, и по этому множеству он может отличить записанные.
+    """
+
+    def __init__(
+        self,
+        url=ELASTICSEARCH_URL,
+        max_docs=BULK_MAX_DOCS,
+        max_bytes=BULK_MAX_BYTES,
+        concurrency=BULK_CONCURRENCY,
+        gzip_level=BULK_GZIP_LEVEL,
+        controller=None,
+        dead_letters=None,
+        name="bulk",
+    ):
+        self.url = f"{url}/_bulk"
+        self.name = name
+        self.controller = controller
+        self.dead_letters = dead_letters
+        self.batcher = BulkBatcher(max_docs, max_bytes, controller)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=concurrency, pool_block=True
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Content-Type"] = "application/x-ndjson"
+        self.gzip_level = gzip_level
+        if gzip_level:
+            self.session.headers["Content-Encoding"] = "gzip"
+        self.executor = ThreadPoolExecutor(concurrency, thread_name_prefix="bulk")
+        # Не больше concurrency запросов в полёте: submit блокируется (backpressure)
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.throttle = Throttle()
+        self.failed = 0
+        self.failed_lock = threading.Lock()
+        self.rejected = set()
+
+    def submit(self, bulk_data, on_success=None):
+        """
+        Добавление пачки документов _bulk (см. serializer.bulk_line) в очередь отправки.
+
+        Выбрасывает исключение, если один из ранее отправленных запросов завершился ошибкой.
+        """
+        for request in self.batcher.add(bulk_data, on_success):
+            self._dispatch(*request)
+        self._drain(block=False)
+
+    def flush(self):
+        """Отправка остатка и ожидание подтверждения всех запросов."""
+        request = self.batcher.take()
+        if request is not None:
+            self._dispatch(*request)
+        self._drain(block=True)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self.close()
+
+    def _dispatch(self, body, offsets, callbacks):
+        self.slots.acquire()
+        future = self.executor.submit(self._send, [body, offsets])
+        future.add_done_callback(lambda _: self.slots.release())
+        self.batcher.pending.append((future, callbacks))
+
+    def _drain(self, block):
+        pending = self.batcher.pending
+        while pending:
+            future, callbacks = pending[0]
+            if not block and not future.done():
+                return
+            future.result()
+            pending.popleft()
+            for callback in callbacks:
+                callback()
+
+    @bulk_retry(requests.ConnectionError, requests.Timeout)
+    def _send(self, request):
+        """
+        Попытка отправки документов request = [тело, смещения].
+
+        Если часть документов отклонена с 429 или 5xx, в request остаются
+        только они, и bulk_retry повторяет попытку с ними.
+        """
+        body, offsets = request
+        logging.debug(f"Отправка в _bulk: {len(offsets)} документов, {len(body)} байт")
+        data = compress(body, self.gzip_level) if self.gzip_level else body
+        retry, failures = handle_response(self._post(data), body, offsets, self.throttle)
+        if failures:
+            failed = report_failures(failures, self.dead_letters, self.rejected)
+            with self.failed_lock:
+                self.failed += failed
+        if retry:
+            request[:] = join_documents(retry)
+            raise DocumentsRejected(f"отклонено документов: {len(retry)}")
+
+    def _post(self, body):
+        self.throttle.wait()
+        started = time.perf_counter()
+        response = self.session.post(
+            self.url, data=body, timeout=(ES_CONNECT_TIMEOUT, BULK_TIMEOUT)
+        )
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, pipeline=self.name, stage="bulk")
+        bulk_bytes_total.inc(len(body), pipeline=self.name)
+        size = len(body) + len(response.content)
+        if is_retryable(response.status_code):
+            if response.status_code == 429:
+                self.throttle.slow_down()
+            self._observe(elapsed, size, throttled=response.status_code == 429)
+            raise BulkRejected(f"{response.status_code}: {response.text[:200]}")
+        response.raise_for_status()
+        result = response.json()
+        self._observe(elapsed, size, is_throttled(result), len(result["items"]))
+        return result
+
+    def _observe(self, elapsed, size, throttled, count=0):
+        if self.controller is not None:
+            self.controller.observe(elapsed, count, size, throttled)
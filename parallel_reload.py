@@ -0,0 +1,183 @@
+"""
+Параллельная полная перезагрузка индекса movies.
+
+Таблица content.film_work делится на непересекающиеся части — диапазоны
+ключа (updated_at, id) равного размера или остатки от хэша id, — и каждая
+часть выгружается отдельным процессом со своим соединением с Postgres и своим
+загрузчиком _bulk. Координатор экспортирует снимок данных через
+pg_export_snapshot(), и все процессы читают один и тот же согласованный снимок.
+
+Документы отправляются все, без сверки с хранилищем отпечатков, но их
+отпечатки сохраняются после подтверждения пачки, как при перестроении
+(rebuild.py): следующий инкрементальный запуск не отправит их повторно.
+
+После успешной выгрузки водяные знаки film_work, person и genre для movies
+выставляются по этому снимку, так что следующий инкрементальный запуск
+продолжит с места, где закончилась перезагрузка.
+
+Запуск:
+    python parallel_reload.py --workers 8 --partition-by range
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import index_schemas
+from config import STATE_FILE_PATH, index_name_film_work
+from db import get_connection
+from engine import run_pipeline
+from extract import iter_keyset_pages
+from indexes import ensure_mapping
+from loader import BulkLoader
+from pipelines import bulk_loader, bulk_transformer, log_fingerprint_stats
+from propagation import get_last_keys
+from queries import (
+    FILM_WORK_COUNT_QUERY,
+    FILM_WORK_KEY_AT_QUERY,
+    FILM_WORK_PARTITION_QUERY,
+    LAST_KEY_QUERY,
+)
+from state import JsonFileStorage, State
+from transform import MOVIES
+
+UPPER_BOUND_CONDITION = "(updated_at, id) <= (%(until_updated_at)s, %(until_id)s)"
+HASH_CONDITION = "abs(hashtext(id::text) %% %(workers)s) = %(worker)s"
+
+
+def configure_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(processName)s %(message)s",
+    )
+
+
+def export_snapshot(connection):
+    """Открытие транзакции REPEATABLE READ и экспорт её снимка для других соединений."""
+    connection.set_session(isolation_level="REPEATABLE READ", readonly=True)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_export_snapshot();")
+        return cursor.fetchone()[0]
+
+
+def range_partitions(connection, workers):
+    """
+    Разбиение по ключу (updated_at, id) на части примерно равного размера.
+
+    :return: список пар (нижняя граница не включительно, верхняя включительно);
+        None — граница не задана
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(FILM_WORK_COUNT_QUERY)
+        count = cursor.fetchone()[0]
+        bounds = []
+        for k in range(1, workers):
+            offset = count * k // workers - 1
+            if offset < 0:
+                continue
+            cursor.execute(FILM_WORK_KEY_AT_QUERY, {"offset": offset})
+            bounds.append(cursor.fetchone())
+    keys = [None] + bounds + [None]
+    return [("range", keys[i], keys[i + 1]) for i in range(len(keys) - 1)]
+
+
+def hash_partitions(workers):
+    return [("hash", workers, worker) for worker in range(workers)]
+
+
+def partition_query(partition):
+    """
+    Запрос страницы фильмов части, его параметры и начальный ключ.
+
+    :return: тройка (запрос с плейсхолдером {keyset}, параметры, after)
+    """
+    kind, first, second = partition
+    if kind == "hash":
+        condition = HASH_CONDITION
+        params = {"workers": first, "worker": second}
+        after = None
+    else:
+        condition, params, after = "TRUE", {}, first
+        if second is not None:
+            condition = UPPER_BOUND_CONDITION
+            params["until_updated_at"], params["until_id"] = second
+    query = FILM_WORK_PARTITION_QUERY.format(keyset="{keyset}", partition=condition)
+    return query, params, after
+
+
+def reload_partition(snapshot, partition):
+    """Выгрузка одной части таблицы в процессе-исполнителе."""
+    connection = get_connection()
+    try:
+        connection.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        with connection.cursor() as cursor:
+            cursor.execute("SET TRANSACTION SNAPSHOT %s;", (snapshot,))
+
+        query, params, after = partition_query(partition)
+        logging.info(f"Выгрузка части {partition}")
+        pages = iter_keyset_pages(connection, query, after=after, params=params)
+        ensure_mapping(index_name_film_work, index_schemas.MOVIES)
+        with BulkLoader(name=index_name_film_work) as loader:
+            processed = run_pipeline(
+                ((datas, None) for datas in pages),
+                bulk_transformer(MOVIES, force=True),
+                # Водяные знаки выставляет координатор, пачки идут без них
+                bulk_loader(loader, None, "film_work", index_name_film_work),
+                name=index_name_film_work,
+            )
+        log_fingerprint_stats(index_name_film_work)
+        logging.info(f"Часть {partition} выгружена: {processed} записей")
+        return processed
+    finally:
+        connection.close()
+
+
+def reload_film_works(state, workers, partition_by="range"):
+    """
+    Полная перезагрузка movies в workers процессах из одного снимка данных.
+
+    :return: число выгруженных фильмов
+    """
+    connection = get_connection()
+    try:
+        snapshot = export_snapshot(connection)
+        logging.info(f"Экспортирован снимок {snapshot}")
+        if partition_by == "hash":
+            partitions = hash_partitions(workers)
+        else:
+            partitions = range_partitions(connection, workers)
+
+        with connection.cursor() as cursor:
+            cursor.execute(LAST_KEY_QUERY.format(table="film_work"))
+            last_keys = {"film_work": cursor.fetchone(), **get_last_keys(connection)}
+
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            len(partitions), mp_context=context, initializer=configure_logging
+        ) as executor:
+            futures = [
+                executor.submit(reload_partition, snapshot, partition)
+                for partition in partitions
+            ]
+            processed = sum(future.result() for future in futures)
+
+        for table, key in last_keys.items():
+            if key is not None:
+                state.set_watermark(table, index_name_film_work, key)
+        return processed
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Параллельная перезагрузка movies")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--partition-by", choices=("range", "hash"), default="range")
+    args = parser.parse_args()
+
+    configure_logging()
+    logging.info(f"Параллельная перезагрузка movies: {args.workers} процессов")
+    state = State(JsonFileStorage(STATE_FILE_PATH))
+    total = reload_film_works(state, args.workers, args.partition_by)
+    logging.info(f"Перезагрузка завершена: {total} записей")
@@ -0,0 +1,476 @@
+import contextlib
+import functools
+import logging
+import threading
+
+import index_schemas
+
+from config import (
+    BATCH_SIZE,
+    FILM_EXTRACT_MODE,
+    FINGERPRINTS_PATH,
+    GENRE_EXTRACT_MODE,
+    PERSON_EXTRACT_MODE,
+    index_name_film_work,
+    index_name_genre,
+    index_name_person,
+)
+from copy_extract import iter_copy
+from dimensions import dimension_cache
+from engine import run_pipeline
+from extract import (
+    iter_batches,
+    iter_keyset_pages,
+    iter_rows_by_ids,
+    iter_streaming,
+    row_key,
+)
+from fingerprints import open_fingerprint_store
+from indexes import ensure_mapping
+from loader import BulkLoader
+from propagation import (
+    collect_related_film_work_ids,
+    collect_relinked_person_ids,
+    get_last_keys,
+    get_last_link_key,
+)
+from queries import (
+    FILM_WORK_BY_IDS_QUERY,
+    FILM_WORK_COPY_COLUMNS,
+    FILM_WORK_COPY_QUERY,
+    FILM_WORK_PLAIN_BY_IDS_QUERY,
+    FILM_WORK_PLAIN_QUERY,
+    FILM_WORK_QUERY,
+    GENRE_BY_IDS_QUERY,
+    GENRE_COLUMNS,
+    GENRE_QUERY,
+    PERSON_BY_IDS_QUERY,
+    PERSON_COLUMNS,
+    PERSON_QUERY,
+)
+from spool import drain, open_dead_letters, open_spool
+from transform import GENRES, MOVIES, PERSONS, compile_bulk
+from tuning import bulk_controller, page_controller
+
+
+fingerprint_store = open_fingerprint_store(FINGERPRINTS_PATH)
+spool = open_spool()
+dead_letters = open_dead_letters()
+
+persons_bulk_data = compile_bulk(PERSONS)
+genres_bulk_data = compile_bulk(GENRES)
+film_works_bulk_data = compile_bulk(MOVIES)
+
+# Регуляторы размера страниц и запросов _bulk по индексам (None — выключены);
+# живут весь процесс, чтобы планировщик не подбирал размер заново каждый запуск
+page_sizes = {
+    index: page_controller(index)
+    for index in (index_name_film_work, index_name_genre, index_name_person)
+}
+bulk_sizes = {
+    index: bulk_controller(index)
+    for index in (index_name_film_work, index_name_genre, index_name_person)
+}
+
+
+def with_checkpoints(batches):
+    """Пары (пачка, ключ последней строки) для продвижения водяного знака."""
+    for rows in batches:
+        yield rows, row_key(rows[-1])
+
+
+def iter_rows(connection, query, columns, watermark, mode, json_columns=()):
+    """Строки справочника после водяного знака: mode "cursor" или "copy"."""
+    if mode == "copy":
+        return iter_copy(
+            connection, query, columns, after=watermark, json_columns=json_columns
+        )
+    return iter_streaming(connection, query, after=watermark)
+
+
+def save_fingerprints(fingerprints, rejected=()):
+    """
+    Сохранение отпечатков документов, записанных в Elasticsearch.
+
+    :param rejected: _id документов, отклонённых окончательно (loader.rejected);
+        их отпечатки не сохраняются, чтобы следующая выгрузка отправила их снова
+    """
+    if fingerprint_store is not None:
+        if rejected:
+            fingerprints = [f for f in fingerprints if f[1] not in rejected]
+        fingerprint_store.save(fingerprints)
+
+
+def open_loader(index, target=None, sink=None):
+    """
+    Загрузчик для записи в индекс index: BulkLoader или None, если пачки идут в spool.
+
+    Запись в другой индекс (target, например новая версия при перестроении)
+    идёт мимо spool: перестроение само продолжается после сбоя и должно
+    знать, что всё записано, до переключения алиаса. Если задан sink
+    (export.ExportSink), пачки пишутся в файлы, а не в Elasticsearch.
+
+    Перед записью в алиас его маппинг обновляется по схеме (при записи через
+    spool — разгрузчиком), см. indexes.ensure_mapping.
+    """
+    if sink is not None:
+        return sink
+    if spool is not None and target is None:
+        return contextlib.nullcontext()
+    if target is None:
+        ensure_mapping(index, index_schemas.BY_INDEX[index])
+    return BulkLoader(
+        controller=bulk_sizes[index], dead_letters=dead_letters, name=index
+    )
+
+
+def bulk_loader(loader, state, table, index):
+    """
+    Загрузчик конвейера: отправка пачки, затем, после её подтверждения,
+    сохранение отпечатков документов и водяного знака.
+
+    Если loader равен None, пачка записывается в spool, и водяной знак
+    сохраняется сразу после записи; отпечатки сохранит разгрузчик spool.
+    """
+
+    def load(payload, checkpoint):
+        bulk_data, fingerprints = payload
+        if loader is None:
+            spool.append(bulk_data, fingerprints)
+            if checkpoint is not None:
+                state.set_watermark(table, index, checkpoint)
+            return
+
+        callbacks = []
+        if fingerprints:
+            callbacks.append(
+                functools.partial(save_fingerprints, fingerprints, loader.rejected)
+            )
+        if checkpoint is not None:
+            callbacks.append(
+                functools.partial(state.set_watermark, table, index, checkpoint)
+            )
+
+        def on_success():
+            for callback in callbacks:
+                callback()
+
+        loader.submit(bulk_data, on_success if callbacks else None)
+
+    return load
+
+
+def ensure_mappings():
+    """Обновление маппингов всех индексов по схемам, см. indexes.ensure_mapping."""
+    for index, schema in index_schemas.BY_INDEX.items():
+        ensure_mapping(index, schema)
+
+
+def drain_spool(stop=None):
+    """
+    Отправка содержимого spool в Elasticsearch, см. spool.drain.
+
+    :return: число отправленных документов (0, если spool отключён)
+    """
+    if spool is None:
+        return 0
+    return drain(
+        spool,
+        stop=stop,
+        save_fingerprints=save_fingerprints,
+        dead_letters=dead_letters,
+        prepare=ensure_mappings,
+    )
+
+
+@contextlib.contextmanager
+def draining_spool():
+    """
+    Разгрузка spool в отдельном потоке на время выгрузки и отправка остатка после неё.
+
+    Для разовых запусков: без параллельной разгрузки запись в заполненный spool
+    (SPOOL_MAX_BYTES) ждала бы вечно. Остаток отправляется, только если
+    выгрузка завершилась без исключения.
+    """
+    if spool is None:
+        yield
+        return
+    stop = threading.Event()
+    thread = threading.Thread(target=drain_spool, args=(stop,), name="spool")
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+    drain_spool()
+
+
+def bulk_transformer(schema, index=None, force=False, use_fingerprints=True):
+    """
+    Преобразование строк в пару (документы _bulk, отпечатки документов).
+
+    Если включено хранилище отпечатков, неизменившиеся документы отбрасываются.
+    :param index: индекс для записи, если он отличается от индекса схемы; такой
+        индекс считается новым, поэтому в него отправляются все документы
+    :param force: отправлять все документы, даже если отпечаток не изменился
+        (например, документ пропал из индекса)
+    :param use_fingerprints: False — не обращаться к хранилищу отпечатков
+        (например, при выгрузке в файлы: отпечатки описывают документы в
+        Elasticsearch)
+    """
+    to_bulk_data = compile_bulk(schema if index is None else {**schema, "index": index})
+    if fingerprint_store is None or not use_fingerprints:
+        return lambda rows: (to_bulk_data(rows), None)
+
+    alias = schema["index"]
+    id_column = schema["id"]
+
+    def transform(rows):
+        ids = [str(row[id_column]) for row in rows]
+        return fingerprint_store.filter(
+            alias, ids, to_bulk_data(rows), record_only=force or index is not None
+        )
+
+    return transform
+
+
+def log_fingerprint_stats(index):
+    if fingerprint_store is not None:
+        fingerprint_store.log_stats(index)
+
+
+def iter_person_batches(connection, watermark, related_ids, mode=PERSON_EXTRACT_MODE):
+    """
+    Пачки изменённых персон, затем пачки персон с новыми связями с фильмами.
+
+    Персоны, уже попавшие в первую часть, из related_ids удаляются. Водяной
+    знак person продвигают только пачки первой части.
+    """
+    rows = iter_rows(
+        connection,
+        PERSON_QUERY,
+        PERSON_COLUMNS,
+        watermark,
+        mode,
+        json_columns=("films",),
+    )
+    for datas in iter_batches(rows, BATCH_SIZE, page_sizes[index_name_person]):
+        related_ids.difference_update(str(data["id"]) for data in datas)
+        yield datas, row_key(datas[-1])
+
+    if related_ids:
+        logging.info(f"Переиндексация персон по связям: {len(related_ids)}")
+    for datas in iter_rows_by_ids(connection, related_ids, PERSON_BY_IDS_QUERY):
+        yield datas, None
+
+
+def load_persons(connection, state, index=None, stop=None, sink=None):
+    """
+    Выгрузка изменённых персон и персон с новыми связями с фильмами в Elasticsearch.
+
+    :param index: индекс для записи, если он отличается от persons
+        (например, новая версия индекса при перестроении)
+    :param stop: событие мягкой остановки, см. engine.run_pipeline
+    :param sink: export.ExportSink для выгрузки в файлы вместо Elasticsearch;
+        в файлы попадают все документы, без фильтра отпечатков
+    :return: число выгруженных записей
+    """
+    watermark = state.get_watermark("person", index_name_person)
+    if watermark is None:
+        # Полная выгрузка и так отправит всех персон со всеми фильмами
+        related_ids, link_key = set(), get_last_link_key(connection)
+    else:
+        related_ids, link_key = collect_relinked_person_ids(
+            connection, state, index_name_person
+        )
+
+    with open_loader(index_name_person, index, sink) as loader:
+        processed = run_pipeline(
+            iter_person_batches(connection, watermark, related_ids),
+            bulk_transformer(PERSONS, index, use_fingerprints=sink is None),
+            bulk_loader(loader, state, "person", index_name_person),
+            stop=stop,
+            name=index_name_person,
+        )
+
+    if link_key is not None and (stop is None or not stop.is_set()):
+        state.set_watermark("person_film_work", index_name_person, link_key)
+    log_fingerprint_stats(index_name_person)
+    return processed
+
+
+def load_genres(connection, state, index=None, stop=None, sink=None):
+    """Выгрузка изменённых жанров в Elasticsearch, см. load_persons."""
+    watermark = state.get_watermark("genre", index_name_genre)
+    rows = iter_rows(
+        connection, GENRE_QUERY, GENRE_COLUMNS, watermark, GENRE_EXTRACT_MODE
+    )
+    with open_loader(index_name_genre, index, sink) as loader:
+        processed = run_pipeline(
+            with_checkpoints(
+                iter_batches(rows, BATCH_SIZE, page_sizes[index_name_genre])
+            ),
+            bulk_transformer(GENRES, index, use_fingerprints=sink is None),
+            bulk_loader(loader, state, "genre", index_name_genre),
+            stop=stop,
+            name=index_name_genre,
+        )
+    log_fingerprint_stats(index_name_genre)
+    return processed
+
+
+def fetch_and_send_persons_to_elasticsearch(connection, state):
+    try:
+        processed = load_persons(connection, state)
+        logging.info(f"Persons successfully processed: {processed}")
+
+    except Exception as e:
+        logging.error(f"Error fetching and sending person data: {e}")
+
+
+def fetch_and_send_genres_to_elasticsearch(connection, state):
+    try:
+        load_genres(connection, state)
+        logging.info("Жанры успешно обработаны")
+
+    except Exception as e:
+        logging.error(f"Ошибка при получении и отправке данных по жанрам: {e}")
+
+
+def prepare_film_works(connection, datas, mode=FILM_EXTRACT_MODE):
+    """Строки фильмов в формате FILM_WORK_QUERY (в режиме кэша — сборка в Python)."""
+    if mode == "dimension_cache":
+        return dimension_cache.enrich(connection, datas)
+    return datas
+
+
+def iter_film_work_batches(
+    connection, watermark, related_ids, mode=FILM_EXTRACT_MODE
+):
+    """
+    Пачки изменённых фильмов, затем пачки фильмов, затронутых изменениями связей.
+
+    Фильмы, уже попавшие в первую часть, из related_ids удаляются, поэтому
+    каждый фильм отправляется один раз. Водяной знак film_work продвигают
+    только пачки первой части.
+
+    :param mode: "sql" — персоны и жанры агрегируются в Postgres,
+        "dimension_cache" — собираются в Python из кэша справочников,
+        "copy" — агрегируются в Postgres и читаются одним COPY без страниц
+    """
+    controller = page_sizes[index_name_film_work]
+    if mode == "dimension_cache":
+        dimension_cache.refresh(connection)
+        pages = iter_keyset_pages(
+            connection, FILM_WORK_PLAIN_QUERY, after=watermark, controller=controller
+        )
+        by_ids_query = FILM_WORK_PLAIN_BY_IDS_QUERY
+    elif mode == "copy":
+        rows = iter_copy(
+            connection,
+            FILM_WORK_COPY_QUERY,
+            FILM_WORK_COPY_COLUMNS,
+            after=watermark,
+            json_columns=("persons", "genres"),
+        )
+        pages = iter_batches(rows, BATCH_SIZE, controller)
+        by_ids_query = FILM_WORK_BY_IDS_QUERY
+    else:
+        pages = iter_keyset_pages(
+            connection, FILM_WORK_QUERY, after=watermark, controller=controller
+        )
+        by_ids_query = FILM_WORK_BY_IDS_QUERY
+
+    for datas in pages:
+        related_ids.difference_update(str(data["id"]) for data in datas)
+        yield prepare_film_works(connection, datas, mode), row_key(datas[-1])
+
+    logging.info(f"Переиндексация фильмов по связям: {len(related_ids)}")
+    for datas in iter_rows_by_ids(connection, related_ids, by_ids_query):
+        yield prepare_film_works(connection, datas, mode), None
+
+
+def reindex_by_ids(schema, ids, batches, force=False):
+    """
+    Переиндексация записей по id без изменения водяных знаков.
+
+    :param force: отправить документы, даже если их отпечатки не изменились
+    """
+    with open_loader(schema["index"]) as loader:
+        processed = run_pipeline(
+            ((rows, None) for rows in batches),
+            bulk_transformer(schema, force=force),
+            bulk_loader(loader, None, None, None),
+            name=schema["index"],
+        )
+    logging.info(f"Переиндексировано в {schema['index']}: {processed} из {len(ids)}")
+    return processed
+
+
+def reindex_persons(connection, ids, force=False):
+    batches = iter_rows_by_ids(connection, ids, PERSON_BY_IDS_QUERY)
+    return reindex_by_ids(PERSONS, ids, batches, force)
+
+
+def reindex_genres(connection, ids, force=False):
+    batches = iter_rows_by_ids(connection, ids, GENRE_BY_IDS_QUERY)
+    return reindex_by_ids(GENRES, ids, batches, force)
+
+
+def reindex_film_works(connection, ids, mode=FILM_EXTRACT_MODE, force=False):
+    if mode == "dimension_cache":
+        dimension_cache.refresh(connection)
+        query = FILM_WORK_PLAIN_BY_IDS_QUERY
+    else:
+        query = FILM_WORK_BY_IDS_QUERY
+    batches = (
+        prepare_film_works(connection, datas, mode)
+        for datas in iter_rows_by_ids(connection, ids, query)
+    )
+    return reindex_by_ids(MOVIES, ids, batches, force)
+
+
+def load_film_works(connection, state, index=None, stop=None, sink=None):
+    """
+    Выгрузка изменённых фильмов и фильмов, затронутых изменениями персон и жанров.
+
+    :param index: индекс для записи, если он отличается от movies
+    :param sink: см. load_persons
+    :return: число выгруженных записей
+    """
+    watermark = state.get_watermark("film_work", index_name_film_work)
+    if watermark is None:
+        # Полная выгрузка и так отправит все фильмы
+        related_ids, related_keys = set(), get_last_keys(connection)
+    else:
+        related_ids, related_keys = collect_related_film_work_ids(
+            connection, state, index_name_film_work
+        )
+
+    logging.info(f"Чтение записей в postgres, изменённых после {watermark}")
+    with open_loader(index_name_film_work, index, sink) as loader:
+        processed = run_pipeline(
+            iter_film_work_batches(connection, watermark, related_ids),
+            bulk_transformer(MOVIES, index, use_fingerprints=sink is None),
+            bulk_loader(loader, state, "film_work", index_name_film_work),
+            stop=stop,
+            name=index_name_film_work,
+        )
+
+    # После мягкой остановки связанные фильмы могли остаться не отправленными:
+    # водяные знаки справочников не сдвигаются, изменения распространятся снова
+    if stop is None or not stop.is_set():
+        for table, key in related_keys.items():
+            if key is not None:
+                state.set_watermark(table, index_name_film_work, key)
+    log_fingerprint_stats(index_name_film_work)
+    return processed
+
+
+def fetch_and_send_film_works_to_elasticsearch(connection, state):
+    try:
+        load_film_works(connection, state)
+
+    except Exception as e:
+        logging.error(f"Ошибка: {e}")
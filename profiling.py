@@ -0,0 +1,110 @@
+"""
+Профилирование одного запуска ETL.
+
+Включается переменной окружения ETL_PROFILE на время одного запуска:
+
+- "cprofile" — до Python 3.12 cProfile видит только свой поток, поэтому
+  каждый поток стадии конвейера профилируется отдельно, результаты пишутся в
+  ETL_PROFILE_DIR/<конвейер>-<стадия>-<время>.prof. С Python 3.12 профилировщик
+  в процессе может быть только один, зато он видит все потоки: он включается
+  при запуске первого конвейера и пишет один файл
+  ETL_PROFILE_DIR/<конвейер>-<время>.prof, когда завершится последний из
+  работающих одновременно. Смотреть через python -m pstats или snakeviz;
+- "tracemalloc" — на время конвейера включается трассировка памяти, в лог
+  выводятся пик и десять мест с наибольшим объёмом выделенной памяти.
+
+Пример:
+    ETL_PROFILE=cprofile python etl.py
+"""
+import contextlib
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from config import PROFILE_DIR, PROFILE_MODE
+
+# Сколько мест выделения памяти выводить в лог
+_TOP_ALLOCATIONS = 10
+
+# С Python 3.12 cProfile работает через sys.monitoring: профилировщик один на
+# процесс и видит все потоки, второй enable() выбрасывает ValueError
+_PROCESS_WIDE = sys.version_info >= (3, 12)
+
+# Общий профилировщик процесса: (профилировщик, имя файла), число конвейеров
+_shared = None
+_shared_users = 0
+_shared_lock = threading.Lock()
+
+
+def _dump(profiler, name):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d%H%M%S')}.prof")
+    profiler.dump_stats(path)
+    logging.info(f"Профиль {name} записан в {path}")
+
+
+@contextlib.contextmanager
+def profile_thread(name, mode=PROFILE_MODE):
+    """Профилирование текущего потока через cProfile, если mode == "cprofile" (до Python 3.12)."""
+    if mode != "cprofile" or _PROCESS_WIDE:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _dump(profiler, name)
+
+
+@contextlib.contextmanager
+def profile_process(name, mode=PROFILE_MODE):
+    """
+    Профилирование всех потоков процесса через cProfile (с Python 3.12).
+
+    Вызывается в потоке, запускающем конвейер. Конвейеры, запущенные, пока
+    профилировщик уже включён, попадают в его файл.
+    """
+    global _shared, _shared_users
+    if mode != "cprofile" or not _PROCESS_WIDE:
+        yield
+        return
+    with _shared_lock:
+        if _shared is None:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            _shared = (profiler, name)
+        _shared_users += 1
+    try:
+        yield
+    finally:
+        with _shared_lock:
+            _shared_users -= 1
+            if not _shared_users:
+                profiler, owner = _shared
+                _shared = None
+                profiler.disable()
+                _dump(profiler, owner)
+
+
+@contextlib.contextmanager
+def trace_memory(name, mode=PROFILE_MODE):
+    """Трассировка выделения памяти, если mode == "tracemalloc"."""
+    if mode != "tracemalloc" or tracemalloc.is_tracing():
+        yield
+        return
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        logging.info(f"{name}: пик выделенной памяти {peak / 1024 / 1024:.1f} МБ")
+        for stat in snapshot.statistics("lineno")[:_TOP_ALLOCATIONS]:
+            logging.info(f"{name}: {stat}")
@@ -0,0 +1,108 @@
+"""
+Распространение изменений персон и жанров в индекс movies.
+
+Поля actors, writers, director и genre в movies денормализованы, поэтому
+переименование персоны или жанра должно переиндексировать связанные фильмы.
+Изменённые записи находятся по водяному знаку (updated_at, id) справочника
+для индекса movies, а связанные фильмы — пачками через person_film_work и
+genre_film_work с условием = ANY(...).
+
+Поле films индекса persons тоже денормализовано: новые связи в
+person_film_work находятся по водяному знаку (created_at, id) таблицы связей
+для индекса persons. Удаление связей и смену роли так не увидеть (у таблицы
+нет updated_at) — их отслеживают триггеры listener.py.
+"""
+import logging
+
+from extract import iter_keyset_pages
+from queries import (
+    CHANGED_IDS_QUERY,
+    LAST_KEY_QUERY,
+    LINKED_FILM_WORK_IDS_QUERY,
+    PERSON_LINK_CHANGES_QUERY,
+    PERSON_LINK_LAST_KEY_QUERY,
+)
+
+# Справочник -> (таблица связей, колонка связи)
+RELATED_TABLES = {
+    "person": ("person_film_work", "person_id"),
+    "genre": ("genre_film_work", "genre_id"),
+}
+
+
+def get_last_keys(connection):
+    """
+    Текущие последние ключи (updated_at, id) справочников.
+
+    Используются при полной выгрузке movies: распространять изменения не нужно,
+    но водяные знаки справочников надо зафиксировать до начала выгрузки.
+    """
+    last_keys = {}
+    with connection.cursor() as cursor:
+        for table in RELATED_TABLES:
+            cursor.execute(LAST_KEY_QUERY.format(table=table))
+            last_keys[table] = cursor.fetchone()
+    return last_keys
+
+
+def linked_film_work_ids(cursor, table, ids):
+    """Id фильмов, связанных с записями ids справочника table (person или genre)."""
+    link_table, link_column = RELATED_TABLES[table]
+    query = LINKED_FILM_WORK_IDS_QUERY.format(
+        link_table=link_table, link_column=link_column
+    )
+    cursor.execute(query, {"ids": [str(item_id) for item_id in ids]})
+    return {str(film_work_id) for (film_work_id,) in cursor}
+
+
+def collect_related_film_work_ids(connection, state, index):
+    """
+    Id фильмов, связанных с персонами и жанрами, изменёнными после прошлого запуска.
+
+    :return: множество id фильмов и словарь новых водяных знаков справочников,
+        которые нужно сохранить после отправки этих фильмов
+    """
+    film_work_ids = set()
+    last_keys = {}
+    with connection.cursor() as cursor:
+        for table in RELATED_TABLES:
+            changed = 0
+            query = CHANGED_IDS_QUERY.format(table=table)
+            after = state.get_watermark(table, index)
+            for rows in iter_keyset_pages(connection, query, after=after):
+                film_work_ids.update(
+                    linked_film_work_ids(cursor, table, [row["id"] for row in rows])
+                )
+                last = rows[-1]
+                last_keys[table] = (last["updated_at"], last["id"])
+                changed += len(rows)
+            if changed:
+                logging.info(f"Изменено записей в content.{table}: {changed}")
+    logging.info(f"Фильмов для переиндексации по связям: {len(film_work_ids)}")
+    return film_work_ids, last_keys
+
+
+def get_last_link_key(connection):
+    """Текущий последний ключ (created_at, id) person_film_work, см. get_last_keys."""
+    with connection.cursor() as cursor:
+        cursor.execute(PERSON_LINK_LAST_KEY_QUERY)
+        return cursor.fetchone()
+
+
+def collect_relinked_person_ids(connection, state, index):
+    """
+    Id персон, у которых после прошлого запуска появились новые связи с фильмами.
+
+    :return: множество id персон и новый водяной знак person_film_work,
+        который нужно сохранить после отправки этих персон
+    """
+    person_ids = set()
+    last_key = None
+    after = state.get_watermark("person_film_work", index)
+    for rows in iter_keyset_pages(connection, PERSON_LINK_CHANGES_QUERY, after=after):
+        person_ids.update(str(row["person_id"]) for row in rows)
+        last = rows[-1]
+        last_key = (last["updated_at"], last["id"])
+    if person_ids:
+        logging.info(f"Персон с новыми связями с фильмами: {len(person_ids)}")
+    return person_ids, last_key
@@ -0,0 +1,333 @@
+"""
+SQL-запросы ETL.
+
+Запросы для постраничного чтения содержат плейсхолдер {keyset}, в который
+пагинатор (см. extract.py) подставляет условие по ключу (updated_at, id),
+и параметр %(limit)s с размером страницы.
+"""
+
+# Фильмы выбираются во вложенном запросе {source}, и только для них выполняются
+# JOIN и агрегация по персонам и жанрам.
+_FILM_WORK_SELECT = """
+    SELECT
+    fw.id,
+    fw.title,
+    fw.description,
+    fw.rating,
+    fw.type,
+    fw.created_at,
+    fw.updated_at,
+    COALESCE (
+        json_agg(
+            DISTINCT jsonb_build_object(
+                'person_role', pfw.role,
+                'person_id', p.id,
+                'person_name', p.full_name
+            )
+        ) FILTER (WHERE p.id is not null),
+        '[]'
+    ) as persons,
+    array_agg(DISTINCT g.name) as genres
+    FROM ({source}) fw
+    LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
+    LEFT JOIN content.person p ON p.id = pfw.person_id
+    LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
+    LEFT JOIN content.genre g ON g.id = gfw.genre_id
+    GROUP BY fw.id, fw.title, fw.description, fw.rating, fw.type,
+             fw.created_at, fw.updated_at
+    ORDER BY fw.updated_at, fw.id;
+"""
+
+# Страница фильмов выбирается по индексу (updated_at, id)
+FILM_WORK_QUERY = _FILM_WORK_SELECT.format(
+    source="""
+        SELECT *
+        FROM content.film_work
+        WHERE {keyset}
+        ORDER BY updated_at, id
+        LIMIT %(limit)s
+    """
+)
+
+# Страница фильмов внутри одной части таблицы при параллельной перезагрузке;
+# {partition} — условие отбора части (диапазон ключей или остаток от хэша id)
+FILM_WORK_PARTITION_QUERY = _FILM_WORK_SELECT.format(
+    source="""
+        SELECT *
+        FROM content.film_work
+        WHERE {keyset} AND {partition}
+        ORDER BY updated_at, id
+        LIMIT %(limit)s
+    """
+)
+
+# Фильмы по списку id, затронутые изменениями персон и жанров
+FILM_WORK_BY_IDS_QUERY = _FILM_WORK_SELECT.format(
+    source="""
+        SELECT *
+        FROM content.film_work
+        WHERE id = ANY(%(ids)s::uuid[])
+    """
+)
+
+# Полная потоковая выгрузка фильмов через COPY (см. copy_extract.py): без LIMIT,
+# жанры отдаются в JSON, как и персоны, чтобы разбирать один формат
+FILM_WORK_COPY_QUERY = """
+    SELECT
+        id,
+        title,
+        description,
+        rating,
+        updated_at,
+        persons,
+        to_json(genres) AS genres
+    FROM ({films}) fw
+    ORDER BY updated_at, id
+""".format(
+    films=_FILM_WORK_SELECT.format(
+        source="""
+            SELECT *
+            FROM content.film_work
+            WHERE {keyset}
+        """
+    ).strip().rstrip(";")
+)
+FILM_WORK_COPY_COLUMNS = (
+    "id", "title", "description", "rating", "updated_at", "persons", "genres",
+)
+
+# Персоны с фильмами и ролями: связи каждой персоны группируются по фильму в
+# подзапросе LATERAL, который Postgres выполняет по индексу
+# person_film_work (person_id) для очередной строки потока персон, так что
+# таблица связей не читается целиком и не собирается в памяти.
+_PERSON_SELECT = """
+    SELECT
+        p.id,
+        p.full_name,
+        p.updated_at,
+        COALESCE(f.films, '[]') AS films
+    FROM ({source}) p
+    LEFT JOIN LATERAL (
+        SELECT json_agg(
+            json_build_object('id', pf.film_work_id, 'roles', pf.roles)
+            ORDER BY pf.film_work_id
+        ) AS films
+        FROM (
+            SELECT film_work_id, array_agg(DISTINCT role ORDER BY role) AS roles
+            FROM content.person_film_work
+            WHERE person_id = p.id
+            GROUP BY film_work_id
+        ) pf
+    ) f ON TRUE
+"""
+
+# Запросы справочников читаются потоково через серверный курсор, без LIMIT
+PERSON_QUERY = _PERSON_SELECT.format(
+    source="""
+        SELECT id, full_name, updated_at
+        FROM content.person
+        WHERE {keyset}
+    """
+) + """
+    ORDER BY p.updated_at, p.id;
+"""
+
+# Только имена персон, для кэша справочников (см. dimensions.py)
+PERSON_NAMES_QUERY = """
+    SELECT
+        id,
+        full_name,
+        updated_at
+    FROM content.person
+    WHERE {keyset}
+    ORDER BY updated_at, id;
+"""
+
+GENRE_QUERY = """
+    SELECT
+        id,
+        name,
+        description,
+        updated_at
+    FROM content.genre
+    WHERE {keyset}
+    ORDER BY updated_at, id;
+"""
+
+# Колонки PERSON_QUERY и GENRE_QUERY по порядку, для разбора вывода COPY
+PERSON_COLUMNS = ("id", "full_name", "updated_at", "films")
+GENRE_COLUMNS = ("id", "name", "description", "updated_at")
+
+PERSON_BY_IDS_QUERY = _PERSON_SELECT.format(
+    source="""
+        SELECT id, full_name, updated_at
+        FROM content.person
+        WHERE id = ANY(%(ids)s::uuid[])
+    """
+) + ";"
+
+GENRE_BY_IDS_QUERY = """
+    SELECT
+        id,
+        name,
+        description,
+        updated_at
+    FROM content.genre
+    WHERE id = ANY(%(ids)s::uuid[]);
+"""
+
+# Изменённые записи справочника (person или genre) для распространения в movies
+CHANGED_IDS_QUERY = """
+    SELECT
+        id,
+        updated_at
+    FROM content.{table}
+    WHERE {{keyset}}
+    ORDER BY updated_at, id
+    LIMIT %(limit)s;
+"""
+
+LAST_KEY_QUERY = """
+    SELECT
+        updated_at,
+        id
+    FROM content.{table}
+    ORDER BY updated_at DESC, id DESC
+    LIMIT 1;
+"""
+
+# Новые связи персон с фильмами. У person_film_work нет updated_at, поэтому
+# ключом служит (created_at, id); для быстрой работы нужен индекс по нему
+PERSON_LINK_CHANGES_QUERY = """
+    SELECT
+        id,
+        updated_at,
+        person_id
+    FROM (
+        SELECT id, created_at AS updated_at, person_id
+        FROM content.person_film_work
+    ) pfw
+    WHERE {keyset}
+    ORDER BY updated_at, id
+    LIMIT %(limit)s;
+"""
+
+PERSON_LINK_LAST_KEY_QUERY = """
+    SELECT
+        created_at,
+        id
+    FROM content.person_film_work
+    ORDER BY created_at DESC, id DESC
+    LIMIT 1;
+"""
+
+# Фильмы, связанные с пачкой изменённых персон или жанров
+LINKED_FILM_WORK_IDS_QUERY = """
+    SELECT DISTINCT film_work_id
+    FROM content.{link_table}
+    WHERE {link_column} = ANY(%(ids)s::uuid[]);
+"""
+
+# Режим кэша справочников: фильмы без JOIN, связи отдельными запросами по id страницы
+_FILM_WORK_PLAIN_SELECT = """
+    SELECT
+        id,
+        title,
+        description,
+        rating,
+        type,
+        created_at,
+        updated_at
+    FROM content.film_work
+"""
+
+FILM_WORK_PLAIN_QUERY = _FILM_WORK_PLAIN_SELECT + """
+    WHERE {keyset}
+    ORDER BY updated_at, id
+    LIMIT %(limit)s;
+"""
+
+FILM_WORK_PLAIN_BY_IDS_QUERY = _FILM_WORK_PLAIN_SELECT + """
+    WHERE id = ANY(%(ids)s::uuid[])
+    ORDER BY updated_at, id;
+"""
+
+PERSON_FILM_WORK_LINKS_QUERY = """
+    SELECT film_work_id, person_id, role
+    FROM content.person_film_work
+    WHERE film_work_id = ANY(%(ids)s::uuid[]);
+"""
+
+GENRE_FILM_WORK_LINKS_QUERY = """
+    SELECT film_work_id, genre_id
+    FROM content.genre_film_work
+    WHERE film_work_id = ANY(%(ids)s::uuid[]);
+"""
+
+PERSON_NAMES_BY_IDS_QUERY = """
+    SELECT id, full_name
+    FROM content.person
+    WHERE id = ANY(%(ids)s::uuid[]);
+"""
+
+GENRE_NAMES_BY_IDS_QUERY = """
+    SELECT id, name
+    FROM content.genre
+    WHERE id = ANY(%(ids)s::uuid[]);
+"""
+
+# Порядок названий жанров по правилам сортировки базы, как в array_agg(DISTINCT g.name)
+GENRE_NAMES_ORDER_QUERY = """
+    SELECT DISTINCT name
+    FROM content.genre
+    ORDER BY name;
+"""
+
+FILM_WORK_COUNT_QUERY = """
+    SELECT count(*)
+    FROM content.film_work;
+"""
+
+# Ключ строки с заданным порядковым номером — граница диапазона при разбиении
+FILM_WORK_KEY_AT_QUERY = """
+    SELECT
+        updated_at,
+        id
+    FROM content.film_work
+    ORDER BY updated_at, id
+    OFFSET %(offset)s
+    LIMIT 1;
+"""
+
+# Сверка с Elasticsearch (reconcile.py). Хэш строки — первые 60 бит md5 от
+# "id:updated_at в миллисекундах" (точность поля date в Elasticsearch); сумма
+# хэшей не зависит от порядка строк.
+RECONCILE_SUMMARY_QUERY = """
+    SELECT
+        left(id::text, %(depth)s) AS bucket,
+        count(*) AS count,
+        sum(
+            ('x' || substr(md5(
+                id::text || ':'
+                || COALESCE(floor(extract(epoch FROM updated_at) * 1000)::bigint::text, '')
+            ), 1, 15))::bit(60)::bigint
+        ) AS hash
+    FROM content.{table}
+    GROUP BY 1;
+"""
+
+# Строки диапазонов id [low, high] для построчного сравнения
+RECONCILE_ROWS_QUERY = """
+    SELECT
+        t.id,
+        floor(extract(epoch FROM t.updated_at) * 1000)::bigint AS millis
+    FROM unnest(%(lows)s::uuid[], %(highs)s::uuid[]) AS r(low, high)
+    JOIN content.{table} t ON t.id BETWEEN r.low AND r.high;
+"""
+
+# Оценка числа строк таблицы по статистике планировщика (-1, если ANALYZE не было)
+RECONCILE_ESTIMATE_QUERY = """
+    SELECT reltuples::bigint
+    FROM pg_class
+    WHERE oid = 'content.{table}'::regclass;
+"""
@@ -0,0 +1,87 @@
+"""
+Перестроение индексов без простоя.
+
+Для каждого индекса: создаётся новая версия по схеме из index_schemas.py с
+отключёнными refresh и репликами, в неё выполняется полная выгрузка, затем
+возвращаются рабочие настройки, выполняется force merge, алиас атомарно
+переключается на новую версию, а версии старше неё удаляются. Читатели всё это
+время видят старый индекс целиком.
+
+Состояние перестроения (имя новой версии и водяные знаки) хранится в
+отдельном файле, поэтому после падения перестроение продолжается с последней
+подтверждённой пачки. После переключения водяные знаки переносятся в основное
+состояние, и инкрементальная выгрузка продолжается с момента перестроения.
+
+Запуск:
+    python rebuild.py movies genres persons
+"""
+import argparse
+import logging
+import os
+
+import index_schemas
+from config import (
+    STATE_FILE_PATH,
+    index_name_film_work,
+    index_name_genre,
+    index_name_person,
+)
+from db import get_connection
+from indexes import (
+    create_versioned_index,
+    delete_old_versions,
+    finalize_index,
+    swap_alias,
+)
+from pipelines import load_film_works, load_genres, load_persons
+from state import JsonFileStorage, State
+
+REBUILDS = {
+    index_name_film_work: (index_schemas.MOVIES, load_film_works),
+    index_name_genre: (index_schemas.GENRES, load_genres),
+    index_name_person: (index_schemas.PERSONS, load_persons),
+}
+
+
+def rebuild_index(connection, state, alias):
+    schema, load = REBUILDS[alias]
+    storage = JsonFileStorage(f"{STATE_FILE_PATH}.rebuild.{alias}")
+    rebuild_state = State(storage)
+
+    name = rebuild_state.get_state("index")
+    if name is None:
+        name = create_versioned_index(alias, schema)
+        rebuild_state.set_state("index", name)
+    else:
+        logging.info(f"Продолжение перестроения {name}")
+
+    processed = load(connection, rebuild_state, index=name)
+    logging.info(f"В {name} выгружено записей: {processed}")
+
+    finalize_index(name, schema)
+    swap_alias(alias, name)
+    for key, value in rebuild_state.state.items():
+        if key != "index":
+            state.set_state(key, value)
+    os.remove(storage.file_path)
+    delete_old_versions(alias, name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Перестроение индексов без простоя")
+    parser.add_argument("indexes", nargs="+", choices=sorted(REBUILDS))
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+    connection = None
+    try:
+        connection = get_connection()
+        state = State(JsonFileStorage(STATE_FILE_PATH))
+        for alias in args.indexes:
+            logging.info(f"Перестроение индекса {alias}")
+            rebuild_index(connection, state, alias)
+    finally:
+        if connection:
+            connection.close()
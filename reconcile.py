@@ -0,0 +1,264 @@
+"""
+Сверка индексов Elasticsearch с Postgres и точечное исправление расхождений.
+
+Строки таблицы делятся на диапазоны по первым depth шестнадцатеричным
+цифрам id (UUID). Для каждого диапазона с обеих сторон считаются число строк
+и сумма хэшей пар (id, updated_at) — сумма не зависит от порядка строк.
+В Postgres это один запрос с GROUP BY, в Elasticsearch — один scroll без
+_source, только с docvalue updated_at. depth выбирается так, чтобы в
+диапазоне было в среднем не больше RECONCILE_RANGE_ROWS строк.
+
+Суммы по более коротким префиксам получаются сложением, поэтому поиск
+расхождений сужается по уровням без новых запросов: в лог пишется, сколько
+диапазонов не совпало на каждом уровне. Построчно с обеих сторон читаются
+только несовпавшие диапазоны глубины depth: отсутствующие в индексе и
+устаревшие документы переиндексируются (в обход хранилища отпечатков), а
+документы, которых в Postgres нет, удаляются.
+
+Сверяется только updated_at самой строки: расхождения денормализованных
+полей (персоны и жанры фильма, фильмы персоны) при неизменном updated_at
+так не обнаружить. Строки, изменённые во время сверки, могут оказаться
+лишний раз переиндексированы — это безопасно. Документы, которые хранилище
+отпечатков не отправило из-за того, что изменилось только updated_at (см.
+fingerprints.py), тоже считаются устаревшими и переписываются.
+
+Перед сверкой в маппинг индекса добавляется поле updated_at, если его там
+нет; документы, записанные до его появления, считаются устаревшими.
+
+Запуск:
+    python reconcile.py movies genres persons
+    python reconcile.py --dry-run movies
+"""
+import argparse
+import hashlib
+import logging
+import uuid
+
+import index_schemas
+from config import (
+    RECONCILE_RANGE_ROWS,
+    RECONCILE_SCROLL_SIZE,
+    index_name_film_work,
+    index_name_genre,
+    index_name_person,
+)
+from db import get_connection
+from indexes import es_request, put_mapping
+from loader import BulkLoader
+from pipelines import reindex_film_works, reindex_genres, reindex_persons
+from queries import (
+    RECONCILE_ESTIMATE_QUERY,
+    RECONCILE_ROWS_QUERY,
+    RECONCILE_SUMMARY_QUERY,
+)
+from serializer import dumps
+
+RECONCILES = {
+    index_name_film_work: ("film_work", index_schemas.MOVIES, reindex_film_works),
+    index_name_genre: ("genre", index_schemas.GENRES, reindex_genres),
+    index_name_person: ("person", index_schemas.PERSONS, reindex_persons),
+}
+
+# Глубже 8 цифр префикс упирается в первый дефис UUID
+MAX_DEPTH = 8
+# Сколько несовпавших диапазонов сравнивается построчно за один запрос
+RANGES_PER_QUERY = 256
+SCROLL_KEEP_ALIVE = "2m"
+
+
+def choose_depth(rows, range_rows=RECONCILE_RANGE_ROWS):
+    """Число цифр префикса, при котором в диапазоне в среднем не больше range_rows строк."""
+    depth = 1
+    while depth < MAX_DEPTH and rows / 16 ** depth > range_rows:
+        depth += 1
+    return depth
+
+
+def prefix_bounds(prefix):
+    """Первый и последний UUID диапазона с префиксом prefix (без дефисов)."""
+    padding = 32 - len(prefix)
+    return (
+        str(uuid.UUID(prefix + "0" * padding)),
+        str(uuid.UUID(prefix + "f" * padding)),
+    )
+
+
+def row_hash(row_id, millis):
+    """Хэш пары (id, updated_at в миллисекундах), как в RECONCILE_SUMMARY_QUERY."""
+    value = f"{row_id}:{'' if millis is None else millis}"
+    return int(hashlib.md5(value.encode()).hexdigest()[:15], 16)
+
+
+def estimate_rows(connection, alias, table):
+    """Оценка числа строк: статистика планировщика или число документов в индексе."""
+    with connection.cursor() as cursor:
+        cursor.execute(RECONCILE_ESTIMATE_QUERY.format(table=table))
+        estimate = cursor.fetchone()[0]
+    return max(estimate, es_request("GET", f"{alias}/_count")["count"])
+
+
+def postgres_summary(connection, table, depth):
+    """Число строк и сумма хэшей для каждого диапазона таблицы."""
+    with connection.cursor() as cursor:
+        cursor.execute(RECONCILE_SUMMARY_QUERY.format(table=table), {"depth": depth})
+        return {bucket: (count, int(hash_sum)) for bucket, count, hash_sum in cursor}
+
+
+def iter_es_hits(alias, query):
+    """Пары (id, updated_at в миллисекундах) документов индекса, подходящих под query."""
+    body = {
+        "size": RECONCILE_SCROLL_SIZE,
+        "query": query,
+        "_source": False,
+        "docvalue_fields": [{"field": "updated_at", "format": "epoch_millis"}],
+        "sort": ["_doc"],
+    }
+    result = es_request(
+        "POST", f"{alias}/_search", params={"scroll": SCROLL_KEEP_ALIVE}, json=body
+    )
+    try:
+        while result["hits"]["hits"]:
+            for hit in result["hits"]["hits"]:
+                values = hit.get("fields", {}).get("updated_at")
+                yield hit["_id"], int(float(values[0])) if values else None
+            result = es_request(
+                "POST",
+                "_search/scroll",
+                json={"scroll": SCROLL_KEEP_ALIVE, "scroll_id": result["_scroll_id"]},
+            )
+    finally:
+        es_request("DELETE", "_search/scroll", json={"scroll_id": result["_scroll_id"]})
+
+
+def es_summary(alias, depth):
+    """Число документов и сумма хэшей для каждого диапазона индекса."""
+    summary = {}
+    for doc_id, millis in iter_es_hits(alias, {"match_all": {}}):
+        bucket = doc_id[:depth]
+        count, hash_sum = summary.get(bucket, (0, 0))
+        summary[bucket] = (count + 1, hash_sum + row_hash(doc_id, millis))
+    return summary
+
+
+def rollup(summary, depth):
+    """Суммы по префиксам длины depth из сумм по более длинным префиксам."""
+    result = {}
+    for bucket, (count, hash_sum) in summary.items():
+        prefix = bucket[:depth]
+        total_count, total_hash = result.get(prefix, (0, 0))
+        result[prefix] = (total_count + count, total_hash + hash_sum)
+    return result
+
+
+def mismatched_ranges(postgres, elastic, depth, alias):
+    """Префиксы длины depth, суммы которых в Postgres и Elasticsearch различаются."""
+    mismatched = []
+    for level in range(1, depth + 1):
+        pg_level, es_level = rollup(postgres, level), rollup(elastic, level)
+        mismatched = sorted(
+            prefix
+            for prefix in pg_level.keys() | es_level.keys()
+            if pg_level.get(prefix) != es_level.get(prefix)
+        )
+        logging.info(
+            f"{alias}: уровень {level}, не совпало диапазонов: "
+            f"{len(mismatched)} из {len(pg_level.keys() | es_level.keys())}"
+        )
+    return mismatched
+
+
+def postgres_rows(connection, table, prefixes):
+    bounds = [prefix_bounds(prefix) for prefix in prefixes]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            RECONCILE_ROWS_QUERY.format(table=table),
+            {"lows": [low for low, _ in bounds], "highs": [high for _, high in bounds]},
+        )
+        return {str(row_id): millis for row_id, millis in cursor}
+
+
+def es_rows(alias, prefixes):
+    # Строковый порядок UUID в нижнем регистре совпадает с порядком самих UUID
+    ranges = [
+        {"range": {"id": {"gte": low, "lte": high}}}
+        for low, high in map(prefix_bounds, prefixes)
+    ]
+    query = {"bool": {"should": ranges, "minimum_should_match": 1}}
+    return dict(iter_es_hits(alias, query))
+
+
+def delete_documents(alias, ids):
+    with BulkLoader(name=alias) as loader:
+        loader.submit(
+            [dumps({"delete": {"_index": alias, "_id": doc_id}}) + b"\n" for doc_id in ids]
+        )
+    logging.info(f"Из {alias} удалено документов: {len(ids)}")
+
+
+def reconcile_index(connection, alias, dry_run=False):
+    """
+    Сверка индекса alias с его таблицей.
+
+    :param dry_run: только найти расхождения, ничего не исправляя
+    :return: словарь с числом несовпавших диапазонов и документов каждого вида
+    """
+    table, schema, reindex = RECONCILES[alias]
+    if not dry_run:
+        put_mapping(alias, schema)
+    es_request("POST", f"{alias}/_refresh")
+
+    depth = choose_depth(estimate_rows(connection, alias, table))
+    postgres = postgres_summary(connection, table, depth)
+    elastic = es_summary(alias, depth)
+    ranges = mismatched_ranges(postgres, elastic, depth, alias)
+
+    report = {"ranges": len(ranges), "missing": 0, "stale": 0, "orphans": 0}
+    for start in range(0, len(ranges), RANGES_PER_QUERY):
+        prefixes = ranges[start:start + RANGES_PER_QUERY]
+        expected = postgres_rows(connection, table, prefixes)
+        actual = es_rows(alias, prefixes)
+        missing = expected.keys() - actual.keys()
+        stale = {
+            row_id
+            for row_id in expected.keys() & actual.keys()
+            if expected[row_id] != actual[row_id]
+        }
+        orphans = actual.keys() - expected.keys()
+        report["missing"] += len(missing)
+        report["stale"] += len(stale)
+        report["orphans"] += len(orphans)
+        if dry_run:
+            continue
+        if missing or stale:
+            reindex(connection, sorted(missing | stale), force=True)
+        if orphans:
+            delete_documents(alias, sorted(orphans))
+    connection.rollback()
+
+    logging.info(
+        f"{alias}: глубина {depth}, диапазонов с расхождениями {report['ranges']}, "
+        f"нет в индексе {report['missing']}, устарело {report['stale']}, "
+        f"лишних {report['orphans']}"
+        + (" (без исправления)" if dry_run else "")
+    )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сверка индексов с Postgres")
+    parser.add_argument("indexes", nargs="+", choices=sorted(RECONCILES))
+    parser.add_argument("--dry-run", action="store_true", help="только отчёт, без исправления")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+    connection = None
+    try:
+        connection = get_connection()
+        for alias in args.indexes:
+            logging.info(f"Сверка индекса {alias}")
+            reconcile_index(connection, alias, dry_run=args.dry_run)
+    finally:
+        if connection:
+            connection.close()
@@ -0,0 +1,135 @@
+"""
+Долгоживущий процесс, периодически выгружающий movies, genres и persons.
+
+Каждый индекс — отдельное задание в своём потоке со своим интервалом из
+SCHEDULE_INTERVALS. Соединения с Postgres берутся из общего пула и
+возвращаются после каждого запуска.
+
+Интервал подстраивается под поток изменений: если изменений не было, он
+удваивается до IDLE_MAX_INTERVAL; если за запуск выгружено не меньше
+BACKLOG_THRESHOLD записей, следующий запуск выполняется сразу; иначе
+задание ждёт свой обычный интервал.
+
+Если включён spool (ETL_SPOOL_DIR), задания пишут пачки в него, а отдельный
+поток отправляет их в Elasticsearch.
+
+По SIGTERM или SIGINT задания перестают извлекать новые пачки, догружают уже
+извлечённые, сохраняют водяные знаки и процесс завершается.
+
+Запуск:
+    python scheduler.py
+"""
+import logging
+import signal
+import threading
+
+from config import (
+    BACKLOG_THRESHOLD,
+    IDLE_MAX_INTERVAL,
+    SCHEDULE_INTERVALS,
+    STATE_FILE_PATH,
+    index_name_film_work,
+    index_name_genre,
+    index_name_person,
+)
+from db import create_pool
+from metrics import start_http_server
+from pipelines import drain_spool, load_film_works, load_genres, load_persons
+from state import JsonFileStorage, State
+
+JOBS = {
+    index_name_person: load_persons,
+    index_name_genre: load_genres,
+    index_name_film_work: load_film_works,
+}
+
+
+def next_delay(delay, interval, processed):
+    """
+    Пауза перед следующим запуском задания.
+
+    :param delay: предыдущая пауза
+    :param interval: обычный интервал задания
+    :param processed: число выгруженных записей или None, если запуск упал
+    """
+    if processed is None or processed == 0:
+        return min(max(delay, interval) * 2, max(IDLE_MAX_INTERVAL, interval))
+    if processed >= BACKLOG_THRESHOLD:
+        return 0
+    return interval
+
+
+def run_once(pool, state, name, load, stop):
+    """Один запуск задания на соединении из пула."""
+    connection = pool.getconn()
+    try:
+        processed = load(connection, state, stop=stop)
+        connection.commit()
+        return processed
+    except Exception as e:
+        logging.error(f"{name}: ошибка выгрузки: {e}")
+        if not connection.closed:
+            connection.rollback()
+        return None
+    finally:
+        pool.putconn(connection, close=bool(connection.closed))
+
+
+def run_job(pool, state, name, load, interval, stop):
+    delay = interval
+    while not stop.is_set():
+        try:
+            processed = run_once(pool, state, name, load, stop)
+        except Exception as e:
+            # Например, нет соединения с Postgres для пула
+            logging.error(f"{name}: не удалось получить соединение: {e}")
+            processed = None
+        delay = next_delay(delay, interval, processed)
+        logging.info(
+            f"{name}: выгружено записей: {processed}, "
+            f"следующий запуск через {delay:.1f} с"
+        )
+        stop.wait(delay)
+    logging.info(f"{name}: задание остановлено")
+
+
+def run(state, intervals=SCHEDULE_INTERVALS):
+    stop = threading.Event()
+
+    def shutdown(signum, frame):
+        logging.info(f"Получен сигнал {signal.Signals(signum).name}, завершение")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    pool = create_pool(1, len(JOBS))
+    threads = [
+        threading.Thread(
+            target=run_job,
+            args=(pool, state, name, load, intervals[name], stop),
+            name=f"job-{name}",
+        )
+        for name, load in JOBS.items()
+    ]
+    threads.append(threading.Thread(target=drain_spool, args=(stop,), name="spool"))
+    try:
+        for thread in threads:
+            thread.start()
+        # join с таймаутом, чтобы основной поток успевал обрабатывать сигналы
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=1)
+    finally:
+        pool.closeall()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(threadName)s %(message)s",
+    )
+    logging.info("Планировщик ETL запущен")
+    start_http_server()
+    run(State(JsonFileStorage(STATE_FILE_PATH)))
+    logging.info("Планировщик ETL остановлен")
@@ -0,0 +1,97 @@
+"""
+Сериализация документов в NDJSON для _bulk.
+
+Если установлен orjson, используется он (в разы быстрее и сразу возвращает
+bytes), иначе стандартный json. UUID, Decimal, datetime и date
+сериализуются в обоих случаях без предварительного приведения в Python.
+"""
+import datetime
+import decimal
+import gzip
+import json
+import uuid
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - зависит от окружения
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Тип {type(value).__name__} не сериализуется в JSON")
+
+
+if orjson is not None:
+
+    def dumps(value):
+        """Сериализация значения в JSON (bytes)."""
+        return orjson.dumps(value, default=_default)
+
+    loads = orjson.loads
+
+else:
+    _encoder = json.JSONEncoder(default=_default, separators=(",", ":"), ensure_ascii=False)
+
+    def dumps(value):
+        """Сериализация значения в JSON (bytes)."""
+        return _encoder.encode(value).encode()
+
+    loads = json.loads
+
+
+def bulk_line(action, document):
+    """Документ _bulk: строка действия и строка тела, каждая с переводом строки."""
+    return b"%b\n%b\n" % (dumps(action), dumps(document))
+
+
+class NdjsonBuffer:
+    """
+    Переиспользуемый буфер тела _bulk.
+
+    Документы дописываются в один bytearray, смещения их начала запоминаются,
+    чтобы при частичном отказе можно было вырезать отдельные документы.
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = []
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def append(self, doc):
+        self.offsets.append(len(self.data))
+        self.data += doc
+
+    def take(self):
+        """
+        Содержимое буфера и смещения документов; буфер очищается для повторного использования.
+
+        :return: пара (bytes, список смещений начала документов)
+        """
+        body = bytes(self.data)
+        offsets = self.offsets
+        self.data.clear()
+        self.offsets = []
+        return body, offsets
+
+
+def split_documents(body, offsets):
+    """Разрезание тела _bulk на отдельные документы по смещениям."""
+    bounds = offsets[1:] + [len(body)]
+    return [body[start:end] for start, end in zip(offsets, bounds)]
+
+
+def compress(body, level):
+    """Сжатие тела запроса для Content-Encoding: gzip."""
+    return gzip.compress(body, compresslevel=level)
@@ -0,0 +1,362 @@
+"""
+Локальная очередь пачек _bulk на диске (spool).
+
+Когда spool включён (ETL_SPOOL_DIR), конвейер не отправляет пачки в
+Elasticsearch сам, а дописывает их в сегменты spool и сразу после fsync
+продвигает водяной знак: пачка уже не потеряется. Отдельный поток-разгрузчик
+(drain) читает сегменты по порядку и отправляет их через BulkLoader. Сегмент
+удаляется только после того, как Elasticsearch подтвердил все его пачки,
+поэтому после перезапуска неподтверждённые пачки отправляются повторно
+(операции index идемпотентны). Пока ES недоступен, чтение из Postgres
+продолжается, пока объём spool не достигнет SPOOL_MAX_BYTES: после этого
+запись в spool блокируется (backpressure).
+
+Сегмент — файл segment-<номер>.spool из записей: строка-заголовок JSON
+(число документов, размер тела, отпечатки документов) и тело — NDJSON пачки.
+Запись в сегмент только дописывается; запись, оборванная падением процесса,
+при чтении отбрасывается (водяной знак для неё не сохранялся). После
+перезапуска запись идёт в новый сегмент.
+
+Документы, которые Elasticsearch отклонил окончательно (например, из-за
+несоответствия маппингу), пишутся в файл недоставленных (dead letter) и могут
+быть отправлены повторно командой replay после исправления причины.
+
+Запуск:
+    python spool.py status
+    python spool.py drain            # разгрузить spool и выйти
+    python spool.py replay           # повторно отправить недоставленные
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from config import DEAD_LETTER_PATH, SPOOL_DIR, SPOOL_MAX_BYTES, SPOOL_SEGMENT_BYTES
+from loader import BulkLoader
+
+_SEGMENT_PREFIX = "segment-"
+_SEGMENT_SUFFIX = ".spool"
+
+# Как часто разгрузчик проверяет новые записи, если его не разбудили
+_POLL_INTERVAL = 1.0
+
+
+def _segment_name(seq):
+    return f"{_SEGMENT_PREFIX}{seq:012d}{_SEGMENT_SUFFIX}"
+
+
+def iter_docs(body):
+    """Документы _bulk из тела пачки: по две строки NDJSON (действие и документ)."""
+    lines = body.split(b"\n")
+    for i in range(0, len(lines) - 1, 2):
+        yield b"%b\n%b\n" % (lines[i], lines[i + 1])
+
+
+class Spool:
+    """Сегментированная очередь пачек на диске с ограничением объёма."""
+
+    def __init__(self, directory, segment_bytes=SPOOL_SEGMENT_BYTES, max_bytes=SPOOL_MAX_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.changed = threading.Condition()
+        # Номер сегмента -> размер записанных в него данных
+        self.sizes = {}
+        for name in os.listdir(directory):
+            if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX):
+                seq = int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)])
+                self.sizes[seq] = os.path.getsize(self._path(seq))
+        self.active = None
+        self.active_seq = max(self.sizes, default=0)
+        if self.sizes:
+            logging.info(
+                f"В spool {len(self.sizes)} сегментов, {self.total_bytes()} байт "
+                "ожидают отправки"
+            )
+
+    def _path(self, seq):
+        return os.path.join(self.directory, _segment_name(seq))
+
+    def total_bytes(self):
+        return sum(self.sizes.values())
+
+    def segments(self):
+        with self.changed:
+            return sorted(self.sizes)
+
+    def append(self, bulk_data, fingerprints=None):
+        """
+        Запись пачки на диск; возвращается после fsync.
+
+        Блокируется, пока объём spool не опустится ниже max_bytes.
+        """
+        body = b"".join(bulk_data)
+        header = {
+            "docs": len(bulk_data),
+            "size": len(body),
+            "fingerprints": [
+                [index, doc_id, doc_hash.hex()]
+                for index, doc_id, doc_hash in fingerprints or ()
+            ],
+        }
+        record = json.dumps(header).encode() + b"\n" + body
+        with self.changed:
+            if self.total_bytes() >= self.max_bytes:
+                logging.warning(
+                    f"Spool заполнен ({self.total_bytes()} байт), ожидание отправки в Elasticsearch"
+                )
+                while self.total_bytes() >= self.max_bytes:
+                    self.changed.wait()
+            if self.active is None or self.sizes[self.active_seq] >= self.segment_bytes:
+                self._roll()
+            self.active.write(record)
+            self.active.flush()
+            os.fsync(self.active.fileno())
+            self.sizes[self.active_seq] += len(record)
+            self.changed.notify_all()
+
+    def _roll(self):
+        """Закрытие текущего сегмента и начало нового."""
+        if self.active is not None:
+            self.active.close()
+        self.active_seq += 1
+        self.active = open(self._path(self.active_seq), "ab")
+        self.sizes[self.active_seq] = 0
+
+    def seal(self):
+        """Закрытие текущего сегмента, чтобы его можно было удалить после отправки."""
+        with self.changed:
+            if self.active is not None:
+                self.active.close()
+                self.active = None
+                if not self.sizes[self.active_seq]:
+                    os.remove(self._path(self.active_seq))
+                    del self.sizes[self.active_seq]
+            self.changed.notify_all()
+
+    def is_sealed(self, seq):
+        with self.changed:
+            return self.active is None or seq != self.active_seq
+
+    def read(self, seq, offset):
+        """
+        Записи сегмента seq начиная со смещения offset.
+
+        :return: список пар (документы, отпечатки) и смещение после последней целой записи
+        """
+        with self.changed:
+            limit = self.sizes.get(seq, 0)
+        if offset >= limit:
+            return [], offset
+        records = []
+        with open(self._path(seq), "rb") as file:
+            file.seek(offset)
+            data = file.read(limit - offset)
+        position = 0
+        while position < len(data):
+            end = data.find(b"\n", position)
+            if end < 0:
+                break
+            header = json.loads(data[position:end])
+            body_end = end + 1 + header["size"]
+            if body_end > len(data):
+                break
+            fingerprints = [
+                (index, doc_id, bytes.fromhex(doc_hash))
+                for index, doc_id, doc_hash in header["fingerprints"]
+            ]
+            records.append((list(iter_docs(data[end + 1:body_end])), fingerprints))
+            position = body_end
+        if position < len(data) and self.is_sealed(seq):
+            logging.warning(f"Сегмент {seq}: отброшена оборванная запись, {len(data) - position} байт")
+            position = len(data)
+        return records, offset + position
+
+    def remove(self, seq):
+        """Удаление сегмента, все пачки которого подтверждены Elasticsearch."""
+        with self.changed:
+            if seq not in self.sizes:
+                # Пустой сегмент, удалённый при закрытии
+                return
+            os.remove(self._path(seq))
+            del self.sizes[seq]
+            self.changed.notify_all()
+        logging.debug(f"Сегмент spool {seq} отправлен и удалён")
+
+    def wait(self, timeout=_POLL_INTERVAL):
+        with self.changed:
+            self.changed.wait(timeout)
+
+    def close(self):
+        self.seal()
+
+
+class DeadLetters:
+    """Файл документов, окончательно отклонённых Elasticsearch, по одному JSON в строке."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def write(self, doc, outcome):
+        record = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "index": outcome.get("_index"),
+            "id": outcome.get("_id"),
+            "status": outcome.get("status"),
+            "error": outcome.get("error"),
+            "doc": doc.decode(),
+        }
+        with self.lock:
+            with open(self.path, "a") as file:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+
+
+def open_spool(directory=SPOOL_DIR):
+    """Spool или None, если он отключён (каталог не задан)."""
+    if not directory:
+        return None
+    return Spool(directory)
+
+
+def open_dead_letters(path=DEAD_LETTER_PATH):
+    if not path:
+        return None
+    return DeadLetters(path)
+
+
+def drain(spool, stop=None, save_fingerprints=None, dead_letters=None, prepare=None):
+    """
+    Отправка содержимого spool в Elasticsearch.
+
+    Без stop разгружает всё записанное к моменту вызова и возвращается. Со
+    stop работает, пока событие не установлено, дожидаясь новых записей. Ошибки
+    отправки (ES недоступен дольше BULK_RETRY_DEADLINE) логируются, и отправка
+    начинается заново с первого неподтверждённого сегмента.
+
+    :param save_fingerprints: функция сохранения отпечатков подтверждённых документов,
+        вызывается с отпечатками пачки и множеством _id отклонённых документов
+    :param prepare: функция, вызываемая перед каждой попыткой отправки
+        (например, обновление маппингов индексов)
+    :return: число отправленных документов
+    """
+    follow = stop is not None
+    sent = 0
+    while True:
+        try:
+            if prepare is not None:
+                prepare()
+            sent += _drain_once(spool, stop, save_fingerprints, dead_letters)
+            return sent
+        except Exception as e:
+            logging.error(f"Ошибка отправки spool в Elasticsearch: {e}")
+            if not follow:
+                raise
+            if stop.wait(_POLL_INTERVAL * 5):
+                return sent
+
+
+def _drain_once(spool, stop, save_fingerprints, dead_letters):
+    follow = stop is not None
+    if not follow:
+        # Разгружается только записанное к этому моменту
+        spool.seal()
+    sent = 0
+    segments = spool.segments()
+    with BulkLoader(dead_letters=dead_letters, name="spool") as loader:
+        while segments or follow:
+            if follow and stop.is_set():
+                break
+            if not segments:
+                loader.flush()
+                spool.wait()
+                segments = spool.segments()
+                continue
+            seq = segments.pop(0)
+            offset = 0
+            while True:
+                # Если сегмент закрыт до чтения, чтение получит его целиком
+                sealed = spool.is_sealed(seq)
+                records, offset = spool.read(seq, offset)
+                for docs, fingerprints in records:
+                    on_success = None
+                    if fingerprints and save_fingerprints is not None:
+                        on_success = functools.partial(
+                            save_fingerprints, fingerprints, loader.rejected
+                        )
+                    loader.submit(docs, on_success)
+                    sent += len(docs)
+                if records:
+                    continue
+                if sealed:
+                    break
+                # Без stop в незакрытый сегмент пишут после вызова: записанное
+                # к моменту вызова уже прочитано, а сегмент удалять нельзя
+                if stop is None or stop.is_set():
+                    return sent
+                loader.flush()
+                spool.wait()
+            # Сегмент удаляется после подтверждения всех пачек, отправленных до него
+            loader.submit([], functools.partial(spool.remove, seq))
+            if follow:
+                segments = [s for s in spool.segments() if s > seq]
+    return sent
+
+
+def replay_dead_letters(path=DEAD_LETTER_PATH):
+    """
+    Повторная отправка недоставленных документов.
+
+    Файл переименовывается перед отправкой; документы, снова отклонённые
+    окончательно, попадают в новый файл недоставленных.
+    :return: число отправленных документов
+    """
+    if not os.path.exists(path):
+        logging.info("Недоставленных документов нет")
+        return 0
+    replaying = f"{path}.{int(time.time())}.replay"
+    os.replace(path, replaying)
+    sent = 0
+    with BulkLoader(dead_letters=DeadLetters(path)) as loader:
+        with open(replaying) as file:
+            for line in file:
+                if line.strip():
+                    loader.submit([json.loads(line)["doc"].encode()])
+                    sent += 1
+    os.remove(replaying)
+    logging.info(f"Повторно отправлено документов: {sent}, отклонено снова: {loader.failed}")
+    return sent
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Spool пачек _bulk")
+    parser.add_argument("command", choices=("status", "drain", "replay"))
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+    if args.command == "replay":
+        replay_dead_letters()
+    else:
+        spool = open_spool()
+        if spool is None:
+            parser.error("spool отключён: задайте ETL_SPOOL_DIR")
+        if args.command == "status":
+            print(f"Сегментов: {len(spool.segments())}, байт: {spool.total_bytes()}")
+        else:
+            from pipelines import save_fingerprints
+
+            sent = drain(
+                spool,
+                save_fingerprints=save_fingerprints,
+                dead_letters=open_dead_letters(),
+            )
+            logging.info(f"Из spool отправлено документов: {sent}")
@@ -0,0 +1,87 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+from metrics import watermark_lag_seconds
+
+
+class JsonFileStorage:
+    """
+    Хранилище состояния в JSON-файле на локальном диске.
+
+    Запись атомарная: состояние пишется во временный файл в том же каталоге,
+    сбрасывается на диск и подменяет основной файл через os.replace. При падении
+    посреди записи на диске остаётся либо старое, либо новое состояние целиком.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def save_state(self, state):
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".state-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(state, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def retrieve_state(self):
+        try:
+            with open(self.file_path) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError:
+            logging.error(f"Файл состояния {self.file_path} повреждён, начинаем заново")
+            return {}
+
+
+class State:
+    """
+    Ключ-значение поверх хранилища, каждое изменение сразу сохраняется.
+
+    Изменения из разных потоков (например, заданий планировщика) сохраняются
+    по очереди.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.state = storage.retrieve_state()
+        self.lock = threading.Lock()
+
+    def set_state(self, key, value):
+        with self.lock:
+            self.state[key] = value
+            self.storage.save_state(self.state)
+
+    def get_state(self, key, default=None):
+        return self.state.get(key, default)
+
+    def get_watermark(self, table, index):
+        """
+        Последний выгруженный ключ (updated_at, id) таблицы в индекс.
+
+        :return: кортеж (datetime, id) или None, если выгрузки ещё не было
+        """
+        value = self.get_state(f"{table}:{index}")
+        if value is None:
+            return None
+        updated_at, row_id = value
+        return datetime.fromisoformat(updated_at), row_id
+
+    def set_watermark(self, table, index, key):
+        updated_at, row_id = key
+        self.set_state(f"{table}:{index}", [updated_at.isoformat(), str(row_id)])
+        if updated_at.tzinfo is None:
+            updated_at = updated_at.replace(tzinfo=timezone.utc)
+        lag = (datetime.now(timezone.utc) - updated_at).total_seconds()
+        watermark_lag_seconds.set(lag, table=table, index=index)
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# Модули ETL лежат в корне репозитория и импортируются по имени, без пакета
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_es import FakeElasticsearch  # noqa: E402
+
+
+@pytest.fixture
+def fake_es():
+    """Локальный сервер _bulk из бенчмарков на свободном порту."""
+    server = FakeElasticsearch(0).start()
+    yield server
+    server.shutdown()
+    server.server_close()
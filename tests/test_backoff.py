@@ -0,0 +1,111 @@
+import asyncio
+import itertools
+
+import pytest
+
+import backoff as backoff_module
+from backoff import backoff, backoff_delays
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Паузы вместо time.sleep; часы time.monotonic идут только во время пауз."""
+    slept = []
+    monkeypatch.setattr(backoff_module.time, "sleep", slept.append)
+    monkeypatch.setattr(backoff_module.time, "monotonic", lambda: sum(slept))
+    return slept
+
+
+def test_delays_grow_up_to_border():
+    delays = backoff_delays(start_sleep_time=1, factor=2, border_sleep_time=5)
+    assert list(itertools.islice(delays, 5)) == [1, 2, 4, 5, 5]
+
+
+def test_jitter_stays_within_delay():
+    delays = backoff_delays(start_sleep_time=1, factor=2, border_sleep_time=4, jitter=True)
+    for delay, limit in zip(delays, [1, 2, 4, 4, 4, 4]):
+        assert 0 <= delay <= limit
+
+
+def test_retries_until_success(sleeps):
+    calls = []
+
+    @backoff(start_sleep_time=1, border_sleep_time=10, exception_type=ValueError)
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ValueError("ещё нет")
+        return "ok"
+
+    assert flaky() == "ok"
+    assert sleeps == [1, 2]
+
+
+def test_exhausted_returns_none_or_reraises(sleeps):
+    @backoff(max_iter=3, exception_type=ValueError)
+    def quiet():
+        raise ValueError("всегда")
+
+    @backoff(max_iter=3, exception_type=ValueError, reraise=True)
+    def loud():
+        raise ValueError("всегда")
+
+    assert quiet() is None
+    with pytest.raises(ValueError):
+        loud()
+    assert len(sleeps) == 4
+
+
+def test_other_exceptions_are_not_retried(sleeps):
+    @backoff(exception_type=ValueError)
+    def broken():
+        raise KeyError("не повторяется")
+
+    with pytest.raises(KeyError):
+        broken()
+    assert sleeps == []
+
+
+def test_policy_overrides_attempts_per_exception_type(sleeps):
+    calls = []
+
+    @backoff(max_iter=10, policies={TimeoutError: {"max_iter": 1}}, reraise=True)
+    def timing_out():
+        calls.append(1)
+        raise TimeoutError()
+
+    with pytest.raises(TimeoutError):
+        timing_out()
+    assert len(calls) == 1
+    assert sleeps == []
+
+
+def test_deadline_stops_before_sleeping_past_it(sleeps):
+    @backoff(start_sleep_time=5, max_iter=100, deadline=12, reraise=True)
+    def failing():
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        failing()
+    # После паузы 5 с до срока остаётся 7 с, а следующая пауза — 10 с
+    assert sleeps == [5]
+
+
+def test_coroutine_is_retried_with_async_sleep(monkeypatch):
+    slept = []
+
+    async def fake_sleep(delay):
+        slept.append(delay)
+
+    monkeypatch.setattr(backoff_module.asyncio, "sleep", fake_sleep)
+    calls = []
+
+    @backoff(start_sleep_time=1, max_iter=None, exception_type=ValueError)
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 4:
+            raise ValueError("ещё нет")
+        return "ok"
+
+    assert asyncio.run(flaky()) == "ok"
+    assert slept == [1, 2, 4]
@@ -0,0 +1,59 @@
+import json
+
+from copy_extract import parse_copy, unescape
+
+COLUMNS = ("id", "full_name", "updated_at", "films")
+
+
+def copy_output(rows):
+    return "".join("\t".join(row) + "\n" for row in rows).encode()
+
+
+def test_unescape():
+    assert unescape("\\N") is None
+    assert unescape("plain") == "plain"
+    assert unescape("a\\tb\\nc\\\\d") == "a\tb\nc\\d"
+
+
+def test_rows_are_readable_by_name_and_position():
+    data = copy_output([("1", "Ann", "2024-01-01 00:00:00+00", "[]")])
+    [row] = parse_copy([data], COLUMNS, json_columns=("films",))
+    assert row["id"] == "1" and row[1] == "Ann"
+    assert row["updated_at"] == "2024-01-01 00:00:00+00"
+    assert row["films"] == []
+    assert list(row.keys()) == list(COLUMNS)
+
+
+def test_rows_split_between_chunks():
+    films = json.dumps([{"id": "f", "roles": ["actor"]}])
+    data = copy_output([
+        ("1", "Анна", "2024-01-01", films),
+        ("2", "Bob", "2024-01-02", "[]"),
+        ("3", "Eve", "2024-01-03", "[]"),
+    ])
+    # Куски режут строки и многобайтовые символы где угодно
+    for size in (1, 2, 7, len(data)):
+        chunks = [data[i:i + size] for i in range(0, len(data), size)]
+        rows = list(parse_copy(chunks, COLUMNS, json_columns=("films",)))
+        assert [row["id"] for row in rows] == ["1", "2", "3"]
+        assert rows[0]["full_name"] == "Анна"
+        assert rows[0]["films"] == [{"id": "f", "roles": ["actor"]}]
+
+
+def test_null_and_escaped_fields():
+    data = copy_output([("1", "\\N", "2024-01-01", "\\N"), ("2", "Tab\\there", "2024-01-01", "[]")])
+    first, second = parse_copy([data], COLUMNS, json_columns=("films",))
+    assert first["full_name"] is None and first["films"] is None
+    assert second["full_name"] == "Tab\there"
+
+
+def test_escaped_json_is_decoded_after_unescaping():
+    # COPY удваивает обратную косую черту внутри JSON
+    data = copy_output([("1", "x", "2024-01-01", '["a\\\\"b"]')])
+    [row] = parse_copy([data], COLUMNS, json_columns=("films",))
+    assert row["films"] == ['a"b']
+
+
+def test_incomplete_last_line_is_not_emitted():
+    data = copy_output([("1", "Ann", "2024-01-01", "[]")]) + b"2\tBob"
+    assert [row["id"] for row in parse_copy([data], COLUMNS)] == ["1"]
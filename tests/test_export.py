@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+import pytest
+
+import export
+from export import ExportSink, iter_shard_batches, read_manifest, replay
+from serializer import bulk_line
+from state import State
+
+COMPRESSIONS = ["gzip", "none"] + (["zstd"] if export.zstandard is not None else [])
+
+
+def docs(start, count, version=0):
+    return [
+        bulk_line({"index": {"_id": str(i), "_index": "movies"}}, {"n": i, "version": version})
+        for i in range(start, start + count)
+    ]
+
+
+def key(hour):
+    return datetime(2024, 1, 1, hour, tzinfo=timezone.utc), str(hour)
+
+
+def dump_batches(directory, batches, shard_bytes=500, compression="gzip"):
+    """Выгрузка пачек так же, как это делает pipelines.bulk_loader."""
+    sink = ExportSink(str(directory), "movies", shard_bytes=shard_bytes, compression=compression)
+    state = State(sink)
+    with sink:
+        for hour, bulk_data in batches:
+            sink.submit(
+                bulk_data,
+                lambda hour=hour: state.set_watermark("film_work", "movies", key(hour)),
+            )
+    return sink
+
+
+def shard_docs(directory, shard):
+    path = os.path.join(directory, "movies", shard["file"])
+    return [doc for batch in iter_shard_batches(path, shard["compression"]) for doc in batch]
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+def test_shards_round_trip(tmp_path, monkeypatch, compression):
+    # Маленькие куски чтения: документы режутся между кусками
+    monkeypatch.setattr(export, "_READ_CHUNK", 7)
+    batches = [(hour, docs(hour * 5, 5)) for hour in range(6)]
+    dump_batches(tmp_path, batches, compression=compression)
+
+    manifest = read_manifest(str(tmp_path / "movies"))
+    shards = manifest["shards"]
+    assert len(shards) > 1
+    assert not [name for name in os.listdir(tmp_path / "movies") if name.endswith(".part")]
+    written = [doc for shard in shards for doc in shard_docs(str(tmp_path), shard)]
+    assert written == [doc for _, bulk_data in batches for doc in bulk_data]
+    for shard in shards:
+        assert shard["docs"] == len(shard_docs(str(tmp_path), shard))
+        assert shard["compression"] == compression
+
+
+def test_manifest_watermarks_chain_and_resume(tmp_path):
+    dump_batches(tmp_path, [(hour, docs(hour * 5, 5)) for hour in range(6)])
+    manifest = read_manifest(str(tmp_path / "movies"))
+    watermarks = [shard["watermark"] for shard in manifest["shards"]]
+    assert watermarks[0][0] == {}
+    for previous, current in zip(watermarks, watermarks[1:]):
+        assert current[0] == previous[1]
+    assert watermarks[-1][1] == manifest["state"]
+
+    sink = ExportSink(str(tmp_path), "movies")
+    assert sink.run == 2
+    assert State(sink).get_watermark("film_work", "movies") == key(5)
+
+
+def test_failed_dump_keeps_previous_state(tmp_path):
+    sink = ExportSink(str(tmp_path), "movies", shard_bytes=10 ** 6, compression="none")
+    state = State(sink)
+    with pytest.raises(RuntimeError):
+        with sink:
+            sink.submit(docs(0, 5), lambda: state.set_watermark("film_work", "movies", key(1)))
+            raise RuntimeError("сбой посреди выгрузки")
+
+    assert state.get_watermark("film_work", "movies") is None
+    assert os.listdir(tmp_path / "movies") == []
+    restarted = State(ExportSink(str(tmp_path), "movies"))
+    assert restarted.get_watermark("film_work", "movies") is None
+
+
+def test_leftover_part_file_is_removed(tmp_path):
+    (tmp_path / "movies").mkdir()
+    (tmp_path / "movies" / "movies-000001.ndjson.part").write_bytes(b"torn")
+    ExportSink(str(tmp_path), "movies")
+    assert os.listdir(tmp_path / "movies") == []
+
+
+def test_truncated_shard_is_an_error(tmp_path):
+    dump_batches(tmp_path, [(0, docs(0, 3))], compression="none")
+    [shard] = read_manifest(str(tmp_path / "movies"))["shards"]
+    path = tmp_path / "movies" / shard["file"]
+    path.write_bytes(path.read_bytes()[:-5])
+    with pytest.raises(ValueError):
+        shard_docs(str(tmp_path), shard)
+
+
+def test_replay_loads_runs_in_order(tmp_path, fake_es):
+    dump_batches(tmp_path, [(hour, docs(hour * 10, 10, version=1)) for hour in range(4)])
+    # Второй запуск выгрузки переписывает часть документов
+    dump_batches(tmp_path, [(4, docs(0, 20, version=2))])
+
+    sent = replay(str(tmp_path), ["movies"], url=fake_es.url, workers=4)
+
+    assert sent == 60
+    latest = {}
+    for doc in docs(0, 40, version=1) + docs(0, 20, version=2):
+        action, body = doc.split(b"\n")[:2]
+        latest[json.loads(action)["index"]["_id"]] = body
+    expected = {
+        ("movies", doc_id): hashlib.blake2b(body, digest_size=8).hexdigest()
+        for doc_id, body in latest.items()
+    }
+    assert fake_es.stats.digests() == expected
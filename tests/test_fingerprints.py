@@ -0,0 +1,119 @@
+import datetime
+import uuid
+
+import pytest
+
+import pipelines
+from fingerprints import FingerprintStore, document_hash, open_fingerprint_store
+from serializer import bulk_line
+from transform import GENRES
+
+
+def doc(doc_id, **body):
+    return bulk_line({"index": {"_id": doc_id, "_index": "genres"}}, {"id": doc_id, **body})
+
+
+def genre(name, updated_at):
+    return {
+        "id": uuid.UUID(int=1),
+        "name": name,
+        "description": None,
+        "updated_at": datetime.datetime(2024, 1, 1, updated_at, tzinfo=datetime.timezone.utc),
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FingerprintStore(str(tmp_path / "fingerprints.sqlite"))
+
+
+def test_hash_ignores_trailing_updated_at_and_action():
+    base = document_hash(doc("1", name="Drama", updated_at="2024-01-01T00:00:00Z"))
+    assert document_hash(doc("1", name="Drama", updated_at="2024-06-01T00:00:00Z")) == base
+    assert document_hash(doc("1", name="Comedy", updated_at="2024-01-01T00:00:00Z")) != base
+    # Строка действия (имя индекса) в хэш не входит
+    other_index = bulk_line(
+        {"index": {"_id": "1", "_index": "genres_20240101000000"}},
+        {"id": "1", "name": "Drama", "updated_at": "2024-01-01T00:00:00Z"},
+    )
+    assert document_hash(other_index) == base
+    assert len(base) == 8
+
+
+def test_hash_keeps_updated_at_inside_string_values():
+    # Кавычка внутри строки экранирована: это не ключ верхнего уровня
+    first = doc("1", name='x,"updated_at":1')
+    second = doc("1", name='x,"updated_at":2')
+    assert document_hash(first) != document_hash(second)
+
+
+def test_saved_documents_are_filtered_until_they_change(store):
+    docs = [doc("1", name="Drama"), doc("2", name="Comedy")]
+    kept, fingerprints = store.filter("genres", ["1", "2"], docs)
+    assert kept == docs
+    store.save(fingerprints)
+
+    changed = [doc("1", name="Drama"), doc("2", name="Satire")]
+    kept, fingerprints = store.filter("genres", ["1", "2"], changed)
+    assert kept == [changed[1]]
+    assert [(index, doc_id) for index, doc_id, _ in fingerprints] == [("genres", "2")]
+    assert store.skip_rate("genres") == 0.25
+
+
+def test_save_replaces_previous_hash(store):
+    store.save([("genres", "1", b"\x00" * 8)])
+    store.save([("genres", "1", b"\x01" * 8), ("persons", "1", b"\x02" * 8)])
+    assert store._lookup("genres", ["1"]) == {"1": b"\x01" * 8}
+    assert store._lookup("persons", ["1", "2"]) == {"1": b"\x02" * 8}
+
+
+def test_record_only_keeps_everything_but_returns_fingerprints(store):
+    docs = [doc("1", name="Drama")]
+    store.save(store.filter("genres", ["1"], docs)[1])
+
+    kept, fingerprints = store.filter("genres", ["1"], docs, record_only=True)
+    assert kept == docs
+    assert fingerprints == [("genres", "1", document_hash(docs[0]))]
+
+
+def test_store_survives_reopening(tmp_path):
+    path = str(tmp_path / "fingerprints.sqlite")
+    open_fingerprint_store(path).save([("genres", "1", b"\x03" * 8)])
+    assert open_fingerprint_store(path)._lookup("genres", ["1"]) == {"1": b"\x03" * 8}
+    assert open_fingerprint_store("") is None
+
+
+@pytest.fixture
+def pipeline_store(monkeypatch, store):
+    monkeypatch.setattr(pipelines, "fingerprint_store", store)
+    return store
+
+
+def test_save_fingerprints_round_trip_skips_rejected(pipeline_store):
+    transform = pipelines.bulk_transformer(GENRES)
+    rows = [genre("Drama", 1), {**genre("Comedy", 1), "id": uuid.UUID(int=2)}]
+    bulk_data, fingerprints = transform(rows)
+    assert len(bulk_data) == 2
+
+    # Второй документ Elasticsearch отклонил окончательно
+    pipelines.save_fingerprints(fingerprints, rejected={str(uuid.UUID(int=2))})
+
+    # Первый не изменился (updated_at не в счёт) и отбрасывается, второй отправляется снова
+    bulk_data, _ = transform([genre("Drama", 2), rows[1]])
+    assert bulk_data == transform([rows[1]])[0]
+
+
+def test_force_and_new_index_send_unchanged_documents(pipeline_store):
+    rows = [genre("Drama", 1)]
+    pipelines.save_fingerprints(pipelines.bulk_transformer(GENRES)(rows)[1])
+
+    assert pipelines.bulk_transformer(GENRES)(rows)[0] == []
+    bulk_data, fingerprints = pipelines.bulk_transformer(GENRES, force=True)(rows)
+    assert len(bulk_data) == 1 and len(fingerprints) == 1
+    # Запись в новую версию индекса: отпечатки ведутся по алиасу
+    bulk_data, fingerprints = pipelines.bulk_transformer(
+        GENRES, index="genres_20240101000000"
+    )(rows)
+    assert len(bulk_data) == 1
+    assert fingerprints[0][0] == GENRES["index"]
+    assert pipelines.bulk_transformer(GENRES, use_fingerprints=False)(rows)[1] is None
@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+import index_schemas
+import indexes
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self.payload = payload or {}
+        self.text = json.dumps(self.payload)
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class FakeCluster:
+    """Индексы с маппингами и журнал запросов, изменяющих их."""
+
+    def __init__(self, indices=None):
+        self.indices = indices or {}
+        self.writes = []
+
+    def get(self, url, **kwargs):
+        name = url.split("/")[-2]
+        if name not in self.indices:
+            return FakeResponse(404, {"error": {"type": "index_not_found_exception"}})
+        return FakeResponse(200, {
+            index: {"mappings": {"properties": properties}}
+            for index, properties in self.indices[name].items()
+        })
+
+    def put(self, url, json=None, **kwargs):
+        name = url.split("/")[-1]
+        if name in self.indices:
+            return FakeResponse(400, {"error": {"type": "resource_already_exists_exception"}})
+        self.writes.append(("create", name))
+        self.indices[name] = {name: dict(json["mappings"]["properties"])}
+        return FakeResponse(200, {"acknowledged": True})
+
+    def request(self, method, url, json=None, **kwargs):
+        name, endpoint = url.split("/")[-2:]
+        assert (method, endpoint) == ("PUT", "_mapping")
+        self.writes.append(("mapping", name, sorted(json["properties"])))
+        for properties in self.indices[name].values():
+            properties.update(json["properties"])
+        return FakeResponse(200, {"acknowledged": True})
+
+
+@pytest.fixture
+def cluster(monkeypatch):
+    cluster = FakeCluster()
+    monkeypatch.setattr(indexes, "requests", cluster)
+    return cluster
+
+
+def test_missing_index_is_created_from_schema(cluster):
+    indexes.put_mapping("genres", index_schemas.GENRES)
+    assert cluster.writes == [("create", "genres")]
+    assert cluster.indices["genres"]["genres"] == index_schemas.GENRES["mappings"]["properties"]
+
+
+def test_only_absent_fields_are_added(cluster):
+    properties = dict(index_schemas.MOVIES["mappings"]["properties"])
+    del properties["updated_at"]
+    # Существующее поле с другим определением не трогается
+    properties["title"] = {"type": "keyword"}
+    cluster.indices["movies"] = {"movies_20240101000000": properties}
+
+    indexes.put_mapping("movies", index_schemas.MOVIES)
+    assert cluster.writes == [("mapping", "movies", ["updated_at"])]
+
+    indexes.put_mapping("movies", index_schemas.MOVIES)
+    assert len(cluster.writes) == 1
+
+
+def test_ensure_mapping_runs_once_per_alias(cluster, monkeypatch):
+    monkeypatch.setattr(indexes, "_mapped", set())
+    for _ in range(3):
+        indexes.ensure_mapping("persons", index_schemas.PERSONS)
+    assert cluster.writes == [("create", "persons")]
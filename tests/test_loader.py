@@ -0,0 +1,166 @@
+import asyncio
+import json
+
+import pytest
+
+import loader
+from loader import (
+    BulkBatcher,
+    BulkLoader,
+    DocumentsRejected,
+    handle_response,
+    join_documents,
+)
+from serializer import bulk_line
+from spool import DeadLetters
+
+
+def docs(start, count, size=0):
+    return [
+        bulk_line({"index": {"_id": str(i), "_index": "movies"}}, {"n": i, "pad": "x" * size})
+        for i in range(start, start + count)
+    ]
+
+
+class FakeThrottle:
+    def __init__(self):
+        self.calls = []
+
+    def slow_down(self):
+        self.calls.append("slow_down")
+
+    def speed_up(self):
+        self.calls.append("speed_up")
+
+
+def test_batcher_cuts_requests_by_docs_and_bytes():
+    batcher = BulkBatcher(max_docs=3, max_bytes=10 ** 6)
+    ready = batcher.add(docs(0, 7))
+    assert [len(offsets) for _, offsets, _ in ready] == [3, 3]
+    assert batcher.take()[0] == docs(6, 1)[0]
+    assert batcher.take() is None
+
+    doc_size = len(docs(0, 1, size=50)[0])
+    batcher = BulkBatcher(max_docs=100, max_bytes=doc_size * 2 + 1)
+    ready = batcher.add(docs(0, 5, size=50))
+    assert [len(offsets) for _, offsets, _ in ready] == [2, 2]
+
+
+def test_batcher_attaches_callbacks_to_last_request_with_the_batch():
+    batcher = BulkBatcher(max_docs=2, max_bytes=10 ** 6)
+    called = []
+
+    # Документы пачки ещё в буфере: обработчик ждёт следующего запроса
+    assert batcher.add(docs(0, 1), lambda: called.append("a")) == []
+    [(_, _, callbacks)] = batcher.add(docs(1, 1), lambda: called.append("b"))
+    assert len(callbacks) == 2
+
+    # Пачка целиком ушла в готовый запрос
+    [(_, _, callbacks)] = batcher.add(docs(2, 2), lambda: called.append("c"))
+    assert len(callbacks) == 1
+
+    # Пустая пачка присоединяется к последнему запросу в полёте...
+    batcher.pending.append(("task", []))
+    batcher.add([], lambda: called.append("d"))
+    assert len(batcher.pending[-1][1]) == 1
+    # ...а если в полёте ничего нет, вызывается сразу
+    batcher.pending.clear()
+    batcher.add([], lambda: called.append("e"))
+    assert called == ["e"]
+
+
+def test_handle_response_classifies_items():
+    body, offsets = join_documents(docs(0, 4))
+    result = {
+        "errors": True,
+        "items": [
+            {"index": {"_id": "0", "status": 201}},
+            {"index": {"_id": "1", "status": 429}},
+            {"index": {"_id": "2", "status": 400, "error": {"type": "mapper_parsing_exception"}}},
+            {"index": {"_id": "3", "status": 503}},
+        ],
+    }
+    throttle = FakeThrottle()
+    retry, failures = handle_response(result, body, offsets, throttle)
+    assert retry == [docs(1, 1)[0], docs(3, 1)[0]]
+    assert [(outcome["_id"], doc) for outcome, doc in failures] == [("2", docs(2, 1)[0])]
+    assert throttle.calls == ["slow_down"]
+
+    throttle = FakeThrottle()
+    assert handle_response({"errors": False, "items": []}, body, offsets, throttle) == ([], [])
+    assert throttle.calls == ["speed_up"]
+
+
+def test_join_documents_offsets():
+    parts = [b"a\n1\n", b"bb\n2\n", b"c\n3\n"]
+    assert join_documents(parts) == (b"".join(parts), [0, 4, 9])
+
+
+def test_rejected_documents_are_retried_until_deadline(fake_es, monkeypatch):
+    fake_es.item_retry_rate = 1.0
+    slept = []
+    # Паузы повторов и throttle не ждут, часы идут только во время пауз
+    monkeypatch.setattr(loader.time, "sleep", slept.append)
+    monkeypatch.setattr(loader.time, "monotonic", lambda: sum(slept))
+
+    with pytest.raises(DocumentsRejected):
+        with BulkLoader(url=fake_es.url) as bulk:
+            bulk.submit(docs(0, 3))
+
+    stats = fake_es.stats.snapshot()
+    assert stats["requests"] > 1 and stats["docs"] == 0
+    assert stats["failed_docs"] == 3 * stats["requests"]
+
+
+@pytest.fixture
+def flaky_es(fake_es):
+    fake_es.item_retry_rate = 0.01
+    fake_es.item_error_rate = 0.05
+    return fake_es
+
+
+def check_delivery(server, order, bulk, dead_letters_path):
+    """
+    Обработчики вызваны по порядку, каждый документ записан или в файле
+    недоставленных, а его _id — в bulk.rejected.
+    """
+    assert order == list(range(0, 300, 30))
+    rejected = []
+    if dead_letters_path.exists():
+        with open(dead_letters_path) as file:
+            rejected = [json.loads(line)["id"] for line in file]
+    assert len(rejected) == bulk.failed
+    assert bulk.rejected == set(rejected)
+    delivered = {doc_id for _, doc_id in server.stats.digests()}
+    assert delivered | set(rejected) == {str(i) for i in range(300)}
+    assert not delivered & set(rejected)
+
+
+def test_bulk_loader_delivers_in_order(flaky_es, tmp_path):
+    path = tmp_path / "dead.jsonl"
+    order = []
+    with BulkLoader(url=flaky_es.url, max_docs=50, dead_letters=DeadLetters(str(path))) as bulk:
+        for start in range(0, 300, 30):
+            bulk.submit(docs(start, 30), lambda start=start: order.append(start))
+    check_delivery(flaky_es, order, bulk, path)
+
+
+def test_async_bulk_loader_delivers_in_order(flaky_es, tmp_path):
+    aiohttp = pytest.importorskip("aiohttp")
+    from async_loader import AsyncBulkLoader
+
+    path = tmp_path / "dead.jsonl"
+    order = []
+
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            bulk = AsyncBulkLoader(
+                session, url=flaky_es.url, max_docs=50, dead_letters=DeadLetters(str(path))
+            )
+            async with bulk:
+                for start in range(0, 300, 30):
+                    await bulk.submit(docs(start, 30), lambda start=start: order.append(start))
+        return bulk
+
+    bulk = asyncio.run(run())
+    check_delivery(flaky_es, order, bulk, path)
@@ -0,0 +1,96 @@
+import hashlib
+import uuid
+
+import pytest
+
+import reconcile
+from reconcile import (
+    choose_depth,
+    es_summary,
+    mismatched_ranges,
+    prefix_bounds,
+    rollup,
+    row_hash,
+)
+
+
+def summary(rows, depth):
+    """Суммы по диапазонам так же, как их считают RECONCILE_SUMMARY_QUERY и es_summary."""
+    result = {}
+    for row_id, millis in rows.items():
+        count, hash_sum = result.get(row_id[:depth], (0, 0))
+        result[row_id[:depth]] = (count + 1, hash_sum + row_hash(row_id, millis))
+    return result
+
+
+@pytest.fixture
+def rows():
+    step = 0x0123456789ABCDEF0123456789ABCDEF
+    ids = [str(uuid.UUID(int=i * step % 2 ** 128)) for i in range(200)]
+    return {row_id: 1_700_000_000_000 + n for n, row_id in enumerate(ids)}
+
+
+def test_row_hash_matches_sql_formula():
+    row_id = "3fa85f64-5717-4562-b3fc-2c963f66afa6"
+    # ('x' || substr(md5(id || ':' || millis), 1, 15))::bit(60)::bigint
+    digest = hashlib.md5(f"{row_id}:1700000000000".encode()).hexdigest()
+    assert row_hash(row_id, 1_700_000_000_000) == int(digest[:15], 16)
+    assert row_hash(row_id, 1_700_000_000_000) < 2 ** 60
+    assert row_hash(row_id, None) == int(hashlib.md5(f"{row_id}:".encode()).hexdigest()[:15], 16)
+
+
+def test_prefix_bounds_cover_the_range():
+    low, high = prefix_bounds("3fa")
+    assert low == "3fa00000-0000-0000-0000-000000000000"
+    assert high == "3fafffff-ffff-ffff-ffff-ffffffffffff"
+    assert low <= "3fa85f64-5717-4562-b3fc-2c963f66afa6" <= high
+    assert not low <= "3fb00000-0000-0000-0000-000000000000" <= high
+
+
+def test_choose_depth():
+    assert choose_depth(0, range_rows=1000) == 1
+    assert choose_depth(16_000, range_rows=1000) == 1
+    assert choose_depth(16_001, range_rows=1000) == 2
+    assert choose_depth(10 ** 12, range_rows=1) == reconcile.MAX_DEPTH
+
+
+def test_rollup_adds_counts_and_hashes(rows):
+    assert rollup(summary(rows, 3), 1) == summary(rows, 1)
+    total = rollup(summary(rows, 2), 0)
+    assert total == {"": (len(rows), sum(row_hash(*item) for item in rows.items()))}
+
+
+def test_equal_sides_have_no_mismatches(rows):
+    assert mismatched_ranges(summary(rows, 2), summary(rows, 2), 2, "movies") == []
+
+
+def test_missing_stale_and_orphan_documents_are_found(rows):
+    ids = sorted(rows)
+    indexed = dict(rows)
+    del indexed[ids[0]]
+    indexed[ids[50]] += 1
+    indexed["ffffffff-0000-0000-0000-000000000000"] = 0
+
+    found = mismatched_ranges(summary(rows, 3), summary(indexed, 3), 3, "movies")
+    assert found == sorted({ids[0][:3], ids[50][:3], "fff"})
+
+
+def test_differences_cancelling_at_coarse_level_are_still_found(rows):
+    ids = sorted(rows)
+    first = ids[0]
+    second = next(row_id for row_id in ids if row_id[0] == first[0] and row_id[1] != first[1])
+    postgres = summary(rows, 2)
+    elastic = dict(postgres)
+    # Сдвиг суммы между двумя диапазонами одного префикса первого уровня
+    count, hash_sum = elastic[first[:2]]
+    elastic[first[:2]] = (count, hash_sum + 7)
+    count, hash_sum = elastic[second[:2]]
+    elastic[second[:2]] = (count, hash_sum - 7)
+    assert rollup(postgres, 1) == rollup(elastic, 1)
+
+    assert mismatched_ranges(postgres, elastic, 2, "movies") == sorted({first[:2], second[:2]})
+
+
+def test_es_summary_groups_hits_by_prefix(monkeypatch, rows):
+    monkeypatch.setattr(reconcile, "iter_es_hits", lambda alias, query: iter(rows.items()))
+    assert es_summary("movies", 2) == summary(rows, 2)
@@ -0,0 +1,102 @@
+import datetime
+import decimal
+import gzip
+import importlib.util
+import json
+import sys
+import uuid
+
+import pytest
+
+import serializer
+
+
+def _load_without_orjson():
+    """Копия модуля serializer с запасной реализацией на стандартном json."""
+    spec = importlib.util.spec_from_file_location("serializer_json", serializer.__file__)
+    module = importlib.util.module_from_spec(spec)
+    saved = sys.modules.get("orjson")
+    sys.modules["orjson"] = None
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        if saved is None:
+            del sys.modules["orjson"]
+        else:
+            sys.modules["orjson"] = saved
+    return module
+
+
+IMPLEMENTATIONS = [serializer, _load_without_orjson()]
+
+
+@pytest.fixture(params=IMPLEMENTATIONS, ids=lambda module: module.__name__)
+def module(request):
+    return request.param
+
+
+def test_fallback_does_not_use_orjson():
+    assert IMPLEMENTATIONS[1].orjson is None
+
+
+def test_dumps_converts_database_types(module):
+    row_id = uuid.UUID("3fa85f64-5717-4562-b3fc-2c963f66afa6")
+    value = {
+        "id": row_id,
+        "rating": decimal.Decimal("8.5"),
+        "updated_at": datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc),
+        "day": datetime.date(2024, 1, 2),
+        "title": "Фильм",
+    }
+    assert json.loads(module.dumps(value)) == {
+        "id": str(row_id),
+        "rating": 8.5,
+        "updated_at": "2024-01-02T03:04:05+00:00",
+        "day": "2024-01-02",
+        "title": "Фильм",
+    }
+
+
+def test_dumps_is_compact_bytes_without_ascii_escapes(module):
+    assert module.dumps({"a": [1, "б"]}) == '{"a":[1,"б"]}'.encode()
+
+
+def test_dumps_rejects_unknown_types(module):
+    with pytest.raises(TypeError):
+        module.dumps({"value": object()})
+
+
+def test_bulk_line_is_two_ndjson_lines():
+    line = serializer.bulk_line({"index": {"_id": "1"}}, {"title": "x"})
+    assert line == b'{"index":{"_id":"1"}}\n{"title":"x"}\n'
+
+
+def test_buffer_take_returns_offsets_and_resets():
+    buffer = serializer.NdjsonBuffer()
+    docs = [serializer.bulk_line({"index": {"_id": str(i)}}, {"n": i}) for i in range(3)]
+    for doc in docs:
+        buffer.append(doc)
+    assert len(buffer) == 3
+    assert buffer.size == sum(map(len, docs))
+
+    body, offsets = buffer.take()
+    assert body == b"".join(docs)
+    assert serializer.split_documents(body, offsets) == docs
+    assert len(buffer) == 0 and buffer.size == 0
+
+    # Буфер переиспользуется, а выданное тело не меняется
+    buffer.append(docs[0])
+    assert buffer.take() == (docs[0], [0])
+    assert body == b"".join(docs)
+
+
+def test_split_selected_documents():
+    docs = [b"a\n1\n", b"bb\n22\n", b"c\n3\n"]
+    body = b"".join(docs)
+    assert serializer.split_documents(body, [0, 4, 10]) == docs
+    assert serializer.split_documents(body, [4]) == [b"bb\n22\nc\n3\n"]
+
+
+def test_compress_is_gzip():
+    body = b'{"index":{}}\n{}\n' * 100
+    assert gzip.decompress(serializer.compress(body, 5)) == body
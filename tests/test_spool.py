@@ -0,0 +1,120 @@
+import functools
+import os
+
+import pytest
+
+import spool as spool_module
+from loader import BulkLoader
+from serializer import bulk_line
+from spool import Spool, drain
+
+
+def docs(start, count):
+    return [
+        bulk_line({"index": {"_id": str(i), "_index": "movies"}}, {"n": i})
+        for i in range(start, start + count)
+    ]
+
+
+@pytest.fixture
+def to_fake_es(monkeypatch, fake_es):
+    """Разгрузчик spool отправляет пачки в fake_es."""
+    monkeypatch.setattr(spool_module, "BulkLoader", functools.partial(BulkLoader, url=fake_es.url))
+    return fake_es
+
+
+def test_records_round_trip_with_fingerprints(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(docs(0, 2), [("movies", "0", b"\x01" * 8)])
+    spool.append(docs(2, 1))
+    [seq] = spool.segments()
+
+    records, offset = spool.read(seq, 0)
+    assert records == [
+        (docs(0, 2), [("movies", "0", b"\x01" * 8)]),
+        (docs(2, 1), []),
+    ]
+    assert offset == spool.total_bytes()
+    assert spool.read(seq, offset) == ([], offset)
+
+
+def test_torn_record_is_dropped_after_restart(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(docs(0, 2))
+    spool.close()
+    [name] = os.listdir(tmp_path)
+    path = tmp_path / name
+    complete = path.stat().st_size
+    # Падение посреди записи: заголовок и часть тела
+    with open(path, "ab") as file:
+        file.write(b'{"docs": 1, "size": 100, "fingerprints": []}\n{"index"')
+
+    restarted = Spool(str(tmp_path))
+    [seq] = restarted.segments()
+    records, offset = restarted.read(seq, 0)
+    assert records == [(docs(0, 2), [])]
+    assert offset == path.stat().st_size > complete
+    # Новые записи идут в новый сегмент
+    restarted.append(docs(2, 1))
+    assert len(restarted.segments()) == 2
+
+
+def test_partial_record_in_active_segment_is_not_visible(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(docs(0, 1))
+    [seq] = spool.segments()
+    # Чтение видит только подтверждённые fsync записи
+    with open(tmp_path / os.listdir(tmp_path)[0], "ab") as file:
+        file.write(b'{"docs": 1')
+    records, offset = spool.read(seq, 0)
+    assert len(records) == 1
+    assert offset == spool.total_bytes()
+
+
+def test_drain_sends_everything_and_removes_segments(tmp_path, to_fake_es):
+    spool = Spool(str(tmp_path), segment_bytes=200)
+    for start in range(0, 30, 3):
+        spool.append(docs(start, 3), [("movies", str(start), b"\x00" * 8)])
+    assert len(spool.segments()) > 1
+    saved = []
+
+    def save_fingerprints(fingerprints, rejected):
+        saved.extend(fingerprints)
+
+    sent = drain(spool, save_fingerprints=save_fingerprints)
+
+    assert sent == 30
+    assert to_fake_es.stats.snapshot()["unique_docs"] == 30
+    assert spool.segments() == [] and spool.total_bytes() == 0
+    assert sorted(doc_id for _, doc_id, _ in saved) == sorted(str(i) for i in range(0, 30, 3))
+
+
+def test_drain_passes_rejected_ids_to_save_fingerprints(tmp_path, to_fake_es):
+    to_fake_es.item_error_rate = 1.0
+    spool = Spool(str(tmp_path))
+    spool.append(docs(0, 3), [("movies", str(i), b"\x00" * 8) for i in range(3)])
+    calls = []
+
+    drain(spool, save_fingerprints=lambda fingerprints, rejected: calls.append(set(rejected)))
+
+    # Все документы отклонены с 400: их отпечатки сохранять нельзя
+    assert calls == [{"0", "1", "2"}]
+    assert to_fake_es.stats.snapshot()["unique_docs"] == 0
+
+
+def test_drain_without_stop_keeps_segment_written_concurrently(tmp_path, to_fake_es):
+    spool = Spool(str(tmp_path))
+    spool.append(docs(0, 2))
+    real_seal = spool.seal
+
+    def seal_then_append():
+        # Запись, пришедшая сразу после закрытия сегмента разгрузчиком
+        real_seal()
+        spool.seal = real_seal
+        spool.append(docs(2, 2))
+
+    spool.seal = seal_then_append
+    assert drain(spool) == 4
+    # Незакрытый сегмент отправлен, но остаётся: в него ещё пишут
+    assert len(spool.segments()) == 1
+    assert to_fake_es.stats.snapshot()["unique_docs"] == 4
@@ -0,0 +1,77 @@
+from tuning import HOLD, WINDOW, SizeController
+
+
+def controller(initial=100, minimum=10, maximum=1000, target=1.0):
+    return SizeController("test", "bulk", minimum, maximum, initial, target)
+
+
+def feed(ctrl, seconds, count, throttled=False):
+    """Одно окно одинаковых наблюдений."""
+    for _ in range(WINDOW):
+        ctrl.observe(seconds, count, throttled=throttled)
+
+
+def test_no_decision_before_window_is_full():
+    ctrl = controller()
+    for _ in range(WINDOW - 1):
+        ctrl.observe(0.1, 100)
+    assert ctrl.size == 100
+
+
+def test_increases_while_throughput_grows():
+    ctrl = controller()
+    feed(ctrl, 0.1, 100)
+    assert ctrl.size == 125
+    # Пропускная способность выросла больше чем на 5 %: растём дальше
+    feed(ctrl, 0.1, 125)
+    assert ctrl.size == 156
+
+
+def test_plateau_reverts_and_holds():
+    ctrl = controller()
+    feed(ctrl, 0.1, 100)
+    assert ctrl.size == 125
+    # Тот же поток записей при большем размере: возврат к прежнему размеру
+    feed(ctrl, 0.125, 125)
+    assert ctrl.size == 100
+    for _ in range(HOLD):
+        feed(ctrl, 0.1, 100)
+        assert ctrl.size == 100
+    feed(ctrl, 0.1, 100)
+    assert ctrl.size == 125
+
+
+def test_slow_operations_decrease_by_quarter():
+    ctrl = controller(target=0.5)
+    feed(ctrl, 1.0, 100)
+    assert ctrl.size == 75
+
+
+def test_throttling_halves_and_forgets_plateau():
+    ctrl = controller()
+    feed(ctrl, 0.1, 100)
+    feed(ctrl, 0.125, 125)
+    assert ctrl.hold == HOLD
+    ctrl.observe(0.1, 100)
+    ctrl.observe(0.1, 100, throttled=True)
+    ctrl.observe(0.1, 100)
+    ctrl.observe(0.1, 100)
+    assert ctrl.size == 50
+    assert ctrl.hold == 0 and ctrl.previous is None
+
+
+def test_size_stays_within_bounds():
+    ctrl = controller(initial=12, minimum=10, maximum=14)
+    feed(ctrl, 0.1, 12, throttled=True)
+    assert ctrl.size == 10
+    ctrl = controller(initial=12, minimum=10, maximum=14)
+    feed(ctrl, 0.1, 12)
+    assert ctrl.size == 14
+    # У максимума сравнивать не с чем: без отката на прежний размер
+    feed(ctrl, 0.1, 14)
+    assert ctrl.size == 14
+
+
+def test_initial_size_is_clamped():
+    assert controller(initial=5).size == 10
+    assert controller(initial=5000).size == 1000
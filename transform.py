@@ -0,0 +1,163 @@
+"""
+Преобразование строк Postgres в документы Elasticsearch.
+
+Документы индексов movies, genres и persons описаны декларативно: какое поле
+документа из какой колонки строки берётся и как приводится. Описание один раз
+компилируется в функцию строка -> документ. Персоны фильма раскладываются по
+ролям за один проход по data["persons"], сколько бы полей из них ни строилось.
+"""
+import time
+from datetime import datetime, timezone
+
+from config import index_name_film_work, index_name_genre, index_name_person
+from metrics import stage_seconds
+from serializer import bulk_line
+
+
+def column(name, convert=None):
+    """Поле документа из колонки строки; convert применяется к значению, отличному от None."""
+    return ("column", name, convert)
+
+
+def timestamp(value):
+    """
+    Время изменения строки в UTC.
+
+    Строка из COPY (см. copy_extract.py) разбирается в datetime. Время с часовым
+    поясом приводится к UTC: psycopg2 возвращает timestamptz в поясе сессии
+    (TimeZone), а asyncpg — в UTC, и документы не должны зависеть от драйвера.
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value
+
+
+def person_names(role):
+    """Список имён персон фильма в роли role."""
+    return ("persons", role, "names")
+
+
+def person_refs(role):
+    """Список {"id", "name"} персон фильма в роли role."""
+    return ("persons", role, "refs")
+
+
+MOVIES = {
+    "index": index_name_film_work,
+    "id": "id",
+    "fields": {
+        "id": column("id", str),
+        "imdb_rating": column("rating", float),
+        "genre": column("genres"),
+        "title": column("title"),
+        "description": column("description"),
+        "director": person_names("director"),
+        "actors_names": person_names("actor"),
+        "writers_names": person_names("writer"),
+        "actors": person_refs("actor"),
+        "writers": person_refs("writer"),
+        "updated_at": column("updated_at", timestamp),
+    },
+}
+
+GENRES = {
+    "index": index_name_genre,
+    "id": "id",
+    "fields": {
+        "id": column("id", str),
+        "name": column("name"),
+        "description": column("description"),
+        "updated_at": column("updated_at", timestamp),
+    },
+}
+
+PERSONS = {
+    "index": index_name_person,
+    "id": "id",
+    "fields": {
+        "id": column("id", str),
+        "full_name": column("full_name"),
+        "films": column("films"),
+        "updated_at": column("updated_at", timestamp),
+    },
+}
+
+
+def compile_schema(schema):
+    """
+    Компиляция описания индекса в функцию строка -> документ.
+
+    :param schema: словарь с ключами index, id (колонка _id) и fields
+    :return: функция, принимающая строку (DictRow или dict) и возвращающая документ
+    """
+    columns = []
+    person_fields = []
+    for field, (kind, source, option) in schema["fields"].items():
+        if kind == "column":
+            columns.append((field, source, option))
+        else:
+            person_fields.append((field, source, option == "refs"))
+    roles = {role for _, role, _ in person_fields}
+    # updated_at пишется последним: fingerprints.document_hash отрезает его от тела
+    trailing = [column for column in columns if column[0] == "updated_at"]
+    columns = [column for column in columns if column[0] != "updated_at"]
+
+    def fill(document, row, fields):
+        for field, source, convert in fields:
+            value = row[source]
+            if convert is not None and value is not None:
+                value = convert(value)
+            document[field] = value
+
+    def to_document(row):
+        document = {}
+        fill(document, row, columns)
+
+        if person_fields:
+            by_role = {role: [] for role in roles}
+            for person in row["persons"]:
+                bucket = by_role.get(person["person_role"])
+                if bucket is not None:
+                    bucket.append(person)
+            for field, role, refs in person_fields:
+                if refs:
+                    document[field] = [
+                        {"id": person["person_id"], "name": person["person_name"]}
+                        for person in by_role[role]
+                    ]
+                else:
+                    document[field] = [person["person_name"] for person in by_role[role]]
+        fill(document, row, trailing)
+        return document
+
+    return to_document
+
+
+def compile_bulk(schema):
+    """
+    Компиляция описания индекса в функцию строки -> документы _bulk.
+
+    Результат — список bytes, по одному на строку: действие index и документ в NDJSON.
+    Время построения документов и сериализации пишется в метрику etl_stage_seconds.
+    """
+    to_document = compile_schema(schema)
+    index = schema["index"]
+    id_column = schema["id"]
+
+    def to_bulk_data(rows):
+        started = time.perf_counter()
+        documents = [to_document(row) for row in rows]
+        transformed = time.perf_counter()
+        bulk_data = [
+            bulk_line({"index": {"_id": str(row[id_column]), "_index": index}}, document)
+            for row, document in zip(rows, documents)
+        ]
+        stage_seconds.observe(transformed - started, pipeline=index, stage="transform")
+        stage_seconds.observe(
+            time.perf_counter() - transformed, pipeline=index, stage="serialize"
+        )
+        return bulk_data
+
+    return to_bulk_data
@@ -0,0 +1,179 @@
+"""
+Адаптивный размер пачек: страниц чтения из Postgres и запросов _bulk.
+
+SizeController подбирает размер между заданными пределами по обратной связи.
+Наблюдения (время операции, число записей, байты, были ли отказы 429)
+собираются окнами по WINDOW штук, и после каждого окна принимается решение:
+
+- были отказы 429 — размер уменьшается вдвое, лучшая найденная
+  пропускная способность забывается (нагрузка на кластер изменилась);
+- среднее время операции выше целевого — размер уменьшается на четверть;
+- после прошлого увеличения пропускная способность (записей в секунду) не
+  выросла хотя бы на 5 % — возврат к прежнему размеру и пауза на HOLD окон:
+  дальше увеличивать бессмысленно, только растёт задержка;
+- иначе размер увеличивается на четверть.
+
+Получается AIMD с поиском точки насыщения: размер держится около максимума
+пропускной способности и отступает при первых признаках перегрузки ES.
+Решения логируются и экспортируются как метрики (см. metrics.py).
+"""
+import logging
+import threading
+
+from config import (
+    ADAPTIVE_BATCHING,
+    BATCH_SIZE,
+    BATCH_SIZE_MAX,
+    BATCH_SIZE_MIN,
+    BULK_DOCS_MAX,
+    BULK_DOCS_MIN,
+    BULK_MAX_DOCS,
+    BULK_TARGET_SECONDS,
+    QUERY_TARGET_SECONDS,
+)
+from metrics import Counter, Gauge
+
+# Число наблюдений в окне, по которому принимается решение
+WINDOW = 4
+# Сколько окон держать размер после отката с неудачного увеличения
+HOLD = 8
+
+INCREASE = 1.25
+DECREASE = 0.75
+THROTTLED_DECREASE = 0.5
+# Минимальный прирост пропускной способности, оправдывающий увеличение
+MIN_GAIN = 1.05
+
+batch_size_gauge = Gauge(
+    "etl_batch_size", "Текущий размер пачки", ("controller", "kind")
+)
+batch_latency_gauge = Gauge(
+    "etl_batch_latency_seconds",
+    "Среднее время операции с пачкой в последнем окне",
+    ("controller", "kind"),
+)
+batch_throughput_gauge = Gauge(
+    "etl_batch_throughput",
+    "Записей в секунду в последнем окне",
+    ("controller", "kind"),
+)
+batch_bytes_counter = Counter(
+    "etl_batch_bytes_total",
+    "Байт запросов и ответов, учтённых регулятором",
+    ("controller", "kind"),
+)
+batch_throttled_counter = Counter(
+    "etl_batch_throttled_total",
+    "Операций с отказом 429",
+    ("controller", "kind"),
+)
+batch_decisions_counter = Counter(
+    "etl_batch_size_decisions_total",
+    "Решения регулятора размера пачки",
+    ("controller", "kind", "decision"),
+)
+
+
+class SizeController:
+    """
+    Размер пачки между minimum и maximum, подстраиваемый по наблюдениям.
+
+    Потокобезопасен: наблюдения могут приходить из потоков загрузчика.
+    """
+
+    def __init__(self, name, kind, minimum, maximum, initial, target_latency):
+        self.name = name
+        self.kind = kind
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.size = min(max(initial, minimum), maximum)
+        self.lock = threading.Lock()
+        self.window = []
+        # Размер и пропускная способность до последнего увеличения
+        self.previous = None
+        self.hold = 0
+        batch_size_gauge.set(self.size, controller=name, kind=kind)
+
+    def observe(self, seconds, count, nbytes=0, throttled=False):
+        """
+        Наблюдение за одной операцией.
+
+        :param seconds: время запроса к Postgres или запроса _bulk
+        :param count: число записей в операции
+        :param nbytes: байты запроса и ответа
+        :param throttled: Elasticsearch ответил 429 на запрос или его часть
+        """
+        labels = {"controller": self.name, "kind": self.kind}
+        if nbytes:
+            batch_bytes_counter.inc(nbytes, **labels)
+        if throttled:
+            batch_throttled_counter.inc(**labels)
+        with self.lock:
+            self.window.append((seconds, count, throttled))
+            if len(self.window) < WINDOW:
+                return
+            window, self.window = self.window, []
+            self._decide(window, labels)
+
+    def _decide(self, window, labels):
+        total_seconds = sum(seconds for seconds, _, _ in window)
+        total_count = sum(count for _, count, _ in window)
+        latency = total_seconds / len(window)
+        throughput = total_count / total_seconds if total_seconds else 0.0
+        batch_latency_gauge.set(latency, **labels)
+        batch_throughput_gauge.set(throughput, **labels)
+
+        size = self.size
+        if any(throttled for _, _, throttled in window):
+            decision = "throttled"
+            size = self.size * THROTTLED_DECREASE
+            self.previous = None
+            self.hold = 0
+        elif latency > self.target_latency:
+            decision = "slow"
+            size = self.size * DECREASE
+            self.previous = None
+        elif self.previous is not None and throughput < self.previous[1] * MIN_GAIN:
+            decision = "plateau"
+            size = self.previous[0]
+            self.previous = None
+            self.hold = HOLD
+        elif self.hold:
+            decision = "hold"
+            self.hold -= 1
+        else:
+            decision = "increase"
+            self.previous = (self.size, throughput)
+            size = self.size * INCREASE
+
+        size = min(max(int(size), self.minimum), self.maximum)
+        batch_decisions_counter.inc(decision=decision, **labels)
+        if size != self.size:
+            logging.info(
+                f"Размер пачки {self.name}/{self.kind}: {self.size} -> {size} "
+                f"({decision}: {latency:.3f} с, {throughput:.0f} записей/с)"
+            )
+            self.size = size
+            batch_size_gauge.set(size, **labels)
+        elif decision == "increase":
+            # Упёрлись в maximum: сравнивать будет не с чем
+            self.previous = None
+
+
+def page_controller(name):
+    """Регулятор размера страницы чтения из Postgres или None, если он выключен."""
+    if not ADAPTIVE_BATCHING:
+        return None
+    return SizeController(
+        name, "page", BATCH_SIZE_MIN, BATCH_SIZE_MAX, BATCH_SIZE, QUERY_TARGET_SECONDS
+    )
+
+
+def bulk_controller(name):
+    """Регулятор числа документов в запросе _bulk или None, если он выключен."""
+    if not ADAPTIVE_BATCHING:
+        return None
+    return SizeController(
+        name, "bulk", BULK_DOCS_MIN, BULK_DOCS_MAX, BULK_MAX_DOCS, BULK_TARGET_SECONDS
+    )